@@ -3,15 +3,19 @@
 # DooPhynd - Duplicate Music File Finder
 
 import os
-import hashlib
 import threading
 import tkinter as tk
 from tkinter import filedialog, ttk, scrolledtext
-import mutagen
-from mutagen.easyid3 import EasyID3
-from mutagen.flac import FLAC
-from mutagen.mp4 import MP4
-import struct
+from fynd_cache import HashCache
+from fynd_hashers import default_hasher
+from fynd_state import ScanState
+from fynd_music import MusicScanner
+from fynd_updates import UpdateChannel
+from fynd_results import music_stores
+from fynd_tkviews import PagedResultsView
+
+# Saved folder tree for quick rescans, kept apart from the other finders' state
+STATE_PATH = os.path.join(os.path.expanduser("~"), ".doophynd_scan_state.db")
 
 class RetroTheme:
     """Theme colors and fonts for retro green screen look"""
@@ -77,6 +81,8 @@ class DooPhynd:
         self.use_metadata = tk.BooleanVar(value=True)
         self.use_hash = tk.BooleanVar(value=True)
         self.music_extensions_var = tk.BooleanVar(value=True)
+        self.quick_rescan = tk.BooleanVar(value=True)
+        self.fuzzy_metadata = tk.BooleanVar(value=False)
         
         # Configure checkbutton style
         check_frame1 = tk.Frame(options_frame, bg=RetroTheme.BG_COLOR)
@@ -115,6 +121,30 @@ class DooPhynd:
                                font=RetroTheme.FONT_FAMILY)
         check3.pack(anchor=tk.W)
         
+        check_frame4 = tk.Frame(options_frame, bg=RetroTheme.BG_COLOR)
+        check_frame4.pack(fill=tk.X, anchor=tk.W)
+        
+        check4 = tk.Checkbutton(check_frame4, text="QUICK RESCAN (CHANGED FOLDERS ONLY)", 
+                               variable=self.quick_rescan,
+                               bg=RetroTheme.BG_COLOR, fg=RetroTheme.TEXT_COLOR, 
+                               selectcolor=RetroTheme.BG_COLOR,
+                               activebackground=RetroTheme.BG_COLOR,
+                               activeforeground=RetroTheme.HIGHLIGHT_COLOR,
+                               font=RetroTheme.FONT_FAMILY)
+        check4.pack(anchor=tk.W)
+        
+        check_frame5 = tk.Frame(options_frame, bg=RetroTheme.BG_COLOR)
+        check_frame5.pack(fill=tk.X, anchor=tk.W)
+        
+        check5 = tk.Checkbutton(check_frame5, text="FUZZY METADATA MATCH (FEAT./REMASTER/PUNCTUATION)",
+                               variable=self.fuzzy_metadata,
+                               bg=RetroTheme.BG_COLOR, fg=RetroTheme.TEXT_COLOR,
+                               selectcolor=RetroTheme.BG_COLOR,
+                               activebackground=RetroTheme.BG_COLOR,
+                               activeforeground=RetroTheme.HIGHLIGHT_COLOR,
+                               font=RetroTheme.FONT_FAMILY)
+        check5.pack(anchor=tk.W)
+        
         # Search button
         button_frame = tk.Frame(main_frame, bg=RetroTheme.BG_COLOR)
         button_frame.pack(fill=tk.X, pady=10)
@@ -194,21 +224,16 @@ class DooPhynd:
         self.tab_content = tk.Frame(self.notebook, bg=RetroTheme.BG_COLOR, bd=1, relief="sunken")
         self.tab_content.pack(fill=tk.BOTH, expand=True, pady=2)
         
-        # Metadata content
+        # Metadata content, paged so only the groups on screen exist as widgets
+        headings = {"label": "GROUP", "files": "FILES", "size": "SIZE", "wasted": "WASTED"}
         self.metadata_frame = tk.Frame(self.tab_content, bg=RetroTheme.BG_COLOR)
-        self.metadata_text = scrolledtext.ScrolledText(self.metadata_frame, wrap=tk.WORD,
-                                                     bg=RetroTheme.BG_COLOR, fg=RetroTheme.TEXT_COLOR,
-                                                     insertbackground=RetroTheme.TEXT_COLOR,
-                                                     font=RetroTheme.FONT_FAMILY)
-        self.metadata_text.pack(fill=tk.BOTH, expand=True)
+        self.metadata_view = PagedResultsView(self.metadata_frame, headings=headings, style="Retro.Treeview")
+        self.metadata_view.pack(fill=tk.BOTH, expand=True)
         
         # Hash content
         self.hash_frame = tk.Frame(self.tab_content, bg=RetroTheme.BG_COLOR)
-        self.hash_text = scrolledtext.ScrolledText(self.hash_frame, wrap=tk.WORD,
-                                                 bg=RetroTheme.BG_COLOR, fg=RetroTheme.TEXT_COLOR,
-                                                 insertbackground=RetroTheme.TEXT_COLOR,
-                                                 font=RetroTheme.FONT_FAMILY)
-        self.hash_text.pack(fill=tk.BOTH, expand=True)
+        self.hash_view = PagedResultsView(self.hash_frame, headings=headings, style="Retro.Treeview")
+        self.hash_view.pack(fill=tk.BOTH, expand=True)
         
         # Error content
         self.error_frame = tk.Frame(self.tab_content, bg=RetroTheme.BG_COLOR)
@@ -237,7 +262,19 @@ class DooPhynd:
         self.files_processed = 0
         self.total_files = 0
         self.errors = []
-        self.music_extensions = ['.mp3', '.flac', '.m4a', '.mp4', '.wav', '.ogg', '.wma', '.aac']
+        self.hash_cache = HashCache()
+        self.scan_state = ScanState(STATE_PATH)
+        self.scanner = None
+        self.listing = False
+        self.pulse_step = 0
+        self.hardlinks = {}
+        self.hash_algorithm = default_hasher()
+        
+        # Scan threads post the latest status and progress here, one 20 Hz timer shows them
+        self.updates = UpdateChannel(self.root)
+        self.updates.register("status", self.status_var.set)
+        self.updates.register("progress", self.show_progress)
+        self.updates.start()
         
         # Add key bindings
         self.root.bind("<F1>", self.show_help)
@@ -249,6 +286,10 @@ class DooPhynd:
         style.configure("TFrame", background=RetroTheme.BG_COLOR)
         style.configure("TLabel", background=RetroTheme.BG_COLOR, foreground=RetroTheme.TEXT_COLOR)
         style.configure("TButton", background=RetroTheme.BG_COLOR, foreground=RetroTheme.TEXT_COLOR)
+        style.configure("Retro.Treeview", background=RetroTheme.BG_COLOR, foreground=RetroTheme.TEXT_COLOR,
+                        fieldbackground=RetroTheme.BG_COLOR, font=RetroTheme.FONT_FAMILY)
+        style.configure("Retro.Treeview.Heading", background=RetroTheme.BG_COLOR, foreground=RetroTheme.TEXT_COLOR,
+                        font=RetroTheme.FONT_FAMILY)
     
     def show_tab(self, tab_name):
         """Switch between tabs"""
@@ -277,89 +318,25 @@ class DooPhynd:
         """Update the custom progress bar based on progress_var"""
         progress = self.progress_var.get()
         width = int((self.progress_frame.winfo_width() - 2) * progress / 100)
+        self.progress_bar.pack_configure(padx=0)
         self.progress_bar.config(width=width)
         self.root.update_idletasks()
     
+    def pulse_progress_bar(self, step):
+        """Indeterminate progress: a short block sweeps across the bar while files are still being listed"""
+        if not self.listing:
+            return
+        span = max(self.progress_frame.winfo_width() - 2, 1)
+        block = max(span // 6, 1)
+        offset = (step * 8) % max(span - block, 1)
+        self.progress_bar.pack_configure(padx=(offset, 0))
+        self.progress_bar.config(width=block)
+    
     def browse_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
             self.folder_var.set(folder_path)
     
-    def is_music_file(self, file_path):
-        """Check if the file has a music extension."""
-        ext = os.path.splitext(file_path)[1].lower()
-        return ext in self.music_extensions
-    
-    def get_metadata(self, file_path):
-        try:
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext == ".mp3":
-                try:
-                    audio = EasyID3(file_path)
-                except mutagen.id3.ID3NoHeaderError:
-                    # Try to handle non-ID3 mp3 files
-                    self.log_error(f"No ID3 header in {file_path}")
-                    return None
-            elif ext == ".flac":
-                try:
-                    audio = FLAC(file_path)
-                except:
-                    self.log_error(f"Error reading FLAC file {file_path}")
-                    return None
-            elif ext == ".m4a" or ext == ".mp4":
-                try:
-                    audio = MP4(file_path)
-                except:
-                    self.log_error(f"Error reading MP4/M4A file {file_path}")
-                    return None
-            else:
-                return None
-            
-            # Different files might have different tag structures
-            try:
-                if ext == ".mp4" or ext == ".m4a":
-                    # MP4 has a different tag structure
-                    artist = audio.get('\xa9ART', ['Unknown'])[0]
-                    title = audio.get('\xa9nam', ['Unknown'])[0]
-                    album = audio.get('\xa9alb', ['Unknown'])[0]
-                else:
-                    # MP3, FLAC, etc
-                    artist = audio.get('artist', ['Unknown'])[0]
-                    title = audio.get('title', ['Unknown'])[0]
-                    album = audio.get('album', ['Unknown'])[0]
-            except (struct.error, IndexError) as e:
-                # Handle "unpack requires a buffer of 4 bytes" and similar errors
-                self.log_error(f"Error unpacking metadata in {file_path}: {e}")
-                return None
-                
-            return artist, title, album
-        except Exception as e:
-            self.log_error(f"Error processing {file_path}: {str(e)}")
-            return None
-    
-    def get_file_hash(self, file_path):
-        try:
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            
-            with open(file_path, 'rb') as f:
-                try:
-                    # Read first 1MB and last 1MB for large files
-                    # or the whole file for smaller files
-                    if file_size > 2*1024*1024:  # If larger than 2MB
-                        first_part = f.read(1024*1024)  # First MB
-                        f.seek(-1024*1024, 2)  # Seek to last MB
-                        last_part = f.read()
-                        return hashlib.md5(first_part + last_part).hexdigest()
-                    else:
-                        return hashlib.md5(f.read()).hexdigest()
-                except (struct.error, OSError) as e:
-                    self.log_error(f"Error reading file {file_path}: {e}")
-                    return None
-        except Exception as e:
-            self.log_error(f"Error hashing {file_path}: {str(e)}")
-            return None
-    
     def log_error(self, message):
         """Log an error message to be displayed later."""
         self.errors.append(message)
@@ -373,153 +350,111 @@ class DooPhynd:
             return
         
         # Clear previous results
-        self.metadata_text.delete(1.0, tk.END)
-        self.hash_text.delete(1.0, tk.END)
+        self.metadata_view.clear()
+        self.hash_view.clear()
         self.error_text.delete(1.0, tk.END)
-        self.errors = []
-        
-        # Count total files first (only music files if option is selected)
+        self.hash_cache.reset_counters()
+        
+        # Snapshot the options here, the scan thread must not read Tk variables
+        self.scanner = MusicScanner(use_metadata=self.use_metadata.get(), use_hash=self.use_hash.get(),
+                                    music_only=self.music_extensions_var.get(), cache=self.hash_cache,
+                                    state=self.scan_state if self.quick_rescan.get() else None,
+                                    hash_algorithm=self.hash_algorithm, progress=self.scan_progress,
+                                    fuzzy_metadata=self.fuzzy_metadata.get(), verify_files=True,
+                                    on_error=lambda message: self.update_status(f"ERROR: {message}"))
+        
+        # The scanner fills these in place while it runs
+        self.errors = self.scanner.errors
+        self.hardlinks = self.scanner.hardlinks
         self.total_files = 0
-        for root, _, files in os.walk(music_folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if not self.music_extensions_var.get() or self.is_music_file(file_path):
-                    self.total_files += 1
-        
-        if self.total_files == 0:
-            self.update_status("NO FILES TO PROCESS IN SELECTED DIRECTORY")
-            return
         
         # Disable search button during processing
         self.search_button.config(state=tk.DISABLED)
         self.progress_var.set(0)
         self.files_processed = 0
+        self.listing = True
         
         # Start search in a separate thread to keep UI responsive
         self.update_status("SCANNING FILES... PLEASE WAIT...")
         threading.Thread(target=self.find_duplicates, args=(music_folder,), daemon=True).start()
     
+    def scan_progress(self, done, total, file_path):
+        # Called from the scan threads after every file, only the latest value reaches the UI
+        self.updates.post("progress", (done, total, file_path))
+    
+    def show_progress(self, progress):
+        """Apply the latest scan progress, runs on the Tk thread; total stays 0 until the crawl is done"""
+        done, total, file_path = progress
+        if total == 0:
+            self.status_var.set(f"SCANNING: {os.path.basename(file_path)} ({done} FILES, STILL LISTING...)")
+            self.pulse_step += 1
+            self.pulse_progress_bar(self.pulse_step)
+            return
+        self.listing = False
+        self.status_var.set(f"SCANNING: {os.path.basename(file_path)} ({done}/{total})")
+        self.progress_var.set((done / total) * 100)
+    
+    def stop_listing(self):
+        self.listing = False
+        self.progress_var.set(0)
+    
     def find_duplicates(self, music_folder):
         self.metadata_duplicates = {}
         self.hash_duplicates = {}
         
         try:
-            for root, _, files in os.walk(music_folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    
-                    # Skip non-music files if option is enabled
-                    if self.music_extensions_var.get() and not self.is_music_file(file_path):
-                        continue
-                    
-                    self.update_status(f"SCANNING: {os.path.basename(file_path)}")
-                    
-                    if self.use_metadata.get():
-                        metadata = self.get_metadata(file_path)
-                        if metadata:
-                            key = (metadata[0].lower(), metadata[1].lower())  # (artist, title)
-                            if key in self.metadata_duplicates:
-                                self.metadata_duplicates[key].append(file_path)
-                            else:
-                                self.metadata_duplicates[key] = [file_path]
-                    
-                    if self.use_hash.get():
-                        file_hash = self.get_file_hash(file_path)
-                        if file_hash:
-                            if file_hash in self.hash_duplicates:
-                                self.hash_duplicates[file_hash].append(file_path)
-                            else:
-                                self.hash_duplicates[file_hash] = [file_path]
-                    
-                    # Update progress
-                    self.files_processed += 1
-                    progress = (self.files_processed / self.total_files) * 100
-                    self.progress_var.set(progress)
-        
-            # Filter out non-duplicates
-            self.metadata_duplicates = {k: v for k, v in self.metadata_duplicates.items() if len(v) > 1}
-            self.hash_duplicates = {k: v for k, v in self.hash_duplicates.items() if len(v) > 1}
+            # One crawl feeds the workers directly, a quick rescan only reads folders changed since the last scan
+            self.metadata_duplicates, self.hash_duplicates = self.scanner.scan(music_folder)
+            self.files_processed = self.scanner.files_processed
+            
+            if self.files_processed == 0:
+                self.updates.call(self.stop_listing)
+                self.updates.call(lambda: self.search_button.config(state=tk.NORMAL))
+                self.update_status("NO FILES TO PROCESS IN SELECTED DIRECTORY")
+                return
             
             # Display results
             self.display_results()
             
             # Re-enable search button
-            self.root.after(0, lambda: self.search_button.config(state=tk.NORMAL))
-            self.update_status(f"SCAN COMPLETE: {self.files_processed} FILES PROCESSED")
+            self.updates.call(lambda: self.search_button.config(state=tk.NORMAL))
+            rescan = f", RESCAN: {self.scanner.delta.summary().upper()}" if self.scanner.delta is not None else ""
+            self.update_status(f"SCAN COMPLETE: {self.files_processed} FILES PROCESSED "
+                               f"({self.hash_cache.summary().upper()}{rescan})")
         
         except Exception as e:
             self.log_error(f"CRITICAL ERROR: {str(e)}")
             # Re-enable search button
-            self.root.after(0, lambda: self.search_button.config(state=tk.NORMAL))
+            self.updates.call(lambda: self.search_button.config(state=tk.NORMAL))
             self.update_status("SCAN FAILED - CHECK ERROR LOG")
             self.display_results()  # Display any results collected so far
     
     def update_status(self, message):
-        self.root.after(0, lambda: self.status_var.set(message))
+        self.updates.post("status", message)
     
     def display_results(self):
-        def update_metadata_text():
-            if not self.metadata_duplicates:
-                self.metadata_text.insert(tk.END, "╔════════════════════════════════════════╗\n")
-                self.metadata_text.insert(tk.END, "║    NO METADATA-BASED DUPLICATES FOUND  ║\n")
-                self.metadata_text.insert(tk.END, "╚════════════════════════════════════════╝\n")
-                return
-            
-            self.metadata_text.insert(tk.END, "╔══════════════════════════════════════════════════════════════╗\n")
-            self.metadata_text.insert(tk.END, "║                METADATA-BASED DUPLICATES                     ║\n")
-            self.metadata_text.insert(tk.END, "╚══════════════════════════════════════════════════════════════╝\n\n")
-            
-            for i, (key, files) in enumerate(self.metadata_duplicates.items(), 1):
-                self.metadata_text.insert(tk.END, f"GROUP #{i}: ARTIST: '{key[0]}', TITLE: '{key[1]}'\n")
-                self.metadata_text.insert(tk.END, f"{'─' * 60}\n")
-                for j, f in enumerate(files, 1):
-                    self.metadata_text.insert(tk.END, f"  {j}. {f}\n") 
-                self.metadata_text.insert(tk.END, "\n")
-            
-            self.metadata_text.insert(tk.END, f"{'═' * 60}\n")
-            self.metadata_text.insert(tk.END, f"TOTAL DUPLICATE GROUPS: {len(self.metadata_duplicates)}\n")
-        
-        def update_hash_text():
-            if not self.hash_duplicates:
-                self.hash_text.insert(tk.END, "╔════════════════════════════════════════╗\n")
-                self.hash_text.insert(tk.END, "║    NO CONTENT-BASED DUPLICATES FOUND   ║\n")
-                self.hash_text.insert(tk.END, "╚════════════════════════════════════════╝\n")
-                return
-            
-            self.hash_text.insert(tk.END, "╔══════════════════════════════════════════════════════════════╗\n")
-            self.hash_text.insert(tk.END, "║                 CONTENT-BASED DUPLICATES                     ║\n")
-            self.hash_text.insert(tk.END, "╚══════════════════════════════════════════════════════════════╝\n\n")
-            
-            for i, (key, files) in enumerate(self.hash_duplicates.items(), 1):
-                self.hash_text.insert(tk.END, f"GROUP #{i}: FILES WITH IDENTICAL CONTENT\n")
-                self.hash_text.insert(tk.END, f"{'─' * 60}\n")
-                for j, f in enumerate(files, 1):
-                    self.hash_text.insert(tk.END, f"  {j}. {f}\n")
-                self.hash_text.insert(tk.END, "\n")
-            
-            self.hash_text.insert(tk.END, f"{'═' * 60}\n")
-            self.hash_text.insert(tk.END, f"TOTAL DUPLICATE GROUPS: {len(self.hash_duplicates)}\n")
-        
-        def update_error_text():
-            if not self.errors:
-                self.error_text.insert(tk.END, "╔════════════════════════════════════════╗\n")
-                self.error_text.insert(tk.END, "║        NO ERRORS DURING SCANNING       ║\n")
-                self.error_text.insert(tk.END, "╚════════════════════════════════════════╝\n")
-                return
-            
-            self.error_text.insert(tk.END, "╔══════════════════════════════════════════════════════════════╗\n")
-            self.error_text.insert(tk.END, "║                      ERROR LOG                               ║\n")
-            self.error_text.insert(tk.END, "╚══════════════════════════════════════════════════════════════╝\n\n")
-            
-            for i, error in enumerate(self.errors, 1):
-                self.error_text.insert(tk.END, f"ERROR #{i}: {error}\n")
-            
-            self.error_text.insert(tk.END, f"\n{'═' * 60}\n")
-            self.error_text.insert(tk.END, f"TOTAL ERRORS: {len(self.errors)}\n")
-        
-        self.root.after(0, update_metadata_text)
-        self.root.after(0, update_hash_text)
-        self.root.after(0, update_error_text)
+        # Stores are filled off the Tk thread, the views only draw the page on screen
+        sizes = self.scanner.file_sizes if self.scanner is not None else {}
+        metadata_store, hash_store = music_stores(self.metadata_duplicates, self.hash_duplicates,
+                                                  self.hardlinks, sizes)
+        if not self.errors:
+            error_report = ("╔════════════════════════════════════════╗\n"
+                            "║        NO ERRORS DURING SCANNING       ║\n"
+                            "╚════════════════════════════════════════╝\n")
+        else:
+            error_report = ("╔══════════════════════════════════════════════════════════════╗\n"
+                            "║                      ERROR LOG                               ║\n"
+                            "╚══════════════════════════════════════════════════════════════╝\n\n"
+                            + "".join(f"ERROR #{i}: {error}\n" for i, error in enumerate(self.errors, 1))
+                            + f"\n{'═' * 60}\nTOTAL ERRORS: {len(self.errors)}\n")
+        
+        def show():
+            self.metadata_view.show("NO METADATA-BASED DUPLICATES FOUND", metadata_store)
+            self.hash_view.show("NO CONTENT-BASED DUPLICATES FOUND", hash_store)
+            # One insert, not one per line
+            self.error_text.insert(tk.END, error_report)
+        
+        self.updates.call(show)
     
     def show_help(self, event=None):
         """Display help information in a new window"""
@@ -3,14 +3,132 @@
 
 import sys
 import os
-import hashlib
+import time
+import threading
 import pandas as pd
 from datetime import datetime
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QFileDialog, QTextEdit, QProgressBar, QStatusBar, QHBoxLayout, QGridLayout, QFrame, QInputDialog, QMessageBox
+    QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QFileDialog, QTextEdit, QProgressBar, QStatusBar, QHBoxLayout, QGridLayout, QFrame, QInputDialog, QMessageBox, QSpinBox, QComboBox, QCheckBox,
+    QTableView, QLineEdit, QHeaderView, QAbstractItemView
 )
 from PyQt6.QtGui import QFont, QIcon, QPixmap
-from PyQt6.QtCore import Qt, QSize
+from PyQt6.QtCore import Qt, QSize, QThread, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex
+from fynd_engine import DuplicateScanner, ScanCancelled, DEFAULT_WORKERS, format_stage_report, format_size
+from fynd_cache import HashCache
+from fynd_hashers import default_hasher, available_hashers
+from fynd_crawl import ExtensionFilter
+from fynd_state import ScanState
+from fynd_results import ResultStore
+
+class ScanWorker(QThread):
+    # Runs the directory walk and the duplicate engine off the GUI thread
+    progress = pyqtSignal(int, int, str)
+    scanFinished = pyqtSignal(list, list, dict, list, dict, str)  # (size, paths) groups, stage stats, cache counters, errors, hardlinks, rescan summary
+    scanCancelled = pyqtSignal()
+    
+    PROGRESS_INTERVAL = 0.05  # Seconds between progress signals
+    
+    def __init__(self, folderPath, includeTypes, excludeTypes, hashCache, workers, hashAlgorithm, scanState=None):
+        super().__init__()
+        self.folderPath = folderPath
+        self.includeTypes = includeTypes
+        self.excludeTypes = excludeTypes
+        self.hashCache = hashCache
+        self.workers = workers
+        self.hashAlgorithm = hashAlgorithm
+        self.scanState = scanState
+        self.cancelEvent = threading.Event()
+        self.lastProgress = 0.0
+    
+    def run(self):
+        # The crawler feeds the size stage directly, so the tree is walked once with one stat per file
+        fileFilter = ExtensionFilter(self.includeTypes, self.excludeTypes)
+        scanner = DuplicateScanner(progress=self.reportProgress, cache=self.hashCache,
+                                   workers=self.workers, cancel_event=self.cancelEvent,
+                                   full_hasher=self.hashAlgorithm)
+        try:
+            if self.scanState is not None:
+                # Quick rescan: only changed folders are listed and only affected groups recomputed;
+                # files are stat'ed too, a file rewritten in place doesn't change its folder's mtime
+                groups = scanner.scan_incremental(self.scanState, self.folderPath, fileFilter, verify_files=True)
+            else:
+                groups = scanner.scan_folder(self.folderPath, fileFilter)
+        except ScanCancelled:
+            self.hashCache.flush()
+            self.scanCancelled.emit()
+            return
+        self.hashCache.flush()
+        rescanSummary = scanner.delta.summary() if scanner.delta is not None else ""
+        # Every file in a group has the same size, the results table needs it for the wasted bytes
+        sizedGroups = [(scanner.file_stats[group[0]].size, group) for group in groups]
+        self.scanFinished.emit(sizedGroups, scanner.stats, scanner.cache_counters(), scanner.errors, scanner.hardlinks,
+                               rescanSummary)
+    
+    def reportProgress(self, done, total, stage_name):
+        # Throttle signals so a fast scan can't flood the GUI event loop
+        now = time.monotonic()
+        if done == total or now - self.lastProgress >= self.PROGRESS_INTERVAL:
+            self.lastProgress = now
+            self.progress.emit(done, total, stage_name)
+    
+    def cancel(self):
+        self.cancelEvent.set()
+
+class DuplicateTableModel(QAbstractTableModel):
+    # Table over a ResultStore; the view only asks for the rows on screen, sorting and filtering reorder indices
+    COLUMNS = [("group", "#"), ("files", "Files"), ("size", "Size"), ("wasted", "Wasted"), ("label", "First file")]
+    
+    def __init__(self, store=None):
+        super().__init__()
+        self.store = store if store is not None else ResultStore()
+    
+    def setStore(self, store):
+        self.beginResetModel()
+        self.store = store
+        self.store.refresh()
+        self.endResetModel()
+    
+    def setFilter(self, text):
+        self.beginResetModel()
+        self.store.set_filter(text)
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        group = self.store[index.row()]
+        column = self.COLUMNS[index.column()][0]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == "group":
+                return group.number
+            if column == "files":
+                return len(group.paths)
+            if column == "size":
+                return format_size(group.size)
+            if column == "wasted":
+                return format_size(group.wasted)
+            return group.label
+        if role == Qt.ItemDataRole.ToolTipRole and column == "label":
+            return "\n".join(group.paths)
+        if role == Qt.ItemDataRole.TextAlignmentRole and column != "label":
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.COLUMNS[section][1]
+        return None
+    
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.store.sort(self.COLUMNS[column][0], reverse=order == Qt.SortOrder.DescendingOrder)
+        self.layoutChanged.emit()
 
 class DupliFynder(QWidget):
     def __init__(self):
@@ -24,6 +142,8 @@ class DupliFynder(QWidget):
         self.setStyleSheet("background-color: #1d1d1f; color: white;")
         
         layout = QVBoxLayout()
+        self.fileTypeButtons = {}
+        self.fileTypeLayouts = {}
         
         # Directory selection section
         self.label = QLabel("Select a directory to scan for duplicate files:")
@@ -75,6 +195,34 @@ class DupliFynder(QWidget):
         self.scanButton.clicked.connect(self.scanDuplicates)
         layout.addWidget(self.scanButton)
         
+        # Worker count and cancel section
+        workerLayout = QHBoxLayout()
+        self.workerLabel = QLabel("Hash workers:")
+        self.workerLabel.setFont(QFont("Arial", 9, QFont.Weight.Bold))
+        workerLayout.addWidget(self.workerLabel)
+        self.workerSpin = QSpinBox()
+        self.workerSpin.setRange(1, 128)
+        self.workerSpin.setValue(DEFAULT_WORKERS)
+        workerLayout.addWidget(self.workerSpin)
+        self.hashLabel = QLabel("Hash:")
+        self.hashLabel.setFont(QFont("Arial", 9, QFont.Weight.Bold))
+        workerLayout.addWidget(self.hashLabel)
+        self.hashCombo = QComboBox()
+        self.hashCombo.addItems(available_hashers(safe_only=True))
+        self.hashCombo.setCurrentText(default_hasher())
+        workerLayout.addWidget(self.hashCombo)
+        self.quickRescanCheck = QCheckBox("Quick rescan")
+        self.quickRescanCheck.setToolTip("Only list folders that changed since the last scan of this folder, files are still checked for changes")
+        self.quickRescanCheck.setChecked(True)
+        workerLayout.addWidget(self.quickRescanCheck)
+        self.cancelButton = QPushButton("Cancel Scan")
+        self.cancelButton.setFont(QFont("Arial", 9, QFont.Weight.Bold))
+        self.cancelButton.setStyleSheet("background-color: #5d3939; color: white; padding: 9px; border: 2px solid #4b2e2e; border-radius: 5px;")
+        self.cancelButton.clicked.connect(self.cancelScan)
+        self.cancelButton.setEnabled(False)
+        workerLayout.addWidget(self.cancelButton)
+        layout.addLayout(workerLayout)
+        
         # Tag message
         self.tagMessage = QLabel("*if no file types are selected, then all duplicates will be found!")
         tagFont = QFont("Arial", 9)  # 10% smaller
@@ -89,9 +237,33 @@ class DupliFynder(QWidget):
         self.progressBar.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.progressBar)
         
-        # Results display section
+        # Results table, only the visible rows are ever rendered
+        self.filterEdit = QLineEdit()
+        self.filterEdit.setPlaceholderText("Filter groups by path...")
+        self.filterEdit.setStyleSheet("background-color: #34495E; color: white; border: 2px solid #3498DB; border-radius: 5px; padding: 3px;")
+        self.filterTimer = QTimer(self)
+        self.filterTimer.setSingleShot(True)
+        self.filterTimer.setInterval(250)
+        self.filterTimer.timeout.connect(lambda: self.resultModel.setFilter(self.filterEdit.text()))
+        self.filterEdit.textChanged.connect(self.filterTimer.start)
+        layout.addWidget(self.filterEdit)
+        
+        self.resultModel = DuplicateTableModel()
+        self.resultTable = QTableView()
+        self.resultTable.setModel(self.resultModel)
+        self.resultTable.setSortingEnabled(True)
+        self.resultTable.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.resultTable.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.resultTable.verticalHeader().setVisible(False)
+        self.resultTable.horizontalHeader().setSectionResizeMode(len(DuplicateTableModel.COLUMNS) - 1, QHeaderView.ResizeMode.Stretch)
+        self.resultTable.setStyleSheet("background-color: #34495E; color: white; border: 2px solid #3498DB; border-radius: 5px;")
+        self.resultTable.selectionModel().currentRowChanged.connect(self.showGroupDetails)
+        layout.addWidget(self.resultTable)
+        
+        # Selected group, hardlinks, stage report and errors
         self.resultText = QTextEdit()
         self.resultText.setReadOnly(True)
+        self.resultText.setMaximumHeight(160)
         self.resultText.setStyleSheet("background-color: #34495E; color: white; border: 2px solid #3498DB; border-radius: 5px;")
         layout.addWidget(self.resultText)
         
@@ -112,6 +284,16 @@ class DupliFynder(QWidget):
         
         self.folderPath = ""
         self.duplicates = []
+        self.reportText = ""
+        self.stageStats = []
+        self.bytesRead = 0
+        self.cacheCounters = {"cache_hits": 0, "cache_misses": 0}
+        self.hashCache = HashCache()
+        self.scanState = ScanState()
+        self.rescanSummary = ""
+        self.scanWorker = None
+        self.scanErrors = []
+        self.hardlinks = {}
         self.searchEntireDir = False
     
     def addFileTypeButtons(self, layout, mode):
@@ -163,6 +345,8 @@ class DupliFynder(QWidget):
                 row += 1
         
         layout.addLayout(self.fileTypeLayout)
+        self.fileTypeButtons[mode] = self.fileTypes
+        self.fileTypeLayouts[mode] = self.fileTypeLayout
     
     def toggleButton(self, button, mode):
         # Toggle button style on selection
@@ -183,7 +367,9 @@ class DupliFynder(QWidget):
         if ok and text:
             if not text.startswith('.'):
                 text = '.' + text
-            if text not in self.fileTypes:
+            fileTypes = self.fileTypeButtons[mode]
+            fileTypeLayout = self.fileTypeLayouts[mode]
+            if text not in fileTypes:
                 button = QPushButton(text)
                 button.setCheckable(True)
                 button.setFont(QFont("Arial", 9, QFont.Weight.Bold))  # 10% smaller
@@ -193,13 +379,13 @@ class DupliFynder(QWidget):
                 else:
                     button.setStyleSheet("background-color: #5d3939; color: white; padding: 4.41px; border: 2px solid #4b2e2e; border-radius: 5px;")  # 12% smaller padding
                     button.clicked.connect(lambda checked, btn=button: self.toggleButton(btn, "Exclude"))
-                self.fileTypes[text] = button
-                row = self.fileTypeLayout.rowCount()
-                col = self.fileTypeLayout.columnCount()
+                fileTypes[text] = button
+                row = fileTypeLayout.rowCount()
+                col = fileTypeLayout.columnCount()
                 if col == 6:
                     col = 0
                     row += 1
-                self.fileTypeLayout.addWidget(button, row, col)
+                fileTypeLayout.addWidget(button, row, col)
     
     def selectFolder(self):
         # Select folder dialog
@@ -214,72 +400,119 @@ class DupliFynder(QWidget):
             self.resultText.setText("Please select a folder first.")
             return
         
-        file_hashes = {}
-        self.duplicates = []
-        
-        file_list = []
-        for root, _, files in os.walk(self.folderPath):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if not self.is_excluded_file(file) and self.is_included_file(file):
-                    file_list.append(file_path)
-        
-        total_files = len(file_list)
-        self.progressBar.setMaximum(total_files)
-        
-        for idx, file_path in enumerate(file_list, 1):
-            file_hash = self.hash_file(file_path)
-            if file_hash in file_hashes:
-                file_hashes[file_hash].append(file_path)
-            else:
-                file_hashes[file_hash] = [file_path]
-            self.progressBar.setValue(idx)
-            self.statusBar.showMessage(f"Scanning file {idx} of {total_files}")
+        if self.scanWorker and self.scanWorker.isRunning():
+            return
         
-        for paths in file_hashes.values():
-            if len(paths) > 1:
-                self.duplicates.append(paths)
+        self.duplicates = []
+        self.resultModel.setStore(ResultStore())
+        self.exportButton.setEnabled(False)
+        self.progressBar.setValue(0)
+        self.statusBar.showMessage("Scanning...")
         
+        # Size -> head/tail sample -> full hash, only colliding files reach the next stage
+        self.hashCache.reset_counters()
+        self.scanWorker = ScanWorker(self.folderPath, self.checkedTypes("Include"), self.checkedTypes("Exclude"),
+                                     self.hashCache, self.workerSpin.value(), self.hashCombo.currentText(),
+                                     self.scanState if self.quickRescanCheck.isChecked() else None)
+        self.scanWorker.progress.connect(self.updateScanProgress)
+        self.scanWorker.scanFinished.connect(self.scanFinished)
+        self.scanWorker.scanCancelled.connect(self.scanCancelled)
+        self.scanButton.setEnabled(False)
+        self.cancelButton.setEnabled(True)
+        self.scanWorker.start()
+    
+    def cancelScan(self):
+        # Ask the running scan to stop
+        if self.scanWorker and self.scanWorker.isRunning():
+            self.scanWorker.cancel()
+            self.statusBar.showMessage("Cancelling scan...")
+    
+    def scanFinished(self, groups, stageStats, cacheCounters, errors, hardlinks, rescanSummary):
+        # Collect results from the worker thread
+        self.duplicates = [paths for _, paths in groups]
+        self.rescanSummary = rescanSummary
+        self.hardlinks = hardlinks
+        store = ResultStore()
+        for size, paths in groups:
+            store.add("content", paths[0], paths, [size] * len(paths),
+                      {file: hardlinks[file] for file in paths if file in hardlinks})
+        self.resultModel.setStore(store)
+        self.stageStats = stageStats
+        self.bytesRead = sum(stats.bytes_read for stats in stageStats)
+        self.cacheCounters = cacheCounters
+        self.scanErrors = errors
+        self.scanButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
         self.displayResults()
     
-    def hash_file(self, file_path, chunk_size=8192):
-        # Generate hash for a file
-        hasher = hashlib.md5()
-        try:
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(chunk_size):
-                    hasher.update(chunk)
-        except Exception as e:
-            return None
-        return hasher.hexdigest()
+    def scanCancelled(self):
+        # Reset the UI after a cancelled scan
+        self.scanButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+        self.progressBar.setValue(0)
+        self.statusBar.showMessage("Scan cancelled.")
     
-    def is_excluded_file(self, filename):
-        # Check if file is excluded based on selected file types
-        for ext, button in self.fileTypes.items():
-            if filename.lower().endswith(ext) and button.isChecked():
-                return True
-        return False
+    def updateScanProgress(self, done, total, stage_name):
+        # Update progress bar and status bar while the engine runs, a total of 0 means still crawling
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        if total:
+            self.statusBar.showMessage(f"{stage_name.capitalize()} stage: file {done} of {total}")
+        else:
+            self.statusBar.showMessage(f"{stage_name.capitalize()} stage: {done} files found")
     
-    def is_included_file(self, filename):
-        # Check if file is included based on selected file types
-        for ext, button in self.fileTypes.items():
-            if filename.lower().endswith(ext) and button.isChecked():
-                return True
-        return False
+    def checkedTypes(self, mode):
+        # Snapshot of the checked extensions, safe to hand to the worker thread
+        return tuple(ext.lower() for ext, button in self.fileTypeButtons[mode].items() if button.isChecked())
     
     def displayResults(self):
-        # Display scan results
+        # The table shows the groups, the text below keeps the hardlinks, stage report and errors
+        self.reportText = self.hardlinkReport() + "Scan stages:\n" + format_stage_report(self.stageStats) + "\n"
+        if self.scanErrors:
+            self.reportText += f"\n{len(self.scanErrors)} files could not be read:\n" + "\n".join(self.scanErrors) + "\n"
         if not self.duplicates:
-            self.resultText.setText("No duplicates found.")
-            self.statusBar.showMessage("Scan complete. No duplicates found.")
+            self.resultText.setText("No duplicates found.\n\n" + self.reportText)
+            self.statusBar.showMessage(f"Scan complete. No duplicates found. {self.scanSummary()}")
             return
         
-        result_str = "Duplicate Files Found:\n\n"
-        for group in self.duplicates:
-            result_str += "\n".join(group) + "\n\n"
-        self.resultText.setText(result_str)
+        # Largest reclaimable groups first
+        self.resultTable.sortByColumn(3, Qt.SortOrder.DescendingOrder)
+        self.resultText.setText(f"{len(self.duplicates)} duplicate groups, "
+                                f"{format_size(self.resultModel.store.wasted_bytes())} reclaimable. "
+                                "Select a group to list its files.\n\n" + self.reportText)
         self.exportButton.setEnabled(True)
-        self.statusBar.showMessage("Scan complete. Duplicates found.")
+        self.statusBar.showMessage(f"Scan complete. Duplicates found. {self.scanSummary()}")
+    
+    def showGroupDetails(self, current, previous):
+        # Files of the selected group only, rendered on demand
+        if not current.isValid():
+            return
+        group = self.resultModel.store[current.row()]
+        details = f"Group {group.number}: {len(group.paths)} files of {format_size(group.size)}, {format_size(group.wasted)} reclaimable\n\n"
+        for file in group.paths:
+            details += file + "\n"
+            for link in group.hardlinks.get(file, []):
+                details += f"    (hardlink of above) {link}\n"
+        self.resultText.setText(details + "\n" + self.reportText)
+    
+    def hardlinkReport(self):
+        # Files that are only hardlinks of each other share their data, so there is nothing to reclaim
+        grouped = {file for group in self.duplicates for file in group}
+        linkSets = [[file] + links for file, links in self.hardlinks.items() if file not in grouped]
+        if not linkSets:
+            return ""
+        report = "Hardlinked files (same data on disk, nothing to reclaim):\n\n"
+        for linkSet in linkSets:
+            report += "\n".join(linkSet) + "\n\n"
+        return report
+    
+    def scanSummary(self):
+        # Bytes read and cache counters for the last scan
+        summary = (f"{format_size(self.bytesRead)} read, cache: {self.cacheCounters['cache_hits']} hits / "
+                   f"{self.cacheCounters['cache_misses']} misses")
+        if self.rescanSummary:
+            summary += f", rescan: {self.rescanSummary}"
+        return summary
     
     def exportReport(self):
         # Export scan results to various formats
@@ -288,15 +521,20 @@ class DupliFynder(QWidget):
 
         data = []
         for idx, group in enumerate(self.duplicates, 1):
-            for file in group:
+            rows = [(file, "copy") for file in group]
+            rows += [(link, "hardlink") for file in group for link in self.hardlinks.get(file, [])]
+            for file, kind in rows:
                 file_stats = os.stat(file)
                 data.append({
                     "Group": f"Group {idx}",
+                    "Kind": kind,
                     "Path": file,
                     "Name": os.path.basename(file),
                     "Type": os.path.splitext(file)[1],
                     "Size (bytes)": file_stats.st_size,
                     "Timestamp": datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+                    "Cache Hits": self.cacheCounters["cache_hits"],
+                    "Cache Misses": self.cacheCounters["cache_misses"],
                 })
 
         df = pd.DataFrame(data)
@@ -317,6 +555,15 @@ class DupliFynder(QWidget):
             elif selected_filter == "OpenDocument Spreadsheet (*.ods)":
                 df.to_excel(save_path, index=False, engine='odf')
 
+    def closeEvent(self, event):
+        # Stop a running scan before the window goes away
+        if self.scanWorker and self.scanWorker.isRunning():
+            self.scanWorker.cancel()
+            self.scanWorker.wait()
+        self.hashCache.close()
+        self.scanState.close()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = DupliFynder()
@@ -1,13 +1,36 @@
 #backupperer
+#Scheduled backups of files and folders to a (USB) destination.
+#"full" mode copies every source into a new backup_<timestamp> folder.
+#"incremental" mode keeps a manifest of the last backup on the destination
+#(see backup_manifest) and puts only new or changed files in the new folder.
+#"snapshot" mode works like rsync --link-dest: changed files are copied and
+#unchanged ones hardlinked to the previous snapshot, so every folder is a
+#complete tree but only costs the delta. Destinations without hardlinks
+#(FAT32, exFAT) fall back to incremental mode.
+#"chunks" mode stores every backup in a deduplicated chunk store (see
+#backup_chunks): large files that changed a little only add their changed
+#chunks, and identical files are stored once.
+#"archive" mode writes one compressed backup_<timestamp>.bka per run (see
+#backup_archive), compressed in parallel, with an index to restore single files.
+#Files are copied by backup_copy's thread pool, with kernel-side copies where
+#the OS offers them and a cap on parallel writes per destination device.
 
 import os
-import shutil
 import time
 import schedule
 import logging
 from datetime import datetime
 import platform
 import psutil
+from backup_manifest import BackupManifest, MANIFEST_NAME, walk_sources
+from backup_copy import CopyEngine, DEFAULT_COPY_WORKERS, DEFAULT_DEVICE_LIMIT
+from backup_chunks import ChunkStore
+from backup_archive import write_archive, ARCHIVE_EXTENSION, CODECS
+from fynd_hashers import hash_file
+
+BACKUP_MODES = ("full", "incremental", "snapshot", "chunks", "archive")
+CHUNK_STORE_NAME = "chunkstore"     # Folder of the chunk store in the destination
+LAST_SNAPSHOT = "last_snapshot"     # Manifest key of the newest complete snapshot folder
 
 # Configure logging
 logging.basicConfig(
@@ -20,7 +43,9 @@ logging.basicConfig(
 )
 
 class BackupManager:
-    def __init__(self, source_paths, backup_destination, interval_hours=24, is_usb=True):
+    def __init__(self, source_paths, backup_destination, interval_hours=24, is_usb=True, mode="full",
+                 checksum=None, workers=DEFAULT_COPY_WORKERS, device_limit=DEFAULT_DEVICE_LIMIT,
+                 archive_codec="zlib"):
         """
         Initialize the backup manager
         
@@ -29,11 +54,28 @@ class BackupManager:
             backup_destination (str): Path to backup destination
             interval_hours (int): Backup interval in hours
             is_usb (bool): Whether the destination is a USB drive
+            mode (str): "full" copies everything each time, "incremental" only new or changed files,
+                "snapshot" complete trees with unchanged files hardlinked to the previous snapshot,
+                "chunks" a deduplicated chunk store where only new chunks are written,
+                "archive" one compressed archive file per backup
+            checksum (str): Hasher name (see fynd_hashers) to store digests in incremental mode;
+                a file whose mtime changed but whose digest did not is then not copied again
+            workers (int): Threads copying files
+            device_limit (int): Copies writing to the same destination device at once, keep it low for USB sticks
+            archive_codec (str): "zlib", "lzma" or "bz2" for archive mode
         """
+        if mode not in BACKUP_MODES:
+            raise ValueError(f"Unknown backup mode '{mode}', use one of {', '.join(BACKUP_MODES)}")
+        if archive_codec not in CODECS:
+            raise ValueError(f"Unknown archive codec '{archive_codec}', use one of {', '.join(CODECS)}")
         self.source_paths = source_paths
         self.backup_destination = backup_destination
         self.interval_hours = interval_hours
         self.is_usb = is_usb
+        self.mode = mode
+        self.checksum = checksum
+        self.copy_engine = CopyEngine(workers, device_limit)
+        self.archive_codec = archive_codec
         
     def is_destination_available(self):
         """Check if backup destination is available"""
@@ -89,32 +131,183 @@ class BackupManager:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_folder = os.path.join(self.backup_destination, f"backup_{timestamp}")
         
+        if self.mode == "snapshot" and not self.destination_supports_hardlinks():
+            logging.warning(f"{self.backup_destination} doesn't support hardlinks (FAT32/exFAT?), "
+                            f"making an incremental backup instead of a snapshot")
+            return self.perform_incremental_backup(backup_folder)
+        if self.mode in ("incremental", "snapshot"):
+            return self.perform_incremental_backup(backup_folder, snapshot=self.mode == "snapshot")
+        if self.mode == "chunks":
+            return self.perform_chunk_backup(os.path.basename(backup_folder))
+        if self.mode == "archive":
+            return self.perform_archive_backup(backup_folder + ARCHIVE_EXTENSION)
+        
         try:
             # Create backup directory
             os.makedirs(backup_folder, exist_ok=True)
             
-            # Copy each source to the backup folder
+            # Collect every file of every source, then copy them all in parallel
+            errors = []
+            jobs = []
+            folders = []    # Recreated even when empty, like copytree does
+            target = lambda name: os.path.join(backup_folder, *name.split("/"))
             for source_path in self.source_paths:
                 if not os.path.exists(source_path):
                     logging.warning(f"Source path {source_path} does not exist, skipping")
                     continue
-                
-                filename = os.path.basename(source_path)
-                destination = os.path.join(backup_folder, filename)
-                
-                if os.path.isdir(source_path):
-                    shutil.copytree(source_path, destination)
-                    logging.info(f"Backed up directory {source_path} to {destination}")
-                else:
-                    shutil.copy2(source_path, destination)
-                    logging.info(f"Backed up file {source_path} to {destination}")
+                for name, source, record in walk_sources([source_path], errors, folders):
+                    jobs.append((source, target(name)))
+            for message in errors:
+                logging.warning(message)
+            
+            stats = self.copy_engine.copy_files(jobs, [target(name) for name in folders])
+            for source, message in stats.failed.items():
+                logging.error(f"Failed to back up {source}: {message}")
+            logging.info(f"Backed up {stats.summary()}")
             
+            if stats.failed or errors:
+                logging.warning(f"Backup to {backup_folder} is incomplete")
+                return False
             logging.info(f"Backup completed successfully to {backup_folder}")
             return True
         except Exception as e:
             logging.error(f"Backup failed: {str(e)}")
             return False
     
+    def destination_supports_hardlinks(self):
+        """Probe the destination with a real hardlink, FAT32/exFAT and some network shares refuse them"""
+        source = os.path.join(self.backup_destination, ".link_test")
+        target = source + "2"
+        try:
+            with open(source, 'w') as f:
+                f.write("test")
+            os.link(source, target)
+            return os.stat(source).st_nlink == 2
+        except OSError:
+            return False
+        finally:
+            for path in (target, source):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def perform_incremental_backup(self, backup_folder, snapshot=False):
+        """
+        Copy only files that are new or changed since the manifest was last written
+        
+        With snapshot=True the unchanged files are hardlinked from the last snapshot as well,
+        so backup_folder is a complete tree that only cost the changed files.
+        """
+        manifest = BackupManifest(os.path.join(self.backup_destination, MANIFEST_NAME))
+        plan = None
+        finished = False
+        copied = []
+        errors = []
+        try:
+            start = time.perf_counter()
+            previous = manifest.get_value(LAST_SNAPSHOT) if snapshot else None
+            if previous and not os.path.isdir(os.path.join(self.backup_destination, previous)):
+                logging.warning(f"Last snapshot {previous} is gone, starting a new full snapshot")
+                previous = None
+            # Without a snapshot to link from every file is copied, whatever the manifest says
+            entries = {} if snapshot and not previous else None
+            plan = manifest.plan(self.source_paths, errors, checksum=self.checksum, entries=entries,
+                                 keep_unchanged=snapshot)
+            for message in errors:
+                logging.warning(message)
+            logging.info(f"Incremental check took {time.perf_counter() - start:.1f}s: {plan.summary()}")
+            if plan.is_empty():
+                logging.info("Nothing changed since the last backup")
+                return True
+            
+            target = lambda name: os.path.join(backup_folder, *name.split("/"))
+            # plan.folders is only filled for snapshots, which are complete trees including empty folders
+            stats = self.copy_engine.copy_files(((source, target(name)) for name, source, record in plan.copy),
+                                                [target(name) for name in plan.folders])
+            for name, source, record in plan.copy:
+                if source in stats.failed:
+                    # Left out of the manifest, so the next run tries it again
+                    continue
+                try:
+                    digest = hash_file(source, self.checksum)[0] if self.checksum else None
+                except OSError as e:
+                    stats.failed[source] = str(e)
+                    continue
+                copied.append((name, record, digest))
+            
+            linked = 0
+            relink = []
+            folders = set()     # Already created, makedirs is one stat per call even when they exist
+            for name, source, record in plan.kept:
+                destination = target(name)
+                folder = os.path.dirname(destination)
+                if folder not in folders:
+                    os.makedirs(folder, exist_ok=True)
+                    folders.add(folder)
+                try:
+                    os.link(os.path.join(self.backup_destination, previous, *name.split("/")), destination)
+                    linked += 1
+                except OSError:
+                    # Missing from the last snapshot, or its inode is at the link limit: a fresh copy
+                    relink.append((source, destination))
+            if relink:
+                stats.failed.update(self.copy_engine.copy_files(relink).failed)
+            for source, message in stats.failed.items():
+                logging.error(f"Failed to back up {source}: {message}")
+            failed = len(stats.failed)
+            logging.info(f"Copied {stats.summary()}")
+            
+            if snapshot:
+                # Files that failed are copied again next time, their links would point at nothing
+                manifest.set_value(LAST_SNAPSHOT, os.path.basename(backup_folder))
+                logging.info(f"Snapshot {backup_folder}: {len(copied)} files copied, {linked} hardlinked"
+                             f"{f' to {previous}' if previous else ''}, {failed} failed")
+            else:
+                if copied:
+                    # The last snapshot no longer has the newest copies, the next snapshot starts over
+                    manifest.set_value(LAST_SNAPSHOT, "")
+                logging.info(f"Incremental backup to {backup_folder}: {len(copied)} of {len(plan.copy)} files copied")
+            finished = True
+            return failed == 0
+        except Exception as e:
+            logging.error(f"Backup failed: {str(e)}")
+            return False
+        finally:
+            # Whatever was copied is recorded, even when the run stopped halfway. A snapshot that
+            # stopped halfway is not linked from, so its copies must not count as backed up
+            if plan is not None and (finished or not snapshot):
+                manifest.apply(copied, plan, os.path.basename(backup_folder))
+            manifest.close()
+    
+    def perform_chunk_backup(self, backup_name):
+        """Add a backup to the chunk store, writing only chunks it doesn't have yet"""
+        errors = []
+        try:
+            start = time.perf_counter()
+            store = ChunkStore(os.path.join(self.backup_destination, CHUNK_STORE_NAME))
+            stats = store.backup(self.source_paths, backup_name, errors)
+            for message in errors:
+                logging.warning(message)
+            logging.info(f"Chunk backup {backup_name} took {time.perf_counter() - start:.1f}s: {stats.summary()}")
+            return not errors
+        except Exception as e:
+            logging.error(f"Backup failed: {str(e)}")
+            return False
+    
+    def perform_archive_backup(self, archive_path):
+        """Write every source into one compressed archive"""
+        errors = []
+        try:
+            stats = write_archive(archive_path, self.source_paths, errors, codec=self.archive_codec)
+            for message in errors:
+                logging.warning(message)
+            logging.info(f"Archived to {archive_path}: {stats.summary()}")
+            return not errors
+        except Exception as e:
+            logging.error(f"Backup failed: {str(e)}")
+            return False
+    
     def start_scheduled_backup(self):
         """Start the scheduled backup process"""
         logging.info(f"Scheduled backup every {self.interval_hours} hours")
@@ -143,12 +336,16 @@ def main():
     
     interval_hours = 24  # Backup every 24 hours
     is_usb = True  # Set to False if backing up to a network or local drive
+    mode = "full"  # "incremental" only copies new or changed files, "snapshot" keeps complete trees,
+                   # "chunks" deduplicates large files that change a little (VM images, mailboxes),
+                   # "archive" writes one compressed file, fewer bytes for slow USB sticks
     
     # Log the configuration
     logging.info(f"Source paths: {source_paths}")
     logging.info(f"Backup destination: {backup_destination}")
     logging.info(f"Interval hours: {interval_hours}")
     logging.info(f"Is USB: {is_usb}")
+    logging.info(f"Mode: {mode}")
     
     # Create and start the backup manager
     try:
@@ -156,7 +353,8 @@ def main():
             source_paths=source_paths,
             backup_destination=backup_destination,
             interval_hours=interval_hours,
-            is_usb=is_usb
+            is_usb=is_usb,
+            mode=mode
         )
         logging.info("BackupManager initialized successfully")
         
@@ -0,0 +1,289 @@
+#backup_archive
+#Compressed single-file archives for BackupManager's "archive" mode.
+#The files of all sources are laid out back to back like in a tar stream and
+#cut into fixed BLOCK_SIZE blocks, which a process pool compresses in
+#parallel (zlib, lzma or bz2 from the standard library). Blocks are written
+#in order as they come back, with at most a few in flight, so the archive is
+#written as one sequential stream and memory stays flat. Blocks that don't
+#shrink are stored as they are.
+#
+#Layout:
+#   MAGIC, codec name
+#   blocks:  <u32 stored size> <u32 raw size> <u8 compressed?> data ...
+#   index:   zlib-compressed JSON with every block's offset, every file's
+#            name, size, mtime_ns, mode and offset in the uncompressed stream,
+#            and the names of all source folders (empty ones have no files)
+#   trailer: END_MAGIC <u64 index offset> <u64 index length>
+#
+#The trailer is read from the end of the file, so one file is extracted by
+#decompressing only the blocks it spans. Without the index the blocks can
+#still be read front to back.
+
+import os
+import io
+import bz2
+import lzma
+import json
+import zlib
+import time
+import stat
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from backup_manifest import walk_sources
+
+MAGIC = b"BKARCH1\0"
+END_MAGIC = b"BKAINDEX"
+BLOCK_SIZE = 1024 * 1024            # Uncompressed bytes per block, also what extracting one file decompresses at least
+BLOCK_HEADER = struct.Struct("<IIB")
+TRAILER = struct.Struct("<8sQQ")
+ARCHIVE_EXTENSION = ".bka"
+CPUS = os.cpu_count() or 1
+DEFAULT_ARCHIVE_WORKERS = CPUS if CPUS > 1 else 0   # With one core a pool only adds pickling
+
+# name -> (compress(data, level), decompress(data), default level)
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress, 6),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress, 9),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6),
+}
+
+
+class ArchiveError(Exception):
+    """Not an archive, or a damaged one"""
+
+
+def compress_block(codec, level, data):
+    """Runs in a pool process: (payload, compressed?) with the raw data kept if compressing doesn't help"""
+    packed = CODECS[codec][0](data, level)
+    return (packed, True) if len(packed) < len(data) else (data, False)
+
+
+class ArchiveStats:
+    def __init__(self):
+        self.files = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.blocks = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        mb = 1024 * 1024
+        ratio = self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        rate = self.raw_bytes / mb / self.seconds if self.seconds else 0.0
+        return (f"{self.files} files, {self.raw_bytes / mb:.1f} MB in {self.stored_bytes / mb:.1f} MB "
+                f"({ratio:.0%}) in {self.seconds:.1f}s, {rate:.1f} MB/s of source data")
+
+
+class ArchiveWriter:
+    def __init__(self, path, codec="zlib", level=None, workers=DEFAULT_ARCHIVE_WORKERS, block_size=BLOCK_SIZE):
+        """
+        Start an archive, nothing is written until add() or close()
+
+        Args:
+            path (str): Archive file; written as path + ".tmp" and renamed by close()
+            codec (str): "zlib", "lzma" or "bz2"
+            level (int): Compression level or lzma preset, None for the codec's default
+            workers (int): Compressing processes, 0 compresses in this process
+            block_size (int): Uncompressed bytes per block
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', use one of {', '.join(CODECS)}")
+        self.path = path
+        self.codec = codec
+        self.level = CODECS[codec][2] if level is None else level
+        self.block_size = block_size
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        # Enough blocks in flight to keep every process busy while the oldest one is written
+        self.window = max(2, workers * 2)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.stream_offset = 0      # Uncompressed bytes added so far
+        self.blocks = []            # [file offset, stored size, raw size, compressed?]
+        self.files = []             # [name, size, mtime_ns, mode, stream offset]
+        self.folders = []           # Folder names, so empty folders are kept too
+        self.stats = ArchiveStats()
+        self.start = time.perf_counter()
+        self.out = open(path + ".tmp", 'wb')
+        self.out.write(MAGIC + codec.encode('ascii').ljust(8, b"\0"))
+
+    def add(self, name, path):
+        """Append one file under name, returns its size as read"""
+        start = self.stream_offset
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            while True:
+                data = f.read(self.block_size - len(self.buffer))
+                if not data:
+                    break
+                self.buffer += data
+                self.stream_offset += len(data)
+                if len(self.buffer) == self.block_size:
+                    self.flush_block()
+        size = self.stream_offset - start
+        self.files.append([name, size, st.st_mtime_ns, stat.S_IMODE(st.st_mode), start])
+        self.stats.files += 1
+        self.stats.raw_bytes += size
+        return size
+
+    def add_folder(self, name):
+        self.folders.append(name)
+
+    def flush_block(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        if self.pool is None:
+            self.write_block(len(data), *compress_block(self.codec, self.level, data))
+            return
+        self.pending.append((len(data), self.pool.submit(compress_block, self.codec, self.level, data)))
+        # Written strictly in order; waiting on the oldest also bounds the memory held in flight
+        while len(self.pending) >= self.window:
+            self.write_pending()
+
+    def write_pending(self):
+        raw_size, future = self.pending.popleft()
+        self.write_block(raw_size, *future.result())
+
+    def write_block(self, raw_size, payload, compressed):
+        self.out.write(BLOCK_HEADER.pack(len(payload), raw_size, compressed))
+        self.blocks.append([self.out.tell(), len(payload), raw_size, compressed])
+        self.out.write(payload)
+        self.stats.blocks += 1
+        self.stats.stored_bytes += BLOCK_HEADER.size + len(payload)
+
+    def close(self):
+        """Write the last block, the index and the trailer, then move the archive into place"""
+        try:
+            if self.buffer:
+                self.flush_block()
+            while self.pending:
+                self.write_pending()
+            index = zlib.compress(json.dumps({"version": 1, "codec": self.codec, "block_size": self.block_size,
+                                              "blocks": self.blocks, "files": self.files,
+                                              "folders": self.folders}).encode('utf-8'))
+            index_offset = self.out.tell()
+            self.out.write(index)
+            self.out.write(TRAILER.pack(END_MAGIC, index_offset, len(index)))
+            self.out.close()
+            os.replace(self.path + ".tmp", self.path)
+        finally:
+            self.shutdown()
+        self.stats.stored_bytes = os.path.getsize(self.path)
+        self.stats.seconds = time.perf_counter() - self.start
+        return self.stats
+
+    def abort(self):
+        """Drop a half-written archive"""
+        self.shutdown()
+        if not self.out.closed:
+            self.out.close()
+        try:
+            os.remove(self.path + ".tmp")
+        except OSError:
+            pass
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+
+def write_archive(path, source_paths, errors, codec="zlib", level=None, workers=DEFAULT_ARCHIVE_WORKERS):
+    """
+    Archive every file below source_paths, with the names a backup folder would give them
+
+    Returns:
+        ArchiveStats
+    """
+    writer = ArchiveWriter(path, codec, level, workers)
+    folders = []
+    try:
+        for name, source, record in walk_sources(source_paths, errors, folders):
+            try:
+                writer.add(name, source)
+            except OSError as e:
+                # A file that fails halfway leaves its bytes in the stream but no index entry
+                errors.append(f"Error reading {source}: {e}")
+        for name in folders:
+            writer.add_folder(name)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        """
+        Open an archive and load its index
+
+        Args:
+            path (str): Archive written by ArchiveWriter
+        """
+        self.path = path
+        self.f = open(path, 'rb')
+        if self.f.read(len(MAGIC)) != MAGIC:
+            raise ArchiveError(f"{path} is not a backup archive")
+        self.f.seek(-TRAILER.size, os.SEEK_END)
+        magic, index_offset, index_length = TRAILER.unpack(self.f.read(TRAILER.size))
+        if magic != END_MAGIC:
+            raise ArchiveError(f"{path} has no index, it was not finished")
+        self.f.seek(index_offset)
+        index = json.loads(zlib.decompress(self.f.read(index_length)))
+        self.codec = index["codec"]
+        self.decompress = CODECS[self.codec][1]
+        self.block_size = index["block_size"]
+        self.blocks = index["blocks"]
+        self.files = {name: (size, mtime_ns, mode, start) for name, size, mtime_ns, mode, start in index["files"]}
+        self.folders = index.get("folders", [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def names(self):
+        return list(self.files)
+
+    def read_block(self, number):
+        offset, stored, raw, compressed = self.blocks[number]
+        self.f.seek(offset)
+        data = self.f.read(stored)
+        return self.decompress(data) if compressed else data
+
+    def extract_to(self, name, out):
+        """Write the contents of one file to a binary file object, decompressing only its blocks"""
+        size, _, _, start = self.files[name]
+        end = start + size
+        for number in range(start // self.block_size, -(-end // self.block_size)):
+            data = self.read_block(number)
+            block_start = number * self.block_size
+            out.write(data[max(start - block_start, 0):end - block_start])
+
+    def read(self, name):
+        out = io.BytesIO()
+        self.extract_to(name, out)
+        return out.getvalue()
+
+    def extract(self, name, target):
+        """Restore one file below target, with its mode and mtime"""
+        _, mtime_ns, mode, _ = self.files[name]
+        destination = os.path.join(target, *name.split("/"))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, 'wb') as out:
+            self.extract_to(name, out)
+        os.chmod(destination, mode)
+        os.utime(destination, ns=(mtime_ns, mtime_ns))
+        return destination
+
+    def extract_all(self, target):
+        """Restore every file and folder below target, returns the number of files"""
+        for name in self.folders:
+            os.makedirs(os.path.join(target, *name.split("/")), exist_ok=True)
+        for name in self.files:
+            self.extract(name, target)
+        return len(self.files)
@@ -0,0 +1,312 @@
+#backup_chunks
+#Deduplicated backup store for BackupManager's "chunks" mode.
+#Files are cut into chunks where a rolling hash over the last CHUNK_WINDOW
+#bytes hits a pattern, so the cut points depend on the content and not on
+#offsets: an edit in the middle of a VM image or a mailbox only changes the
+#chunks around it, and the rest of the file cuts into the same chunks as
+#before. Every chunk is stored once under its BLAKE2b digest, each backup is
+#a recipe file listing the chunks of every file. Identical files in
+#different sources, and unchanged parts of changed files, cost nothing.
+#
+#Store layout:
+#   chunks/ab/abcdef...     chunk data, named by its digest
+#   backups/<name>.jsonl    one line per file: name, size, mtime_ns, chunks,
+#                           and one per source folder: name, folder
+#
+#The rolling hash is vectorised with NumPy when it is installed; without it
+#the same cut points are found by a pure Python loop, only much slower.
+
+import os
+import json
+import bisect
+import hashlib
+from backup_manifest import walk_sources
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_MIN = 64 * 1024           # No cut before this many bytes, also keeps tiny chunks out
+CHUNK_BITS = 18                 # A cut every 2**18 bytes on average after CHUNK_MIN
+CHUNK_MAX = 2 * 1024 * 1024     # Forced cut, so data without any hit (zeros) still chunks
+CHUNK_WINDOW = 48               # Bytes the rolling hash looks at
+READ_BLOCK = 4 * 1024 * 1024    # Bytes read and hashed at once
+HASH_MASK = (1 << 32) - 1
+HASH_BASE = 0x9E3779B1          # Odd, so it has an inverse mod 2**32; fixed, cut points must not change
+BYTE_OFFSET = 0x5BD1E995        # Added to every byte, so a run of zeros doesn't hash to 0 and cut everywhere
+CUT_BELOW = 1 << (32 - CHUNK_BITS)
+BASE_POWER = pow(HASH_BASE, CHUNK_WINDOW, 1 << 32)
+# sum(BYTE_OFFSET * HASH_BASE**k for k < CHUNK_WINDOW), the offsets' share of every window hash
+OFFSET_SUM = sum(BYTE_OFFSET * pow(HASH_BASE, k, 1 << 32) for k in range(CHUNK_WINDOW)) & HASH_MASK
+
+
+def hash_hits_python(data):
+    """
+    End offsets i + 1 of every byte i whose window hash is below CUT_BELOW
+
+    H(i) = sum((data[i - k] + BYTE_OFFSET) * HASH_BASE**k for k < CHUNK_WINDOW) mod 2**32,
+    rolled one byte at a time.
+    """
+    hits = []
+    h = 0
+    base, mask = HASH_BASE, HASH_MASK
+    # What each byte adds when it enters the window and takes away when it leaves
+    enter = [byte + BYTE_OFFSET for byte in range(256)]
+    leave = [((byte + BYTE_OFFSET) * BASE_POWER) & HASH_MASK for byte in range(256)]
+    for byte in data[:CHUNK_WINDOW]:
+        h = (h * base + enter[byte]) & mask
+    if len(data) >= CHUNK_WINDOW and h < CUT_BELOW:
+        hits.append(CHUNK_WINDOW)
+    for i in range(CHUNK_WINDOW, len(data)):
+        h = (h * base + enter[data[i]] - leave[data[i - CHUNK_WINDOW]]) & mask
+        if h < CUT_BELOW:
+            hits.append(i + 1)
+    return hits
+
+
+class PowerTables:
+    """HASH_BASE**i and HASH_BASE**-i mod 2**32 as uint32 arrays, grown on demand"""
+
+    def __init__(self):
+        self.size = 0
+        self.powers = self.inverses = None
+
+    def get(self, n):
+        if n > self.size:
+            size = max(n, READ_BLOCK + CHUNK_MAX)
+            # cumprod wraps around in uint32, which is exactly mod 2**32
+            powers = np.full(size, HASH_BASE, dtype=np.uint32)
+            powers[0] = 1
+            inverses = np.full(size, pow(HASH_BASE, -1, 1 << 32), dtype=np.uint32)
+            inverses[0] = 1
+            self.powers = np.cumprod(powers, dtype=np.uint32)
+            self.inverses = np.cumprod(inverses, dtype=np.uint32)
+            self.size = size
+        return self.powers[:n], self.inverses[:n]
+
+
+POWER_TABLES = PowerTables()
+
+
+def hash_hits_numpy(data):
+    """
+    hash_hits_python() in a handful of array passes
+
+    With S(i) = sum(data[j] * B**-j for j <= i), the window hash is B**i * (S(i) - S(i - W)) plus
+    OFFSET_SUM; all of it wraps around in uint32 exactly like the mod 2**32 arithmetic.
+    """
+    n = len(data)
+    if n < CHUNK_WINDOW:
+        return []
+    powers, inverses = POWER_TABLES.get(n)
+    prefix = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+    prefix *= inverses
+    np.cumsum(prefix, out=prefix)
+    window = prefix[CHUNK_WINDOW - 1:].copy()
+    window[1:] -= prefix[:n - CHUNK_WINDOW]
+    window *= powers[CHUNK_WINDOW - 1:]
+    window += np.uint32(OFFSET_SUM)
+    return (np.flatnonzero(window < CUT_BELOW) + CHUNK_WINDOW).tolist()
+
+
+hash_hits = hash_hits_numpy if np is not None else hash_hits_python
+
+
+def cut_points(data, final):
+    """
+    End offsets of the chunks in data, which starts at a chunk boundary
+
+    Without final the bytes after the last cut are left out, more data may move their cut.
+    """
+    hits = hash_hits(data)
+    cuts = []
+    start = 0
+    position = 0
+    while True:
+        # Windows of hits at or past start + CHUNK_MIN lie inside the chunk, so cuts don't depend on earlier data
+        position = bisect.bisect_left(hits, start + CHUNK_MIN, position)
+        if position < len(hits) and hits[position] <= start + CHUNK_MAX:
+            end = hits[position]
+        elif start + CHUNK_MAX <= len(data):
+            end = start + CHUNK_MAX
+        else:
+            break
+        cuts.append(end)
+        start = end
+    if final and start < len(data):
+        cuts.append(len(data))
+    return cuts
+
+
+def iter_chunks(f, read_block=READ_BLOCK):
+    """Yield the chunks of an open binary file as bytes"""
+    pending = b""
+    while True:
+        block = f.read(read_block)
+        data = pending + block if pending else block
+        start = 0
+        for end in cut_points(data, final=not block):
+            yield data[start:end]
+            start = end
+        if not block:
+            return
+        pending = data[start:]
+
+
+def chunk_digest(data):
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+class ChunkStats:
+    def __init__(self):
+        self.files = 0
+        self.files_reused = 0       # Unchanged since the last backup, not read at all
+        self.bytes_read = 0
+        self.chunks = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+
+    def summary(self):
+        mb = 1024 * 1024
+        return (f"{self.files} files ({self.files_reused} unchanged), {self.bytes_read / mb:.1f} MB read, "
+                f"{self.chunks_written} of {self.chunks} chunks new, {self.bytes_written / mb:.1f} MB written")
+
+
+class ChunkStore:
+    def __init__(self, root):
+        """
+        Open (or create) a chunk store
+
+        Args:
+            root (str): Folder holding chunks/ and backups/
+        """
+        self.root = root
+        self.chunk_root = os.path.join(root, "chunks")
+        self.backup_root = os.path.join(root, "backups")
+        os.makedirs(self.chunk_root, exist_ok=True)
+        os.makedirs(self.backup_root, exist_ok=True)
+        self.known = set()          # Digests seen stored during this session
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_root, digest[:2], digest)
+
+    def put_chunk(self, data, stats=None):
+        """Store data unless a chunk with its digest is already there, returns the digest"""
+        digest = chunk_digest(data)
+        if digest in self.known:
+            return digest
+        path = self.chunk_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name, a chunk that exists is always complete
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+            if stats is not None:
+                stats.chunks_written += 1
+                stats.bytes_written += len(data)
+        self.known.add(digest)
+        return digest
+
+    def backups(self):
+        """Names of the stored backups, oldest first"""
+        return sorted(name[:-len(".jsonl")] for name in os.listdir(self.backup_root) if name.endswith(".jsonl"))
+
+    def load_recipes(self, backup, folders=None):
+        """
+        {file name: (size, mtime_ns, [chunk digests])} of one backup
+
+        Args:
+            folders (list): Optional list that collects the names of the backup's folders
+        """
+        recipes = {}
+        with open(os.path.join(self.backup_root, f"{backup}.jsonl"), encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("folder"):
+                    if folders is not None:
+                        folders.append(entry["name"])
+                    continue
+                recipes[entry["name"]] = (entry["size"], entry["mtime_ns"], entry["chunks"])
+        return recipes
+
+    def backup(self, source_paths, backup, errors):
+        """
+        Store the sources as a new backup
+
+        Files whose size and mtime match the newest earlier backup reuse its chunk list without
+        being read. The recipe is only written at the end, so an interrupted run leaves no backup
+        behind (its chunks are reused next time).
+
+        Args:
+            source_paths (list): Files and folders to back up
+            backup (str): Name of the new backup, e.g. "backup_20240101_120000"
+            errors (list): Collects messages for files that couldn't be read
+
+        Returns:
+            ChunkStats
+        """
+        stats = ChunkStats()
+        earlier = self.backups()
+        previous = self.load_recipes(earlier[-1]) if earlier else {}
+        recipe_path = os.path.join(self.backup_root, f"{backup}.jsonl")
+        temp = recipe_path + ".tmp"
+        folders = []
+        with open(temp, 'w', encoding='utf-8') as out:
+            for name, path, record in walk_sources(source_paths, errors, folders):
+                old = previous.get(name)
+                if old is not None and old[0] == record.size and old[1] == record.mtime_ns:
+                    chunks = old[2]
+                    stats.files_reused += 1
+                else:
+                    try:
+                        chunks = self.store_file(path, stats)
+                    except OSError as e:
+                        errors.append(f"Error reading {path}: {e}")
+                        continue
+                stats.files += 1
+                stats.chunks += len(chunks)
+                out.write(json.dumps({"name": name, "size": record.size, "mtime_ns": record.mtime_ns,
+                                      "chunks": chunks}) + "\n")
+            # Folders are listed so that empty ones come back on restore
+            for name in folders:
+                out.write(json.dumps({"name": name, "folder": True}) + "\n")
+        os.replace(temp, recipe_path)
+        return stats
+
+    def store_file(self, path, stats):
+        chunks = []
+        with open(path, 'rb') as f:
+            for data in iter_chunks(f):
+                stats.bytes_read += len(data)
+                chunks.append(self.put_chunk(data, stats))
+        return chunks
+
+    def restore(self, backup, target, names=None):
+        """
+        Rebuild files of a backup below target
+
+        Args:
+            names (iterable): Backup names ("folder/sub/file") to restore, None restores everything,
+                empty folders included
+
+        Returns:
+            int: Files restored
+        """
+        folders = []
+        recipes = self.load_recipes(backup, folders)
+        wanted = recipes if names is None else {name: recipes[name] for name in names}
+        if names is None:
+            for name in folders:
+                os.makedirs(os.path.join(target, *name.split("/")), exist_ok=True)
+        for name, (size, mtime_ns, chunks) in wanted.items():
+            destination = os.path.join(target, *name.split("/"))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, 'wb') as out:
+                for digest in chunks:
+                    with open(self.chunk_path(digest), 'rb') as f:
+                        out.write(f.read())
+            os.utime(destination, ns=(mtime_ns, mtime_ns))
+        return len(wanted)
@@ -0,0 +1,201 @@
+#backup_copy
+#Parallel copy engine for BackupManager.
+#A pool of threads copies files with os.copy_file_range (the kernel copies,
+#or the filesystem clones), then os.sendfile, then a plain read/write loop
+#with one reusable buffer per thread; none of them pass the data through
+#Python objects. A method that the platform or filesystem refuses is
+#remembered per device pair and not tried again.
+#Target directories are created in one pass before the copies start, and
+#permissions and timestamps are set in one pass after they finish, so the
+#workers only move data. Copies to the same destination device are capped
+#by a semaphore, a slow USB stick gets a couple of streams instead of a
+#queue of seeking writers.
+
+import os
+import time
+import errno
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_COPY_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+DEFAULT_DEVICE_LIMIT = 4            # Copies writing to one device at once
+COPY_BUFFER = 1024 * 1024           # Buffer of the read/write fallback
+CHUNK_LIMIT = 1 << 30               # Largest request to copy_file_range/sendfile, some kernels cap it anyway
+# Errors meaning "this method doesn't work here", not "this file failed"
+UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+               errno.ENOTSOCK, errno.EBADF, errno.EPERM}
+# The same for setting permissions and timestamps; EPERM is a real failure there
+METADATA_UNSUPPORTED = {errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+class CopyStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.failed = {}            # source path -> error message
+        self.methods = {}           # copy method -> files copied with it
+
+    def mb_per_second(self):
+        return self.bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def files_per_second(self):
+        return self.files / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        methods = ", ".join(f"{count} {name}" for name, count in sorted(self.methods.items()))
+        return (f"{self.files} files, {self.bytes / (1024 * 1024):.1f} MB in {self.seconds:.1f}s "
+                f"({self.mb_per_second():.1f} MB/s, {self.files_per_second():.0f} files/s; {methods or 'nothing copied'})"
+                f"{f', {len(self.failed)} failed' if self.failed else ''}")
+
+
+class CopyEngine:
+    def __init__(self, workers=DEFAULT_COPY_WORKERS, device_limit=DEFAULT_DEVICE_LIMIT, progress=None):
+        """
+        Initialize the engine
+
+        Args:
+            workers (int): Copy threads
+            device_limit (int): Copies writing to the same destination device at once
+            progress (callable): Optional progress(files_done, bytes_done), called from worker threads
+        """
+        self.workers = max(1, workers)
+        self.device_limit = max(1, device_limit)
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.device_slots = {}      # st_dev -> BoundedSemaphore
+        self.unsupported = set()    # (method, source dev, destination dev) that failed as unsupported
+        self.local = threading.local()
+
+    def slots_for(self, device):
+        with self.lock:
+            if device not in self.device_slots:
+                self.device_slots[device] = threading.BoundedSemaphore(self.device_limit)
+            return self.device_slots[device]
+
+    def copy_files(self, jobs, folders=()):
+        """
+        Copy (source, destination) pairs, with their permissions and timestamps
+
+        Existing destinations are unlinked first, never written through, since they may be
+        hardlinks into an older snapshot. Files that fail are listed in stats.failed and left
+        out of the metadata pass; everything else is still copied.
+
+        Args:
+            jobs (iterable): (source, destination) file pairs
+            folders (iterable): Destination folders to create even if no file goes into them
+
+        Returns:
+            CopyStats
+        """
+        jobs = list(jobs)
+        stats = CopyStats()
+        start = time.perf_counter()
+        folders = self.make_folders((destination for _, destination in jobs), folders)
+        metadata = []               # (source, destination, source stat), applied after all data is written
+
+        def run(job):
+            source, destination = job
+            try:
+                st = os.stat(source)
+                with self.slots_for(folders[os.path.dirname(destination)]):
+                    method = self.copy_data(source, destination, st)
+            except OSError as e:
+                with self.lock:
+                    stats.failed[source] = str(e)
+                return
+            with self.lock:
+                metadata.append((source, destination, st))
+                stats.files += 1
+                stats.bytes += st.st_size
+                stats.methods[method] = stats.methods.get(method, 0) + 1
+                done = stats.files, stats.bytes
+            if self.progress:
+                self.progress(*done)
+
+        pending = iter(jobs)
+
+        def worker():
+            # Workers pull jobs one at a time, a million files don't become a million futures
+            while True:
+                with self.lock:
+                    job = next(pending, None)
+                if job is None:
+                    return
+                run(job)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            workers = [pool.submit(worker) for _ in range(min(self.workers, len(jobs)))]
+            for future in workers:
+                # Raises an unexpected exception from a worker here
+                future.result()
+        for source, destination, st in metadata:
+            try:
+                os.chmod(destination, stat.S_IMODE(st.st_mode))
+                os.utime(destination, ns=(st.st_atime_ns, st.st_mtime_ns))
+            except OSError as e:
+                # Filesystems that have no permissions at all are not a failure, anything else is
+                if e.errno not in METADATA_UNSUPPORTED:
+                    stats.failed[source] = f"Error setting metadata: {e}"
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    @staticmethod
+    def make_folders(destinations, extra=()):
+        """Create the folder of every destination and the extra folders once, returns {folder: st_dev}"""
+        folders = {}
+        for folder in sorted({os.path.dirname(destination) for destination in destinations}.union(extra)):
+            os.makedirs(folder, exist_ok=True)
+            folders[folder] = os.stat(folder).st_dev
+        return folders
+
+    def copy_data(self, source, destination, st):
+        """Copy the bytes of one file, returns the name of the method that did it"""
+        try:
+            os.unlink(destination)
+        except FileNotFoundError:
+            pass
+        with open(source, 'rb', buffering=0) as fsrc, open(destination, 'wb', buffering=0) as fdst:
+            devices = (st.st_dev, os.fstat(fdst.fileno()).st_dev)
+            for method, func in (("copy_file_range", getattr(os, "copy_file_range", None)),
+                                 ("sendfile", getattr(os, "sendfile", None))):
+                if func is None or (method,) + devices in self.unsupported:
+                    continue
+                try:
+                    self.copy_range(func, method, fsrc.fileno(), fdst.fileno(), st.st_size)
+                    return method
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED or fdst.tell() or os.fstat(fdst.fileno()).st_size:
+                        raise
+                    with self.lock:
+                        self.unsupported.add((method,) + devices)
+            self.copy_buffered(fsrc, fdst)
+            return "buffered"
+
+    @staticmethod
+    def copy_range(func, method, src_fd, dst_fd, size):
+        copied = 0
+        while copied < size:
+            count = min(size - copied, CHUNK_LIMIT)
+            if method == "sendfile":
+                n = func(dst_fd, src_fd, copied, count)
+            else:
+                n = func(src_fd, dst_fd, count)
+            if n == 0:
+                # The file shrank while being copied, what's there is what gets backed up
+                break
+            copied += n
+
+    def copy_buffered(self, fsrc, fdst):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = memoryview(bytearray(COPY_BUFFER))
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                return
+            # An unbuffered write may take less than it was given
+            written = 0
+            while written < n:
+                written += fdst.write(buffer[written:n])
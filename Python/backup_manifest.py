@@ -0,0 +1,211 @@
+#backup_manifest
+#Manifest of what the last backup holds, for BackupManager's incremental mode.
+#Every backed-up file has one row: its path inside the backup, size,
+#mtime_ns, an optional digest and the backup_<timestamp> folder holding its
+#latest copy. A run walks the sources once with fynd_crawl (one lstat per
+#file), compares the stats against the manifest loaded into a dict, and only
+#copies what is new or changed. A run where nothing changed reads the
+#manifest, stats every file and writes nothing.
+#
+#The manifest lives next to the backups on the destination, so a different
+#USB stick starts with its own (empty) manifest instead of a wrong one.
+#Snapshot mode also records the last complete snapshot folder, the one
+#unchanged files are hardlinked from.
+
+import os
+import sqlite3
+from collections import namedtuple
+from fynd_crawl import crawl
+from fynd_hashers import hash_file
+
+MANIFEST_NAME = ".backup_manifest.db"
+WRITE_BATCH = 5000          # Manifest rows written per executemany
+
+
+class ManifestEntry(namedtuple("ManifestEntry", "size mtime_ns digest location")):
+    """One backed-up file: its stat when copied, its digest if checksums are on, and the folder holding it"""
+
+    __slots__ = ()
+
+
+def backup_name(source_path, file_path):
+    """Path of file_path inside a backup folder, '/'-separated, the layout copytree gives"""
+    base = os.path.basename(os.path.normpath(source_path))
+    if file_path == source_path:
+        return base
+    relative = os.path.relpath(file_path, source_path)
+    return f"{base}/{relative}".replace(os.sep, "/")
+
+
+def name_prefixes(source_path):
+    """(source prefix, backup name prefix) so names below a folder are a slice and a concatenation"""
+    return os.path.join(source_path, ""), backup_name(source_path, source_path) + "/"
+
+
+class FileRecordLike(namedtuple("FileRecordLike", "path size mtime_ns")):
+    """Stat of a single source file, the fields of a FileRecord the manifest needs"""
+
+    __slots__ = ()
+
+    def __new__(cls, path, st):
+        return super().__new__(cls, path, st.st_size, st.st_mtime_ns)
+
+
+def walk_sources(source_paths, errors, folders=None):
+    """
+    Yield (backup name, source path, FileRecord) for every file below the sources
+
+    Symlinks are followed like copytree does, a backup holds the files they point to.
+
+    Args:
+        folders (list): Optional list that collects the backup names of every source folder,
+            empty ones included, once the walk is done
+    """
+    for source_path in source_paths:
+        if not os.path.isdir(source_path):
+            try:
+                st = os.stat(source_path)
+            except OSError as e:
+                errors.append(f"Error reading {source_path}: {e}")
+                continue
+            yield backup_name(source_path, source_path), source_path, FileRecordLike(source_path, st)
+            continue
+        # relpath() per file costs more than the stat, crawl() paths all start with the folder
+        source_prefix, name_prefix = name_prefixes(source_path)
+        skip = len(source_prefix)
+        found = [] if folders is not None else None
+        for record in crawl(source_path, errors=errors, follow_symlinks=True, folders=found):
+            relative = record.path[skip:]
+            if os.sep != "/":
+                relative = relative.replace(os.sep, "/")
+            yield name_prefix + relative, record.path, record
+        if found is not None:
+            for folder in found:
+                relative = folder[skip:].replace(os.sep, "/")
+                folders.append(name_prefix + relative if relative else name_prefix[:-1])
+
+
+class BackupPlan:
+    """What an incremental run has to do"""
+
+    def __init__(self):
+        self.copy = []          # (backup name, source path, record) of new or changed files
+        self.touched = []       # (backup name, record, entry) whose stat changed but digest did not
+        self.removed = []       # Backup names no longer in the sources
+        self.kept = []          # (backup name, source path, record) of unchanged files, with keep_unchanged
+        self.folders = []       # Backup names of every source folder, with keep_unchanged
+        self.unchanged = 0
+        self.bytes_to_copy = 0
+
+    def is_empty(self):
+        return not (self.copy or self.touched or self.removed)
+
+    def summary(self):
+        return (f"{len(self.copy)} new or changed ({self.bytes_to_copy / (1024 * 1024):.1f} MB), "
+                f"{self.unchanged + len(self.touched)} unchanged, {len(self.removed)} removed")
+
+
+class BackupManifest:
+    def __init__(self, db_path):
+        """
+        Open (or create) the manifest database
+
+        Args:
+            db_path (str): Location of the SQLite file, usually MANIFEST_NAME in the backup destination
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        # The manifest is rewritten by one process at a time, a rollback journal keeps it a single file
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT,
+                location TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_value(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_value(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def load(self):
+        """{backup name: ManifestEntry} for every file in the last backup"""
+        rows = self.conn.execute("SELECT name, size, mtime_ns, digest, location FROM files")
+        return {name: ManifestEntry(size, mtime_ns, digest, location) for name, size, mtime_ns, digest, location in rows}
+
+    def plan(self, source_paths, errors, checksum=None, entries=None, keep_unchanged=False):
+        """
+        Compare the sources against the manifest
+
+        Args:
+            source_paths (list): Files and folders being backed up
+            errors (list): Collects messages for unreadable entries
+            checksum (str): Registered hasher name; files whose stat changed are hashed and
+                only copied if the digest differs too. None trusts size and mtime
+            entries (dict): Output of load() if the caller already has it
+            keep_unchanged (bool): List unchanged files in plan.kept and every folder in plan.folders,
+                snapshots link and recreate them
+
+        Returns:
+            BackupPlan
+        """
+        entries = self.load() if entries is None else entries
+        plan = BackupPlan()
+        error_count = len(errors)
+        seen = set()
+        folders = plan.folders if keep_unchanged else None
+        for name, path, record in walk_sources(source_paths, errors, folders):
+            seen.add(name)
+            entry = entries.get(name)
+            if entry is not None and entry.size == record.size and entry.mtime_ns == record.mtime_ns:
+                plan.unchanged += 1
+                if keep_unchanged:
+                    plan.kept.append((name, path, record))
+                continue
+            if checksum and entry is not None and entry.digest and entry.size == record.size:
+                try:
+                    digest, _ = hash_file(path, checksum)
+                except OSError as e:
+                    errors.append(f"Error reading {path}: {e}")
+                    continue
+                if digest == entry.digest:
+                    plan.touched.append((name, record, entry))
+                    if keep_unchanged:
+                        plan.kept.append((name, path, record))
+                    continue
+            plan.copy.append((name, path, record))
+            plan.bytes_to_copy += record.size
+        # An unreadable folder is not a deletion, nothing is dropped from the manifest after read errors
+        if len(errors) == error_count:
+            plan.removed = [name for name in entries if name not in seen]
+        return plan
+
+    def apply(self, copied, plan, location):
+        """
+        Record a finished run
+
+        Args:
+            copied (list): (backup name, record, digest) of the files that were copied
+            plan (BackupPlan): The plan the run followed, for touched and removed files
+            location (str): Name of the backup folder the copies went to
+        """
+        rows = [(name, record.size, record.mtime_ns, digest, location) for name, record, digest in copied]
+        rows += [(name, record.size, record.mtime_ns, entry.digest, entry.location)
+                 for name, record, entry in plan.touched]
+        with self.conn:
+            for start in range(0, len(rows), WRITE_BATCH):
+                self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                      rows[start:start + WRITE_BATCH])
+            self.conn.executemany("DELETE FROM files WHERE name = ?", ((name,) for name in plan.removed))
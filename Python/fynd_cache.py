@@ -0,0 +1,101 @@
+#fynd_cache
+#Persistent digest cache shared by the duplicate finders.
+#Digests are stored in a small SQLite database keyed by the file's identity
+#(st_dev, st_ino) and the kind of digest, and are only trusted while the
+#file's size and mtime_ns still match the stored values.
+
+import os
+import sqlite3
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".fynd_hash_cache.db")
+COMMIT_EVERY = 500  # Pending writes before the cache commits to disk
+
+
+class HashCache:
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        """
+        Open (or create) the cache database
+
+        Args:
+            db_path (str): Location of the SQLite file, ":memory:" for a throwaway cache
+        """
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS digests (
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (dev, ino, kind)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def get(self, path, st, kind):
+        """Return the cached digest for a file, or None if missing or stale"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, digest FROM digests WHERE dev=? AND ino=? AND kind=?",
+                (st.st_dev, st.st_ino, kind),
+            ).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                self.hits += 1
+                return row[2]
+            self.misses += 1
+            return None
+
+    def put(self, path, st, kind, digest):
+        """Store a digest, replacing any stale entry for the same inode"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests (dev, ino, kind, size, mtime_ns, path, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, kind, st.st_size, st.st_mtime_ns, path, digest),
+            )
+            self.pending += 1
+            if self.pending >= COMMIT_EVERY:
+                self.conn.commit()
+                self.pending = 0
+
+    def lookup(self, path, kind, compute):
+        """Return the digest for path, calling compute(path) and caching it on a miss"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return compute(path)
+        digest = self.get(path, st, kind)
+        if digest is None:
+            digest = compute(path)
+            if digest is not None:
+                self.put(path, st, kind, digest)
+        return digest
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    def counters(self):
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
+
+    def summary(self):
+        return f"cache: {self.hits} hits / {self.misses} misses"
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,181 @@
+#fynd_cli
+#Headless front end for the duplicate finders. Runs the same engines as the
+#Qt and Tk apps and writes one JSON object per line to stdout, so scans can
+#run from cron and be piped into jq or a log collector.
+#
+#Usage: python fynd_cli.py files FOLDER [--include .jpg .png] [--exclude .tmp] [--quick]
+#       python fynd_cli.py music FOLDER [--no-metadata] [--fuzzy] [--no-hash] [--content payload|file|audio|fingerprint] [--quick]
+#
+#Every line has an "event" field: "progress" (only with --progress),
+#"group", "hardlinks", "error" and a final "summary".
+
+import os
+import sys
+import json
+import time
+import argparse
+from fynd_engine import DuplicateScanner, ScanCancelled, DEFAULT_WORKERS
+from fynd_music import MusicScanner, CONTENT_MODES
+from fynd_fingerprint import fingerprints_available
+from fynd_decode import DEFAULT_DECODERS
+from fynd_cache import HashCache, DEFAULT_CACHE_PATH
+from fynd_state import ScanState, DEFAULT_STATE_PATH
+from fynd_crawl import ExtensionFilter
+from fynd_hashers import HASHERS
+
+PROGRESS_INTERVAL = 1.0  # Seconds between progress lines
+
+
+class JsonLinesWriter:
+    """Writes events as JSON Lines and throttles progress events"""
+
+    def __init__(self, stream=sys.stdout, show_progress=False):
+        self.stream = stream
+        self.show_progress = show_progress
+        self.last_progress = 0.0
+
+    def emit(self, event, **fields):
+        self.stream.write(json.dumps({"event": event, **fields}) + "\n")
+        self.stream.flush()
+
+    def progress(self, done, total, stage):
+        if not self.show_progress:
+            return
+        now = time.monotonic()
+        if done == total or now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.emit("progress", stage=stage, done=done, total=total)
+
+
+def scan_files(args, out, cache):
+    # Byte-identical files of any type through the staged engine
+    scanner = DuplicateScanner(progress=out.progress, cache=cache, workers=args.workers,
+                               full_hasher=args.hasher)
+    file_filter = ExtensionFilter(args.include, args.exclude)
+    if args.quick:
+        state = ScanState(args.state)
+        try:
+            # Files are stat'ed too, a file rewritten in place doesn't change its folder's mtime
+            groups = scanner.scan_incremental(state, args.folder, file_filter, verify_files=True)
+        finally:
+            state.close()
+    else:
+        groups = scanner.scan_folder(args.folder, file_filter)
+
+    grouped = set()
+    for paths in groups:
+        grouped.update(paths)
+        out.emit("group", kind="content", size=scanner.file_stats[paths[0]].size, paths=paths,
+                 hardlinks={path: scanner.links_of(path) for path in paths if scanner.links_of(path)})
+    for path, links in scanner.hardlinks.items():
+        if path not in grouped:
+            out.emit("hardlinks", paths=[path] + links)
+    for message in scanner.errors:
+        out.emit("error", message=message)
+    summary = {
+        "groups": len(groups),
+        "stages": [stats.as_dict() for stats in scanner.stats],
+        **scanner.cache_counters(),
+    }
+    if scanner.delta is not None:
+        summary["rescan"] = scanner.delta.summary()
+    out.emit("summary", **summary)
+
+
+def scan_music(args, out, cache):
+    # Music files matched by tags and/or content
+    state = ScanState(args.state) if args.quick else None
+    scanner = MusicScanner(use_metadata=not args.no_metadata, use_hash=not args.no_hash,
+                           music_only=not args.all_files, content=args.content,
+                           cache=cache, state=state, hash_algorithm=args.hasher,
+                           tag_processes=args.processes, decoders=args.decoders, fuzzy_metadata=args.fuzzy, verify_files=True,
+                           progress=lambda done, total, path: out.progress(done, total, "music"))
+    try:
+        metadata_duplicates, hash_duplicates = scanner.scan(args.folder)
+    finally:
+        if state is not None:
+            state.close()
+
+    for (artist, title), paths in metadata_duplicates.items():
+        out.emit("group", kind="metadata", artist=artist, title=title, paths=paths)
+    for digest, paths in hash_duplicates.items():
+        out.emit("group", kind="content", digest=digest, paths=paths,
+                 hardlinks={path: scanner.hardlinks[path] for path in paths if path in scanner.hardlinks})
+    grouped = {path for paths in hash_duplicates.values() for path in paths}
+    for path, links in scanner.hardlinks.items():
+        if path not in grouped:
+            out.emit("hardlinks", paths=[path] + links)
+    for message in scanner.errors:
+        out.emit("error", message=message)
+    summary = {
+        "files": scanner.files_processed,
+        "metadata_groups": len(metadata_duplicates),
+        "content_groups": len(hash_duplicates),
+        **(cache.counters() if cache is not None else {}),
+    }
+    if scanner.delta is not None:
+        summary["rescan"] = scanner.delta.summary()
+    out.emit("summary", **summary)
+
+
+def main(argv=None):
+    # Options shared by both commands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("folder")
+    common.add_argument("--progress", action="store_true", help="also emit progress events")
+    common.add_argument("--no-cache", action="store_true", help="don't read or write the digest cache")
+    common.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="digest cache database")
+    common.add_argument("--state", default=DEFAULT_STATE_PATH, help="saved tree used by --quick")
+    common.add_argument("--quick", action="store_true", help="only list folders changed since the last --quick scan, files are still stat'ed")
+    common.add_argument("--hasher", default=None, help="full hash algorithm, defaults to the benchmarked one")
+
+    parser = argparse.ArgumentParser(description="Find duplicate files without a GUI, output is JSON Lines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    files = commands.add_parser("files", parents=[common], help="byte-identical files of any type")
+    files.add_argument("--include", nargs="*", default=(), help="only these extensions")
+    files.add_argument("--exclude", nargs="*", default=(), help="skip these extensions")
+    files.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="hashing threads")
+
+    music = commands.add_parser("music", parents=[common], help="music files with the same tags or content")
+    music.add_argument("--no-metadata", action="store_true", help="don't group by artist/title")
+    music.add_argument("--fuzzy", action="store_true",
+                       help="also group tags differing by featured artists, remaster notes or punctuation")
+    music.add_argument("--no-hash", action="store_true", help="don't group by content")
+    music.add_argument("--all-files", action="store_true", help="don't restrict the scan to music extensions")
+    music.add_argument("--content", choices=CONTENT_MODES, default="payload",
+                       help="hash the audio without tags, the raw file or the decoded audio (needs ffmpeg), "
+                            "or match fingerprints of the recording (needs numpy and ffmpeg)")
+    music.add_argument("--processes", type=int, default=None, help="tag parsing processes, 0 parses in threads")
+    music.add_argument("--decoders", type=int, default=DEFAULT_DECODERS, help="ffmpeg processes decoding at once")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"not a folder: {args.folder}")
+    if args.hasher is not None and args.hasher not in HASHERS:
+        parser.error(f"unknown hasher '{args.hasher}', choose one of: {', '.join(HASHERS)}")
+    args.folder = os.path.abspath(args.folder)
+    if args.command == "music" and args.quick:
+        # Music scans keep no groups in the state, so they must not share the file scan's tree
+        args.state = args.state + ".music"
+    if args.command == "music" and args.content == "fingerprint" and not fingerprints_available():
+        parser.error("--content fingerprint needs numpy and ffmpeg")
+
+    out = JsonLinesWriter(show_progress=args.progress)
+    cache = None if args.no_cache else HashCache(args.cache)
+    try:
+        if args.command == "files":
+            scan_files(args, out, cache)
+        else:
+            scan_music(args, out, cache)
+    except (KeyboardInterrupt, ScanCancelled):
+        out.emit("cancelled")
+        return 130
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#fynd_crawl
+#os.scandir based tree crawler shared by the duplicate finders.
+#Each directory entry costs one lstat at most, extension filters are
+#compiled into frozensets once, and files come out as small FileRecord
+#tuples that carry everything the later stages need. Paths that share an
+#inode (hardlinks) can be collapsed before any hashing.
+
+import os
+from collections import namedtuple
+
+
+class FileRecord(namedtuple("FileRecord", "path size mtime_ns dev inode nlink")):
+    """A crawled file; the st_* aliases let records stand in for os.stat_result"""
+
+    __slots__ = ()
+
+    st_size = property(lambda self: self.size)
+    st_mtime_ns = property(lambda self: self.mtime_ns)
+    st_dev = property(lambda self: self.dev)
+    st_ino = property(lambda self: self.inode)
+    st_nlink = property(lambda self: self.nlink)
+
+    @classmethod
+    def from_stat(cls, path, st):
+        return cls(path, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino, st.st_nlink)
+
+
+def split_extension(name):
+    """Lower-cased last suffix including the dot ('' for none), like os.path.splitext on a bare name"""
+    dot = name.rfind('.')
+    if dot <= 0:
+        return ''
+    return name[dot:].lower()
+
+
+class ExtensionFilter:
+    def __init__(self, include=(), exclude=()):
+        """
+        Compile include/exclude extension lists into set lookups
+
+        Args:
+            include (iterable): Extensions to keep (".mp3" or "mp3"), empty keeps everything
+            exclude (iterable): Extensions to drop, checked before include
+        """
+        self.include, self.include_compound = self.compile(include)
+        self.exclude, self.exclude_compound = self.compile(exclude)
+        self.accepts_all = not (self.include or self.include_compound or self.exclude or self.exclude_compound)
+
+    @staticmethod
+    def compile(extensions):
+        # Single suffixes are a set lookup; compound ones like ".tar.gz" need an endswith check
+        simple, compound = set(), set()
+        for ext in extensions:
+            ext = ext.strip().lower()
+            if not ext:
+                continue
+            if not ext.startswith('.'):
+                ext = '.' + ext
+            (compound if ext.count('.') > 1 else simple).add(ext)
+        return frozenset(simple), tuple(sorted(compound))
+
+    def matches(self, name):
+        if self.accepts_all:
+            return True
+        lower = name.lower()
+        ext = split_extension(lower)
+        if ext in self.exclude or (self.exclude_compound and lower.endswith(self.exclude_compound)):
+            return False
+        if not self.include and not self.include_compound:
+            return True
+        return ext in self.include or bool(self.include_compound and lower.endswith(self.include_compound))
+
+    def signature(self):
+        """Stable text form of the filter, used to tell whether saved results still apply"""
+        include = sorted(self.include) + list(self.include_compound)
+        exclude = sorted(self.exclude) + list(self.exclude_compound)
+        return f"include={','.join(include)};exclude={','.join(exclude)}"
+
+
+def crawl(root, file_filter=None, errors=None, follow_symlinks=False, folders=None):
+    """
+    Yield a FileRecord for every regular file below root
+
+    Args:
+        root (str): Directory to crawl
+        file_filter (ExtensionFilter): Optional filter applied to file names before any stat
+        errors (list): Optional list that collects messages for unreadable entries
+        follow_symlinks (bool): Descend into / report symlinked directories and files
+        folders (list): Optional list that collects every directory crawled, root included
+    """
+    accept = file_filter.matches if file_filter is not None else None
+    visited = set()     # (st_dev, st_ino) of directories, a symlink back up the tree is entered once
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            if follow_symlinks:
+                st = os.stat(folder)
+                if st.st_ino and (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+            with os.scandir(folder) as entries:
+                if folders is not None:
+                    folders.append(folder)
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=follow_symlinks):
+                            stack.append(entry.path)
+                            continue
+                        if not entry.is_file(follow_symlinks=follow_symlinks):
+                            continue
+                        if accept is not None and not accept(entry.name):
+                            continue
+                        st = entry.stat(follow_symlinks=follow_symlinks)
+                        if st.st_ino == 0:
+                            # Windows DirEntry stats leave st_ino/st_dev empty
+                            st = os.stat(entry.path, follow_symlinks=follow_symlinks)
+                    except OSError as e:
+                        if errors is not None:
+                            errors.append(f"Error reading {entry.path}: {e}")
+                        continue
+                    yield FileRecord.from_stat(entry.path, st)
+        except OSError as e:
+            if errors is not None:
+                errors.append(f"Error reading {folder}: {e}")
+
+
+def stat_paths(paths, errors=None):
+    """FileRecords for an explicit list of paths, skipping ones that can't be stat'ed"""
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if errors is not None:
+                errors.append(f"Error reading {path}: {e}")
+            continue
+        yield FileRecord.from_stat(path, st)
+
+
+def collapse_hardlinks(records, links):
+    """
+    Yield one record per inode, so hardlinked paths are hashed and reported once
+
+    Args:
+        records (iterable): FileRecords
+        links (dict): Filled with first_path -> [other paths linked to the same inode]
+    """
+    seen = {}
+    for record in records:
+        # Only multiply-linked inodes can repeat, so the seen map stays small
+        if record.nlink > 1:
+            key = (record.dev, record.inode)
+            first = seen.get(key)
+            if first is not None:
+                links.setdefault(first, []).append(record.path)
+                continue
+            seen[key] = record.path
+        yield record
@@ -0,0 +1,176 @@
+#fynd_decode
+#Streaming audio decode through an ffmpeg pipe.
+#ffmpeg writes 16-bit PCM to a pipe and the caller gets it back in blocks of
+#at most block_size bytes, read into one reusable buffer. A worker never holds
+#more than one block of audio, however long the track is, and the hash is
+#updated as the audio arrives instead of after the whole track is in RAM.
+#The number of decoders running at once is capped with DecoderSlots.
+
+import os
+import struct
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from fynd_engine import ScanCancelled
+from fynd_hashers import new_hasher
+
+DECODE_BLOCK = 256 * 1024           # Largest block of PCM held per decoder
+DEFAULT_DECODERS = max(1, os.cpu_count() or 1)
+WAV_HEADER_LIMIT = 64 * 1024        # A WAV header from ffmpeg is well below this, more means it isn't one
+
+
+class DecodeError(Exception):
+    """ffmpeg is missing or could not decode a file, the message is shown in the error log"""
+
+
+def ffmpeg_path():
+    return shutil.which("ffmpeg")
+
+
+def stream_pcm(file_path, block_size=DECODE_BLOCK, rate=None, channels=None, seconds=None, cancel_event=None,
+               wav=False):
+    """
+    Decode a file to signed 16-bit little-endian PCM and yield it block by block
+
+    Each block is a memoryview into the same buffer, it is only valid until the next one is requested.
+
+    Args:
+        file_path (str): Any file ffmpeg can read
+        block_size (int): Largest block yielded, also the memory held for audio
+        rate (int): Resample to this rate, None keeps the file's rate
+        channels (int): Mix to this many channels, None keeps the file's channels
+        seconds (float): Only decode this much from the start
+        cancel_event (threading.Event): Set it to stop the decoder, raises ScanCancelled
+        wav (bool): Write a WAV header before the samples, it tells the rate and channel count
+    """
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None:
+        raise DecodeError("ffmpeg is not installed, audio can't be decoded")
+    cmd = [ffmpeg, "-v", "error", "-nostdin", "-i", file_path]
+    if seconds:
+        cmd += ["-t", str(seconds)]
+    if channels:
+        cmd += ["-ac", str(channels)]
+    if rate:
+        cmd += ["-ar", str(rate)]
+    if wav:
+        # bitexact keeps the encoder tag out of the header, the samples are the same either way
+        cmd += ["-map_metadata", "-1", "-fflags", "+bitexact", "-c:a", "pcm_s16le", "-f", "wav", "-"]
+    else:
+        cmd += ["-f", "s16le", "-"]
+
+    # stderr goes to a file, a chatty decoder must not block on a full pipe nobody reads
+    with tempfile.TemporaryFile() as log:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, bufsize=0)
+        view = memoryview(bytearray(block_size))
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ScanCancelled()
+                n = proc.stdout.readinto(view)
+                if not n:
+                    break
+                yield view[:n]
+            returncode = proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+        if returncode != 0:
+            log.seek(0)
+            lines = log.read().decode('utf-8', 'replace').strip().splitlines()
+            raise DecodeError(f"Error decoding {file_path}: {lines[-1] if lines else f'ffmpeg exited with {returncode}'}")
+
+
+def decode_digest(file_path, algorithm, hasher=None, cancel_event=None, **options):
+    """
+    Hash the decoded audio of a file while it streams in
+
+    Args:
+        algorithm (str): Registered hasher name, ignored if hasher is given
+        hasher: Hash object to update instead of a new one
+        **options: Passed on to stream_pcm
+
+    Returns:
+        tuple: (hexdigest, bytes of PCM decoded)
+    """
+    hasher = hasher or new_hasher(algorithm)
+    nbytes = 0
+    for block in stream_pcm(file_path, cancel_event=cancel_event, **options):
+        hasher.update(block)
+        nbytes += len(block)
+    return hasher.hexdigest(), nbytes
+
+
+def parse_wav_header(data):
+    """(sample rate, channels, offset of the samples) from the start of a WAV stream, None if more is needed"""
+    if len(data) >= 12 and (data[:4] != b"RIFF" or data[8:12] != b"WAVE"):
+        raise DecodeError("ffmpeg did not write a WAV stream")
+    fmt = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, size = data[position:position + 4], struct.unpack_from("<I", data, position + 4)[0]
+        if chunk_id == b"fmt ":
+            if position + 16 > len(data):
+                return None
+            channels, rate = struct.unpack_from("<HI", data, position + 10)
+            fmt = rate, channels
+        elif chunk_id == b"data":
+            if fmt is None or not fmt[1]:
+                raise DecodeError("WAV stream without a format chunk")
+            return fmt + (position + 8,)
+        position += 8 + size + (size & 1)
+    return None
+
+
+def decode_identity(file_path, cancel_event=None):
+    """
+    MD5 of a file's decoded 16-bit samples, with their rate and count
+
+    The MD5 is the one FLAC encoders store in STREAMINFO, so a FLAC, WAV or ALAC copy of the
+    same audio gives the same triple whichever way it was obtained.
+
+    Returns:
+        tuple: (md5 hexdigest, sample rate, samples per channel)
+    """
+    hasher = hashlib.md5()
+    header = bytearray()
+    fmt = None
+    nbytes = 0
+    for block in stream_pcm(file_path, cancel_event=cancel_event, wav=True):
+        if fmt is None:
+            header += block
+            fmt = parse_wav_header(header)
+            if fmt is None:
+                if len(header) > WAV_HEADER_LIMIT:
+                    raise DecodeError(f"Error decoding {file_path}: no audio in ffmpeg's output")
+                continue
+            block = memoryview(header)[fmt[2]:]
+        hasher.update(block)
+        nbytes += len(block)
+    if fmt is None:
+        raise DecodeError(f"Error decoding {file_path}: no audio in ffmpeg's output")
+    rate, channels, _ = fmt
+    return hasher.hexdigest(), rate, nbytes // (2 * channels)
+
+
+class DecoderSlots:
+    def __init__(self, decoders=DEFAULT_DECODERS):
+        """
+        Cap on decoders running at once, shared by all worker threads
+
+        Args:
+            decoders (int): Decoder processes allowed in parallel; audio memory is at most decoders * DECODE_BLOCK
+        """
+        self.decoders = max(1, decoders)
+        self.slots = threading.BoundedSemaphore(self.decoders)
+
+    def __enter__(self):
+        self.slots.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release()
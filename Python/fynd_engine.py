@@ -0,0 +1,436 @@
+#fynd_engine
+#Staged duplicate detection engine used by the DupliFynder front ends.
+#Files are grouped by size first, then by a small head/tail sample, and only
+#files that still collide after that are hashed in full. Small groups are
+#compared byte-by-byte in lock-step instead, which stops at the first
+#differing chunk.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fynd_crawl import crawl, stat_paths, collapse_hardlinks, ExtensionFilter
+from fynd_hashers import new_hasher, default_hasher, is_safe, hash_file, hash_head_tail, update_from_file, FAST_HASHER
+
+SAMPLE_SIZE = 64 * 1024     # Bytes read from each end of a file in the sample stage
+LOCKSTEP_MAX_GROUP = 3      # Groups up to this size are compared instead of hashed
+LOCKSTEP_FIRST_CHUNK = 64 * 1024
+LOCKSTEP_MAX_CHUNK = 4 * 1024 * 1024
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+class ScanCancelled(Exception):
+    """Raised by DuplicateScanner.scan when its cancel event is set"""
+
+
+class StageStats:
+    """Counters for one stage of the duplicate pipeline"""
+
+    def __init__(self, name):
+        self.name = name
+        self.files_in = 0       # Files that entered the stage
+        self.files_out = 0      # Files still in a candidate group after the stage
+        self.groups_out = 0     # Candidate groups left after the stage
+        self.bytes_read = 0     # Bytes read from disk during the stage
+        self.files_compared = 0 # Files settled by lock-step comparison instead of hashing
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "files_in": self.files_in,
+            "files_out": self.files_out,
+            "groups_out": self.groups_out,
+            "bytes_read": self.bytes_read,
+            "files_compared": self.files_compared,
+        }
+
+
+class DuplicateScanner:
+    def __init__(self, sample_size=SAMPLE_SIZE, progress=None, cache=None,
+                 workers=DEFAULT_WORKERS, cancel_event=None, sample_hasher=FAST_HASHER, full_hasher=None,
+                 lockstep_max=LOCKSTEP_MAX_GROUP, collapse_links=True):
+        """
+        Initialize the scanner
+
+        Args:
+            sample_size (int): Bytes hashed from the start and end of each file in the sample stage
+            progress (callable): Optional callback progress(done, total, stage_name), called from the scanning thread
+            cache (HashCache): Optional persistent digest cache
+            workers (int): Number of threads hashing files concurrently
+            cancel_event (threading.Event): Set it to abort the scan with ScanCancelled
+            sample_hasher (str): Algorithm for the head/tail sample stage, may be non-cryptographic
+            full_hasher (str): Algorithm that decides identity, defaults to the benchmarked default
+            lockstep_max (int): Largest group compared in lock-step in the full stage, 0 always hashes
+            collapse_links (bool): Treat paths sharing (st_dev, st_ino) as one file, see hardlinks
+        """
+        self.sample_size = sample_size
+        self.progress = progress
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.cancel_event = cancel_event or threading.Event()
+        self.sample_hasher = sample_hasher
+        self.full_hasher = full_hasher or default_hasher()
+        self.lockstep_max = lockstep_max
+        self.collapse_links = collapse_links
+        if not is_safe(self.full_hasher):
+            raise ValueError(f"'{self.full_hasher}' is not collision resistant enough for the full hash stage")
+        self.stats = []
+        self.errors = []
+        self.file_stats = {}
+        self.hardlinks = {}     # path in a result group -> other paths linked to the same inode
+        self.delta = None       # ScanDelta of the last scan_incremental
+
+    def scan(self, file_paths):
+        """Return a list of duplicate groups (lists of paths) for the given files"""
+        self.errors = []
+        return self.scan_records(stat_paths(file_paths, self.errors), total=len(file_paths))
+
+    def scan_folder(self, folder, file_filter=None):
+        """Crawl folder and return its duplicate groups"""
+        self.errors = []
+        return self.scan_records(crawl(folder, file_filter, self.errors))
+
+    def scan_records(self, records, total=0):
+        """
+        Return duplicate groups for an iterable of FileRecords
+
+        Args:
+            records (iterable): FileRecords, e.g. straight from fynd_crawl.crawl
+            total (int): Number of records if known, 0 reports the size stage as open-ended
+        """
+        self.stats = []
+        self.file_stats = {}
+        self.hardlinks = {}
+
+        if self.collapse_links:
+            records = collapse_hardlinks(records, self.hardlinks)
+        return [sorted(paths) for _, paths in self.run_stages(records, total)]
+
+    def scan_incremental(self, state, folder, file_filter=None, verify_files=False):
+        """
+        Rescan folder against a saved ScanState and patch the previous duplicate groups
+
+        Only folders whose mtime changed are listed again, and only sizes touched by added,
+        removed or changed files go back through the pipeline; every other group is kept as saved.
+        The first scan of a folder (or one with different settings) runs the whole pipeline.
+
+        Args:
+            state (ScanState): Saved tree and groups, updated in place
+            folder (str): Directory to scan
+            file_filter (ExtensionFilter): Optional filter on file names
+            verify_files (bool): Also stat files in unchanged folders to catch in-place rewrites
+        """
+        self.errors = []
+        self.stats = []
+        self.file_stats = {}
+        self.hardlinks = {}
+        file_filter = file_filter or ExtensionFilter()
+
+        records, self.delta = state.refresh(folder, self.errors, verify_files)
+        self.check_cancelled()
+        if not file_filter.accepts_all:
+            records = [record for record in records if file_filter.matches(os.path.basename(record.path))]
+        if self.collapse_links:
+            # Links are collected over the whole tree so kept groups still show theirs
+            records = list(collapse_hardlinks(records, self.hardlinks))
+        # Kept groups never reach the size stage, so their records are registered here
+        self.file_stats = {record.path: record for record in records}
+
+        signature = self.state_signature(file_filter)
+        saved = state.load_groups(folder, signature)
+        if saved is None:
+            groups = self.run_stages(records, len(records))
+        else:
+            affected = self.delta.affected_sizes()
+            changed = [record for record in records if record.size in affected]
+            kept = [(size, paths) for size, paths in saved if size not in affected]
+            groups = kept + self.run_stages(changed, len(changed))
+
+        groups = [(size, sorted(paths)) for size, paths in groups]
+        state.commit(folder, signature, groups, self.delta)
+        return [paths for _, paths in groups]
+
+    def state_signature(self, file_filter):
+        """Everything that changes grouping results, saved next to the groups"""
+        return (f"{file_filter.signature()};links={int(self.collapse_links)};"
+                f"{self.cache_kind('full')}")
+
+    def run_stages(self, records, total=0):
+        """Size, sample and full stages over already collapsed records, returns [(size, paths)]"""
+        groups = self.group_by_size(records, total)
+        groups = self.refine(groups, "sample", self.sample_key)
+        return self.refine(groups, "full", self.full_key)
+
+    def group_by_size(self, records, total=0):
+        """Stage 1: bucket files by size and drop sizes that only occur once"""
+        stats = StageStats("size")
+        self.stats.append(stats)
+
+        by_size = {}
+        for idx, record in enumerate(records, 1):
+            self.check_cancelled()
+            stats.files_in += 1
+            # Keep the record so later stages can validate cache entries without another syscall
+            self.file_stats[record.path] = record
+            by_size.setdefault(record.size, []).append(record.path)
+            self.report(idx, total, stats.name)
+
+        groups = [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+        self.finish_stage(stats, groups)
+        return groups
+
+    def refine(self, groups, name, key_func):
+        """Split every candidate group by key_func and drop keys that only occur once"""
+        stats = StageStats(name)
+        self.stats.append(stats)
+
+        # A job is either one file to key, or (full stage only) a small group to compare in lock-step
+        jobs = []
+        for group_idx, (size, paths) in enumerate(groups):
+            if name == "full" and self.use_lockstep(size, paths):
+                jobs.append((group_idx, size, paths))
+            else:
+                jobs.extend((group_idx, size, [path]) for path in paths)
+        total = sum(len(paths) for _, paths in groups)
+        buckets = [{} for _ in groups]
+
+        def run_job(job):
+            group_idx, size, paths = job
+            if self.cancel_event.is_set():
+                return job, [], 0
+            if len(paths) > 1:
+                keyed, nbytes = self.lockstep_group(paths, size)
+                return job, keyed, nbytes
+            key, nbytes = self.cached_key(paths[0], size, name, key_func)
+            return job, [(paths[0], key)], nbytes
+
+        # Hashing happens on the pool, results are merged here so counters need no locking
+        pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 and len(jobs) > 1 else None
+        done = 0
+        try:
+            results = pool.map(run_job, jobs) if pool else map(run_job, jobs)
+            for (group_idx, size, paths), keyed, nbytes in results:
+                self.check_cancelled()
+                done += len(paths)
+                stats.files_in += len(paths)
+                stats.bytes_read += nbytes
+                if len(paths) > 1:
+                    stats.files_compared += len(paths)
+                self.report(done, total, name)
+                for path, key in keyed:
+                    if key is not None:
+                        buckets[group_idx].setdefault(key, []).append(path)
+        finally:
+            if pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        refined = []
+        for (size, _), group_buckets in zip(groups, buckets):
+            refined.extend((size, members) for members in group_buckets.values() if len(members) > 1)
+
+        self.finish_stage(stats, refined)
+        return refined
+
+    def cached_key(self, path, size, name, key_func):
+        """Look the stage key up in the cache before reading the file, returns (key, bytes_read)"""
+        if self.cache is None:
+            return key_func(path, size)
+        st = self.file_stats[path]
+        kind = self.cache_kind(name)
+        key = self.cache.get(path, st, kind)
+        if key is not None:
+            return key, 0
+        key, nbytes = key_func(path, size)
+        if key is not None:
+            self.cache.put(path, st, kind, key)
+        return key, nbytes
+
+    def cache_kind(self, stage_name):
+        return f"{stage_name}:{self.sample_size}:{self.sample_hasher}:{self.full_hasher}"
+
+    def use_lockstep(self, size, paths):
+        """Small groups of files the sample stage didn't already fully cover go to lock-step comparison"""
+        return len(paths) <= self.lockstep_max and size > 2 * self.sample_size
+
+    def lockstep_group(self, paths, size):
+        """Key a small group, using cached full digests and comparing only what the cache can't settle"""
+        keyed = {}
+        uncached = []
+        kind = self.cache_kind("full")
+        for path in paths:
+            digest = self.cache.get(path, self.file_stats[path], kind) if self.cache is not None else None
+            if digest is not None:
+                keyed[path] = digest
+            else:
+                uncached.append(path)
+        if not uncached:
+            return list(keyed.items()), 0
+
+        # New or changed files are compared with each other and with one member per cached digest
+        representatives = {}
+        for path, digest in keyed.items():
+            representatives.setdefault(digest, path)
+        compared, nbytes = self.lockstep_keys(uncached + list(representatives.values()), size, set(keyed))
+        keyed.update(compared)
+        return list(keyed.items()), nbytes
+
+    def lockstep_keys(self, paths, size, cached=()):
+        """
+        Read a small group chunk by chunk in lock-step and split it as soon as members diverge
+
+        Each surviving partition is hashed once (from one member's chunks) along the way, so files
+        that turn out identical end with a real full digest that goes into the cache. With a cache,
+        a file that splits off alone is hashed to the end as well, otherwise every rescan of an
+        unchanged tree would read it again; files in cached already have a valid digest and aren't.
+
+        Returns:
+            tuple: ([(path, full_digest)], bytes_read) for the members that got a digest
+        """
+        files = {}
+        diverged = []       # (path, hasher up to where it split off), finished once the comparison is over
+        nbytes = 0
+        try:
+            for path in paths:
+                try:
+                    files[path] = open(path, 'rb', buffering=0)
+                except OSError as e:
+                    self.errors.append(f"Error reading {path}: {e}")
+            partitions = [(list(files), new_hasher(self.full_hasher))] if len(files) > 1 else []
+            chunk_size = LOCKSTEP_FIRST_CHUNK
+            offset = 0
+            while partitions and offset < size:
+                if self.cancel_event.is_set():
+                    return [], nbytes
+                next_partitions = []
+                for members, hasher in partitions:
+                    # Split members by the content of this chunk, comparing against one representative each
+                    splits = []
+                    for path in members:
+                        try:
+                            data = files[path].read(chunk_size)
+                        except OSError as e:
+                            self.errors.append(f"Error reading {path}: {e}")
+                            continue
+                        nbytes += len(data)
+                        for split in splits:
+                            if split[0] == data:
+                                split[1].append(path)
+                                break
+                        else:
+                            splits.append((data, [path]))
+                    survivors = [split for split in splits if len(split[1]) > 1]
+                    if self.cache is not None:
+                        for data, split_members in splits:
+                            if len(split_members) == 1 and split_members[0] not in cached:
+                                split_hasher = hasher.copy()
+                                split_hasher.update(data)
+                                diverged.append((split_members[0], split_hasher))
+                    for data, split_members in survivors:
+                        split_hasher = hasher.copy() if len(survivors) > 1 else hasher
+                        split_hasher.update(data)
+                        next_partitions.append((split_members, split_hasher))
+                partitions = next_partitions
+                offset += chunk_size
+                # Files that match early tend to match all the way, so read bigger chunks as we go
+                chunk_size = min(chunk_size * 2, LOCKSTEP_MAX_CHUNK)
+            finished = list(partitions)
+            for path, hasher in diverged:
+                try:
+                    nbytes += update_from_file(hasher, files[path], cancel_event=self.cancel_event)
+                except OSError as e:
+                    self.errors.append(f"Error reading {path}: {e}")
+                    continue
+                if self.cancel_event.is_set():
+                    return [], nbytes
+                finished.append(([path], hasher))
+        finally:
+            for f in files.values():
+                f.close()
+
+        keyed = []
+        kind = self.cache_kind("full")
+        for members, hasher in finished:
+            digest = hasher.hexdigest()
+            for path in members:
+                keyed.append((path, digest))
+                if self.cache is not None:
+                    self.cache.put(path, self.file_stats[path], kind, digest)
+        return keyed, nbytes
+
+    def cache_counters(self):
+        if self.cache is None:
+            return {"cache_hits": 0, "cache_misses": 0}
+        return self.cache.counters()
+
+    def sample_key(self, path, size):
+        """Stage 2: hash the first and last sample_size bytes of a file"""
+        if size == 0:
+            return "empty", 0
+        try:
+            if size <= 2 * self.sample_size:
+                # The sample covers the whole file, so this is already a full hash
+                digest, nbytes = hash_file(path, self.full_hasher)
+                return "full:" + digest, nbytes
+            digest, nbytes = hash_head_tail(path, self.sample_hasher, self.sample_size)
+        except OSError as e:
+            self.errors.append(f"Error reading {path}: {e}")
+            return None, 0
+        return "sample:" + digest, nbytes
+
+    def full_key(self, path, size):
+        """Stage 3: hash the whole file, skipping files the sample stage already covered"""
+        if size == 0 or size <= 2 * self.sample_size:
+            return "covered", 0
+        try:
+            digest, nbytes = hash_file(path, self.full_hasher, cancel_event=self.cancel_event)
+        except OSError as e:
+            self.errors.append(f"Error reading {path}: {e}")
+            return None, 0
+        if self.cancel_event.is_set():
+            return None, nbytes
+        return digest, nbytes
+
+    def finish_stage(self, stats, groups):
+        stats.groups_out = len(groups)
+        stats.files_out = sum(len(paths) for _, paths in groups)
+
+    def links_of(self, path):
+        """Other paths that are hardlinks of path (not reclaimable copies)"""
+        return self.hardlinks.get(path, [])
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ScanCancelled()
+
+    def report(self, done, total, stage_name):
+        if self.progress:
+            self.progress(done, total, stage_name)
+
+    def bytes_read(self):
+        return sum(stats.bytes_read for stats in self.stats)
+
+
+def format_size(num_bytes):
+    """Human readable byte count"""
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ("KB", "MB", "GB", "TB"):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == "TB":
+            return f"{num_bytes:.1f} {unit}"
+
+
+def format_stage_report(stats_list):
+    """One line per stage with file counts and bytes read"""
+    lines = []
+    for stats in stats_list:
+        line = (
+            f"{stats.name:>6}: {stats.files_in} files in, {stats.files_out} files left in "
+            f"{stats.groups_out} groups out, {format_size(stats.bytes_read)} read"
+        )
+        if stats.files_compared:
+            line += f" ({stats.files_compared} files compared in lock-step)"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,192 @@
+#fynd_fingerprint
+#Acoustic fingerprints for finding the same recording in different encodings.
+#The first FP_SECONDS of a track are decoded by ffmpeg to mono 5512 Hz,
+#cut into overlapping frames and reduced with NumPy to the log energy of 33
+#bands between 300 and 2000 Hz. Averaged over 16 time segments and
+#normalised, that gives a 528-value vector which barely moves under
+#re-encoding, bitrate changes or a few ms of encoder padding, so an mp3 and
+#a flac of the same recording end up close together.
+#
+#FingerprintIndex files the vectors under random-hyperplane (SimHash) keys
+#in several tables. A new track is only compared with the tracks sharing a
+#bucket in one of the tables, so matching stays sublinear in the library size.
+#
+#NumPy and ffmpeg are optional, fingerprint() raises FingerprintError or
+#DecodeError without them.
+
+import base64
+from fynd_decode import stream_pcm, ffmpeg_path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FP_RATE = 5512              # Decode rate, everything above 2.7 kHz is dropped
+FP_SECONDS = 90             # Length of the decoded window from the start of the track
+MIN_SECONDS = 5             # Shorter tracks are not fingerprinted
+FRAME_SIZE = 2048           # Samples per analysis frame (0.37 s)
+HOP_SIZE = 256              # Samples between frames
+BANDS = 33
+BAND_LOW = 300.0
+BAND_HIGH = 2000.0
+SEGMENTS = 16
+VECTOR_SIZE = BANDS * SEGMENTS
+LSH_TABLES = 10
+LSH_BITS = 12
+LSH_SEED = 0x46594E44       # Fixed, so keys stay comparable between runs
+MATCH_THRESHOLD = 0.90      # Cosine similarity for two tracks to count as the same recording
+
+
+class FingerprintError(Exception):
+    """A track that could not be fingerprinted, the message is shown in the error log"""
+
+
+def fingerprints_available():
+    return np is not None and ffmpeg_path() is not None
+
+
+def decode_window(file_path, seconds=FP_SECONDS, rate=FP_RATE, cancel_event=None):
+    """Mono float32 samples of the first seconds of a track, streamed from ffmpeg into one array"""
+    samples = np.empty(int(seconds * rate), dtype="<i2")
+    raw = samples.view(np.uint8)
+    filled = 0
+    for block in stream_pcm(file_path, rate=rate, channels=1, seconds=seconds, cancel_event=cancel_event):
+        n = min(len(block), len(raw) - filled)
+        raw[filled:filled + n] = block[:n]
+        filled += n
+    return samples[:filled // 2].astype(np.float32) / 32768.0
+
+
+def band_matrix(rate=FP_RATE):
+    """(FFT bins x BANDS) 0/1 matrix summing the power spectrum into log-spaced bands"""
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / rate)
+    edges = np.geomspace(BAND_LOW, BAND_HIGH, BANDS + 1)
+    band_of = np.searchsorted(edges, freqs, side="right") - 1
+    matrix = np.zeros((len(freqs), BANDS), dtype=np.float32)
+    inside = (band_of >= 0) & (band_of < BANDS)
+    matrix[np.nonzero(inside)[0], band_of[inside]] = 1.0
+    return matrix
+
+
+def band_energies(samples, rate=FP_RATE):
+    """Log band energy per frame, shape (frames, BANDS)"""
+    if len(samples) < FRAME_SIZE:
+        raise FingerprintError("Track is too short to fingerprint")
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1)) ** 2
+    return np.log10(spectrum @ band_matrix(rate) + 1e-10)
+
+
+def summary_vector(energies):
+    """Unit vector of the band energies averaged per time segment, with level and EQ removed"""
+    segments = np.stack([part.mean(axis=0) for part in np.array_split(energies, SEGMENTS)])
+    # Per-band means carry the encoder's EQ, per-segment means the loudness, neither says which song it is
+    segments = segments - segments.mean(axis=0)
+    segments = segments - segments.mean(axis=1, keepdims=True)
+    vector = segments.ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        raise FingerprintError("Track is silent")
+    return (vector / norm).astype(np.float32)
+
+
+def fingerprint(file_path, cancel_event=None):
+    """Fingerprint vector of a track, raises FingerprintError or DecodeError if it can't be computed"""
+    if np is None:
+        raise FingerprintError("numpy is not installed, fingerprints can't be computed")
+    samples = decode_window(file_path, cancel_event=cancel_event)
+    if len(samples) < MIN_SECONDS * FP_RATE:
+        raise FingerprintError(f"{file_path} is shorter than {MIN_SECONDS} s")
+    return summary_vector(band_energies(samples))
+
+
+def encode_vector(vector):
+    """Compact text form for the digest cache"""
+    return base64.b64encode(vector.astype(np.float16).tobytes()).decode('ascii')
+
+
+def decode_vector(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float16).astype(np.float32)
+
+
+class FingerprintIndex:
+    def __init__(self, tables=LSH_TABLES, bits=LSH_BITS, threshold=MATCH_THRESHOLD, seed=LSH_SEED):
+        """
+        Initialize an empty index
+
+        Args:
+            tables (int): Hash tables, more tables find more matches at the cost of more candidates
+            bits (int): Hyperplanes per table, more bits make buckets smaller
+            threshold (float): Cosine similarity a candidate needs to count as a match
+            seed (int): Seed for the hyperplanes, indexes only agree when they share it
+        """
+        if np is None:
+            raise RuntimeError("numpy is not installed, fingerprints can't be indexed")
+        rng = np.random.default_rng(seed)
+        self.tables = tables
+        self.bits = bits
+        self.threshold = threshold
+        self.planes = rng.standard_normal((tables * bits, VECTOR_SIZE)).astype(np.float32)
+        self.weights = 1 << np.arange(bits, dtype=np.int64)
+        self.buckets = [{} for _ in range(tables)]
+        self.keys = []
+        self.vectors = np.empty((1024, VECTOR_SIZE), dtype=np.float16)
+        self.parent = []            # Union-find over matches, for groups()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def hash_keys(self, vector):
+        signs = (self.planes @ vector) > 0
+        return signs.reshape(self.tables, self.bits).astype(np.int64) @ self.weights
+
+    def match_ids(self, vector, hash_keys):
+        """[(position, similarity)] of indexed tracks matching vector, best first"""
+        candidates = set()
+        for table, hash_key in zip(self.buckets, hash_keys):
+            candidates.update(table.get(int(hash_key), ()))
+        if not candidates:
+            return []
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = self.vectors[ids].astype(np.float32) @ vector
+        hits = [(int(i), float(score)) for i, score in zip(ids, scores) if score >= self.threshold]
+        return sorted(hits, key=lambda hit: -hit[1])
+
+    def query(self, vector):
+        """[(key, similarity)] of indexed tracks matching vector, best first"""
+        return [(self.keys[i], score) for i, score in self.match_ids(vector, self.hash_keys(vector))]
+
+    def add(self, key, vector):
+        """Index a track and return its matches among the tracks added before it"""
+        hash_keys = self.hash_keys(vector)
+        matches = self.match_ids(vector, hash_keys)
+        index = len(self.keys)
+        if index == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+        self.vectors[index] = vector
+        self.keys.append(key)
+        self.parent.append(index)
+        for table, hash_key in zip(self.buckets, hash_keys):
+            table.setdefault(int(hash_key), []).append(index)
+        for match, _ in matches:
+            self.union(index, match)
+        return [(self.keys[i], score) for i, score in matches]
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def groups(self):
+        """Keys of tracks linked by matches, only groups with more than one track"""
+        clusters = {}
+        for i, key in enumerate(self.keys):
+            clusters.setdefault(self.find(i), []).append(key)
+        return [keys for keys in clusters.values() if len(keys) > 1]
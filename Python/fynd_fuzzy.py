@@ -0,0 +1,320 @@
+#fynd_fuzzy
+#Fuzzy artist/title matching for the music finders.
+#Tags are normalised first: accents, case and punctuation go, "feat." credits
+#are dropped, and qualifiers like "(Remastered 2011)" or "- Radio Edit" are
+#cut from titles. Tags that are equal after that are grouped straight away.
+#The remaining distinct keys are compared fuzzily on character trigrams,
+#but only within blocks. Similar artists are found once among the distinct
+#artist names, then every title is indexed under its rarest trigrams
+#(prefix filtering) together with its artist. Two keys are only scored if
+#their artists are close enough, they share a title block and their titles
+#hold the same numbers ("Symphony No. 5" is not "No. 6"). The prefixes
+#are as short as the threshold allows, so no pair that could match is missed
+#and a 500k track library is scored in a few million pairs instead of 10^11.
+#
+#Usage: python fynd_fuzzy.py --bench [--tracks 200000]
+#       python fynd_fuzzy.py --check
+
+import re
+import sys
+import time
+import math
+import random
+import argparse
+import unicodedata
+
+MATCH_THRESHOLD = 0.8       # Score for two keys to count as the same song
+TITLE_WEIGHT = 0.6          # Share of the score coming from the title, the rest from the artist
+
+# Credits in brackets, or after the first word: "Feat of Clay" and "With or Without You" are titles
+FEATURING = re.compile(r"[\(\[]\s*(feat|ft|featuring|with)\b\.?\s[^\)\]]*[\)\]]?|(?<=\w)[\s,]+(feat|ft|featuring)\b\.?\s.*$")
+NUMBER = re.compile(r"\d+")
+QUALIFIER_WORDS = (r"remaster(ed)?|re-?mastered|\d{4}\s+remaster(ed)?|mono|stereo|deluxe|bonus( track)?|"
+                   r"explicit|clean|radio edit|single version|album version|original mix|digital(ly)? remaster(ed)?|"
+                   r"remastered version|\d{4}\s+version|anniversary edition")
+BRACKETED = re.compile(r"[\(\[][^\)\]]*\b(" + QUALIFIER_WORDS + r")\b[^\)\]]*[\)\]]")
+DASHED = re.compile(r"\s+-\s+[^-]*\b(" + QUALIFIER_WORDS + r")\b.*$")
+APOSTROPHES = re.compile(r"['\u2019`]")
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def fold(text):
+    """Lowercase, accents removed, '&' spelled out"""
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.replace("&", " and ")
+
+
+def clean(text):
+    # "Don't" and "Dont" are the same word, other punctuation separates words
+    return " ".join(NON_WORD.sub(" ", APOSTROPHES.sub("", text)).split())
+
+
+def normalize_artist(artist):
+    text = FEATURING.sub("", fold(artist))
+    text = clean(text)
+    return text[4:] if text.startswith("the ") else text
+
+
+def normalize_title(title):
+    text = fold(title)
+    text = BRACKETED.sub(" ", text)
+    text = DASHED.sub("", text)
+    text = FEATURING.sub("", text)
+    return clean(text)
+
+
+def normalize_key(artist, title):
+    return normalize_artist(artist or ""), normalize_title(title or "")
+
+
+def numbers(text):
+    """Numbers in a title; "No. 5" and "No. 6" or "Part 1" and "Part 2" are different works"""
+    return tuple(int(number) for number in NUMBER.findall(text))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    inter = len(a & b)
+    return inter / (len(a) + len(b) - inter)
+
+
+class FuzzyMatcher:
+    def __init__(self, threshold=MATCH_THRESHOLD, title_weight=TITLE_WEIGHT):
+        """
+        Initialize an empty matcher
+
+        Args:
+            threshold (float): Weighted title/artist trigram similarity for a match
+            title_weight (float): Share of the similarity taken from the title
+        """
+        self.threshold = threshold
+        self.title_weight = title_weight
+        self.keys = {}              # normalised key -> position
+        self.members = []           # position -> [original keys]
+        self.candidates = 0         # Pairs scored in the last group() call
+
+    def add(self, artist, title, key=None):
+        """Register a tag pair; key (default (artist, title)) is what groups() reports"""
+        norm = normalize_key(artist, title)
+        position = self.keys.setdefault(norm, len(self.members))
+        if position == len(self.members):
+            self.members.append([])
+        self.members[position].append(key if key is not None else (artist, title))
+
+    def groups(self):
+        """Lists of keys whose tags match, only groups with more than one key"""
+        norms = list(self.keys)
+        parent = list(range(len(norms)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # A perfect artist can't make up for a title below min_title, and the other way round
+        weight = self.title_weight
+        min_title = (self.threshold - (1 - weight)) / weight - 1e-9 if weight else 0.0
+        min_artist = (self.threshold - weight) / (1 - weight) - 1e-9 if weight < 1 else 0.0
+
+        # Artists repeat a lot, so their neighbours are found once among the distinct names
+        artist_ids = {}
+        for artist, _ in norms:
+            artist_ids.setdefault(artist, len(artist_ids))
+        artist_grams = [trigrams(artist) for artist in artist_ids]
+        neighbours = similar_sets(artist_grams, min_artist)
+        artist_of = [artist_ids[artist] for artist, _ in norms]
+        title_grams = [trigrams(title) for _, title in norms]
+        title_numbers = [numbers(title) for _, title in norms]
+        title_prefixes = prefixes(title_grams, min_title)
+
+        # Blocks are (title prefix gram, artist), looked up under every artist close enough to match
+        index = {}
+        self.candidates = 0
+        for i in sorted(range(len(norms)), key=lambda i: len(title_grams[i])):
+            titles, artist = title_grams[i], artist_of[i]
+            # Sizes are visited in increasing order, so only the lower bound needs checking
+            smallest_title = min_title * len(titles)
+            seen = set()
+            for other, artist_score in neighbours[artist].items():
+                for gram in title_prefixes[i]:
+                    for j in index.get((gram, other), ()):
+                        if j in seen or len(title_grams[j]) < smallest_title:
+                            continue
+                        seen.add(j)
+                        if title_numbers[i] != title_numbers[j]:
+                            continue
+                        self.candidates += 1
+                        score = weight * jaccard(titles, title_grams[j]) + (1 - weight) * artist_score
+                        if score >= self.threshold:
+                            a, b = find(i), find(j)
+                            if a != b:
+                                parent[max(a, b)] = min(a, b)
+            for gram in title_prefixes[i]:
+                index.setdefault((gram, artist), []).append(i)
+
+        clusters = {}
+        for i in range(len(norms)):
+            clusters.setdefault(find(i), []).extend(self.members[i])
+        return [keys for keys in clusters.values() if len(keys) > 1]
+
+
+def fuzzy_groups(groups, threshold=MATCH_THRESHOLD):
+    """
+    Merge {(artist, title): [paths]} groups whose tags match fuzzily
+
+    A merged group is keyed by the tags of its largest member group, groups without a match are kept as they are.
+    """
+    matcher = FuzzyMatcher(threshold)
+    for key in groups:
+        matcher.add(key[0], key[1], key)
+    merged = dict(groups)
+    for keys in matcher.groups():
+        keys.sort(key=lambda key: (-len(groups[key]), key))
+        merged[keys[0]] = [path for key in keys for path in merged.pop(key)]
+    return merged
+
+
+def prefixes(gram_sets, threshold):
+    """
+    The rarest grams of each set that a set with Jaccard >= threshold must share at least one of
+
+    With t = threshold, two sets reaching it share at least t * |x| grams, so any
+    |x| - ceil(t * |x|) + 1 grams of x in a fixed global order include a shared one.
+    """
+    frequency = {}
+    for grams in gram_sets:
+        for gram in grams:
+            frequency[gram] = frequency.get(gram, 0) + 1
+    result = []
+    for grams in gram_sets:
+        ordered = sorted(grams, key=lambda gram: (frequency[gram], gram))
+        result.append(ordered[:len(ordered) - math.ceil(threshold * len(ordered)) + 1])
+    return result
+
+
+def similar_sets(gram_sets, threshold):
+    """
+    For each set, {position: jaccard} of the sets (itself included) with Jaccard >= threshold
+
+    Sets are visited smallest first and looked up in an index of the earlier sets' prefixes.
+    """
+    result = [{i: 1.0} for i in range(len(gram_sets))]
+    index = {}
+    for i, prefix in sorted(enumerate(prefixes(gram_sets, threshold)), key=lambda item: len(gram_sets[item[0]])):
+        grams = gram_sets[i]
+        seen = set()
+        for gram in prefix:
+            for j in index.get(gram, ()):
+                if j in seen or len(gram_sets[j]) < threshold * len(grams):
+                    continue
+                seen.add(j)
+                score = jaccard(grams, gram_sets[j])
+                if score >= threshold:
+                    result[i][j] = result[j][i] = score
+            index.setdefault(gram, []).append(i)
+    return result
+
+
+# (tags, tags, same song?) pairs that --check runs through normalisation and matching
+CHECK_CASES = [
+    (("Drake", "Hold On (with Majid Jordan)"), ("Drake", "Hold On"), True),
+    (("Drake feat. Rihanna", "Take Care"), ("Drake", "Take Care ft. Rihanna"), True),
+    (("The Beatles", "Let It Be (Remastered 2009)"), ("Beatles", "Let It Be - 2009 Remaster"), True),
+    (("Beyoncé", "Don't Hurt Yourself [Explicit]"), ("Beyonce", "Dont Hurt Yourself"), True),
+    (("U2", "With or Without You"), ("U2", "With a Shout"), False),
+    (("Billy Idol", "Dancing with Myself"), ("Billy Idol", "Dancing with the Stars"), False),
+    (("Simon with Garfunkel", "The Boxer"), ("Simon", "The Boxer"), False),
+    (("Beethoven", "Symphony No. 5"), ("Beethoven", "Symphony No. 6"), False),
+    (("Beethoven", "Symphony No. 5 in C minor, Op. 67"), ("Beethoven", "Symphony No 5 in C Minor Op 67"), True),
+    (("Band", "Song Part 1"), ("Band", "Song Part 2"), False),
+    (("Band", "Feat of Strength"), ("Band", "Feat of Clay"), False),
+    (("Band", "Ft. Worth Blues"), ("Band", "Ft. Lauderdale Blues"), False),
+    (("Band ft. Singer", "Song (feat. Singer)"), ("Band", "Song"), True),
+]
+
+
+def check():
+    """Run CHECK_CASES, returns the cases that came out wrong"""
+    wrong = []
+    for first, second, same in CHECK_CASES:
+        matcher = FuzzyMatcher()
+        matcher.add(*first)
+        matcher.add(*second)
+        if bool(matcher.groups()) != same:
+            wrong.append((first, second, same))
+    return wrong
+
+
+def make_bench_tags(tracks, seed=1):
+    """Synthetic library: songs with re-tagged variants (feat., remaster notes, typos, punctuation)"""
+    rng = random.Random(seed)
+    letters = "etaoinshrdlucmfwypvbgkjqxz"
+    vocabulary = ["".join(rng.choice(letters[:rng.randint(8, 26)]) for _ in range(rng.randint(2, 9)))
+                  for _ in range(20000)]
+    # Word use is skewed like real titles, a few words turn up everywhere
+    word = lambda: vocabulary[int(len(vocabulary) * rng.random() ** 3)]
+    # About ten tracks per artist, some artists with far more
+    artists = [" ".join(word().capitalize() for _ in range(rng.randint(1, 3))) for _ in range(max(1, tracks // 10))]
+    tags = []
+    while len(tags) < tracks:
+        artist = artists[int(len(artists) * rng.random() ** 2)]
+        title = " ".join(word() for _ in range(rng.randint(1, 4))).title()
+        tags.append((artist, title))
+        if rng.random() < 0.3:
+            variant = rng.choice([
+                (f"{artist} feat. {word().capitalize()}", title),
+                (artist, f"{title} (Remastered {rng.randint(1995, 2020)})"),
+                (artist.upper(), f"{title} - Radio Edit"),
+                (artist, title.replace(" ", ", ", 1) + "!"),
+                (artist, title[:-1] + title[-1] * 2),
+            ])
+            tags.append(variant)
+    return tags[:tracks]
+
+
+def bench(tracks=200000):
+    tags = make_bench_tags(tracks)
+    matcher = FuzzyMatcher()
+    start = time.perf_counter()
+    for artist, title in tags:
+        matcher.add(artist, title)
+    groups = matcher.groups()
+    elapsed = time.perf_counter() - start
+    exact = len({(artist.lower(), title.lower()) for artist, title in tags})
+    return {"tracks": tracks, "seconds": elapsed, "groups": len(groups), "candidates": matcher.candidates,
+            "distinct_exact": exact, "distinct_normalised": len(matcher.keys)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzzy artist/title matching for the Fynd music finders")
+    parser.add_argument("--bench", action="store_true", help="group a synthetic library and time it")
+    parser.add_argument("--tracks", type=int, default=200000, help="size of the synthetic library")
+    parser.add_argument("--check", action="store_true", help="match known same and different songs")
+    args = parser.parse_args(argv)
+    if args.check:
+        wrong = check()
+        for first, second, same in wrong:
+            print(f"{first} and {second} should {'' if same else 'not '}match")
+        print(f"{len(CHECK_CASES) - len(wrong)} of {len(CHECK_CASES)} checks passed")
+        return 1 if wrong else 0
+    if not args.bench:
+        parser.print_help()
+        return 0
+    r = bench(args.tracks)
+    print(f"{r['tracks']} tracks in {r['seconds']:.1f} s: {r['distinct_exact']} distinct tags, "
+          f"{r['distinct_normalised']} after normalising, {r['candidates']} pairs scored, {r['groups']} groups")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#fynd_hashers
+#Registry of digest algorithms used by the duplicate finders, plus a small
+#benchmark that measures MB/s on this machine and remembers the fastest
+#safe algorithm as the default.
+#
+#File data is fed to the hashers through a reusable per-thread buffer
+#(readinto + memoryview) or an mmap for big files, so no bytes objects are
+#created per chunk.
+#
+#Usage: python fynd_hashers.py --bench-hashers [--size-mb 256] [--no-save]
+#       python fynd_hashers.py --bench-read [--corpus-mb 512]
+
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".fynd_hashers.json")
+FALLBACK_DEFAULT = "md5"
+FAST_HASHER = "fast64"
+
+MIN_BUFFER = 1024 * 1024            # Smallest read buffer
+MAX_BUFFER = 16 * 1024 * 1024       # Largest read buffer
+MMAP_THRESHOLD = 64 * 1024 * 1024   # Files at least this big are mapped instead of read
+
+_buffers = threading.local()
+
+
+class Fast64:
+    """Non-cryptographic 64-bit digest for pre-filter stages (xxh3 if available, else crc32+adler32)"""
+
+    name = FAST_HASHER
+
+    def __init__(self):
+        if xxhash is not None:
+            self.impl = xxhash.xxh3_64()
+        else:
+            self.impl = None
+            self.crc = 0
+            self.adler = 1
+
+    def update(self, data):
+        if self.impl is not None:
+            self.impl.update(data)
+        else:
+            self.crc = zlib.crc32(data, self.crc)
+            self.adler = zlib.adler32(data, self.adler)
+
+    def hexdigest(self):
+        if self.impl is not None:
+            return self.impl.hexdigest()
+        return f"{self.crc:08x}{self.adler:08x}"
+
+
+# name -> (factory, safe). Safe hashers are collision resistant enough to be the final word on
+# whether two files are identical; the rest are only fit for narrowing down candidates.
+HASHERS = {
+    "md5": (hashlib.md5, True),
+    "sha1": (hashlib.sha1, True),
+    "sha256": (hashlib.sha256, True),
+    "blake2b": (hashlib.blake2b, True),
+    "blake2s": (hashlib.blake2s, True),
+    FAST_HASHER: (Fast64, False),
+}
+
+
+def register_hasher(name, factory, safe=True):
+    """Add an algorithm; factory() must return an object with update() and hexdigest()"""
+    HASHERS[name] = (factory, safe)
+
+
+def available_hashers(safe_only=False):
+    return [name for name, (_, safe) in HASHERS.items() if safe or not safe_only]
+
+
+def hasher_entry(name):
+    """(factory, safe) of a registered algorithm, ValueError listing the choices for any other name"""
+    try:
+        return HASHERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown hash algorithm '{name}', choose from: {', '.join(HASHERS)}") from None
+
+
+def new_hasher(name):
+    """Create a fresh hasher object for the named algorithm"""
+    return hasher_entry(name)[0]()
+
+
+def is_safe(name):
+    return hasher_entry(name)[1]
+
+
+def default_hasher():
+    """Fastest safe algorithm recorded by the last --bench-hashers run, md5 if never benchmarked"""
+    try:
+        with open(CONFIG_PATH) as f:
+            name = json.load(f).get("default")
+    except (OSError, ValueError):
+        return FALLBACK_DEFAULT
+    if name in HASHERS and is_safe(name):
+        return name
+    return FALLBACK_DEFAULT
+
+
+def buffer_size_for(file_size):
+    """Read size for a file: about 1/8 of it, rounded up to a power of two, between 1 and 16 MiB"""
+    target = max(MIN_BUFFER, file_size // 8)
+    size = MIN_BUFFER
+    while size < target and size < MAX_BUFFER:
+        size *= 2
+    return size
+
+
+def get_buffer(size):
+    """Per-thread reusable buffer of at least size bytes, as a memoryview"""
+    view = getattr(_buffers, "view", None)
+    if view is None or len(view) < size:
+        _buffers.view = view = memoryview(bytearray(size))
+    return view
+
+
+def update_from_file(hasher, f, length=None, cancel_event=None):
+    """Feed length bytes (or the rest of the file) from f into hasher, returns bytes read"""
+    remaining = length
+    step = buffer_size_for(os.fstat(f.fileno()).st_size if length is None else length)
+    buf = get_buffer(step)
+    total = 0
+    while remaining is None or remaining > 0:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        want = step if remaining is None else min(step, remaining)
+        n = f.readinto(buf[:want])
+        if not n:
+            break
+        hasher.update(buf[:n])
+        total += n
+        if remaining is not None:
+            remaining -= n
+    return total
+
+
+def update_from_mmap(hasher, f, cancel_event=None):
+    """Feed a whole file into hasher through an mmap, returns bytes hashed"""
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return 0
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, "madvise"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mm)
+        try:
+            total = 0
+            for start in range(0, size, MAX_BUFFER):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                hasher.update(view[start:start + MAX_BUFFER])
+                total += min(MAX_BUFFER, size - start)
+            return total
+        finally:
+            view.release()
+
+
+def hash_file(path, algorithm, use_mmap=None, cancel_event=None):
+    """
+    Hash a whole file without intermediate copies
+
+    Args:
+        path (str): File to hash
+        algorithm (str): Registered hasher name
+        use_mmap (bool): Force (True) or disable (False) mmap, None picks mmap for files >= MMAP_THRESHOLD
+        cancel_event (threading.Event): Stop early when set; the digest is then incomplete
+
+    Returns:
+        tuple: (hexdigest, bytes_read), raises OSError if the file can't be read
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as f:
+        if use_mmap is None:
+            use_mmap = os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD
+        if use_mmap:
+            try:
+                nbytes = update_from_mmap(hasher, f, cancel_event)
+            except (ValueError, OSError):
+                # Some filesystems (and pipes) can't be mapped, fall back to reading
+                f.seek(0)
+                hasher = new_hasher(algorithm)
+                nbytes = update_from_file(hasher, f, cancel_event=cancel_event)
+        else:
+            nbytes = update_from_file(hasher, f, cancel_event=cancel_event)
+    return hasher.hexdigest(), nbytes
+
+
+def hash_head_tail(path, algorithm, part_size):
+    """
+    Hash the first and last part_size bytes of a file (the whole file if it is shorter than both)
+
+    Returns:
+        tuple: (hexdigest, bytes_read), raises OSError if the file can't be read
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= 2 * part_size:
+            nbytes = update_from_file(hasher, f)
+        else:
+            nbytes = update_from_file(hasher, f, part_size)
+            f.seek(-part_size, os.SEEK_END)
+            nbytes += update_from_file(hasher, f, part_size)
+    return hasher.hexdigest(), nbytes
+
+
+def bench_hashers(size_mb=256, names=None, block_size=1024 * 1024):
+    """Hash size_mb of in-memory data with each algorithm and return {name: MB/s}"""
+    block = os.urandom(block_size)
+    blocks = max(1, size_mb * 1024 * 1024 // block_size)
+    results = {}
+    for name in names or HASHERS:
+        hasher = new_hasher(name)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            hasher.update(block)
+        hasher.hexdigest()
+        elapsed = time.perf_counter() - start
+        results[name] = (blocks * block_size / (1024 * 1024)) / max(elapsed, 1e-9)
+    return results
+
+
+def pick_default(results):
+    """Fastest safe algorithm in a bench_hashers result"""
+    safe = {name: speed for name, speed in results.items() if is_safe(name)}
+    return max(safe, key=safe.get) if safe else FALLBACK_DEFAULT
+
+
+def save_default(name):
+    with open(CONFIG_PATH, "w") as f:
+        json.dump({"default": name}, f)
+
+
+def legacy_hash_file(path, algorithm, chunk_size=8192):
+    """The old 8 KiB f.read() loop, kept as the baseline for --bench-read"""
+    hasher = new_hasher(algorithm)
+    nbytes = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+            nbytes += len(chunk)
+    return hasher.hexdigest(), nbytes
+
+
+def make_bench_corpus(folder, corpus_mb):
+    """Mixed corpus: many small documents, some photos, a few large videos"""
+    block = os.urandom(1024 * 1024)
+    budget = corpus_mb * 1024 * 1024
+    layout = [(16 * 1024, 0.10), (3 * 1024 * 1024, 0.30), (200 * 1024 * 1024, 0.60)]
+    paths = []
+    for file_size, share in layout:
+        count = max(1, int(budget * share) // file_size)
+        for i in range(count):
+            path = os.path.join(folder, f"bench_{file_size}_{i}.bin")
+            with open(path, 'wb') as f:
+                remaining = file_size
+                while remaining > 0:
+                    n = min(remaining, len(block))
+                    f.write(block[:n])
+                    remaining -= n
+            paths.append(path)
+    return paths
+
+
+def bench_read(corpus_mb=512, algorithm=FAST_HASHER, folder=None):
+    """Time the legacy, readinto and mmap read paths over a mixed corpus, returns {path_name: MB/s}"""
+    own_folder = folder is None
+    folder = folder or tempfile.mkdtemp(prefix="fynd_bench_")
+    try:
+        paths = make_bench_corpus(folder, corpus_mb)
+        read_paths = {
+            "legacy 8 KiB read": lambda p: legacy_hash_file(p, algorithm),
+            "readinto buffer": lambda p: hash_file(p, algorithm, use_mmap=False),
+            "mmap": lambda p: hash_file(p, algorithm, use_mmap=True),
+            "auto": lambda p: hash_file(p, algorithm),
+        }
+        results = {}
+        for name, func in read_paths.items():
+            # One warm-up pass so every path is measured against the same page cache state
+            for path in paths:
+                func(path)
+            start = time.perf_counter()
+            total = sum(func(path)[1] for path in paths)
+            elapsed = time.perf_counter() - start
+            results[name] = (total / (1024 * 1024)) / max(elapsed, 1e-9)
+        return results
+    finally:
+        if own_folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Digest algorithms for the Fynd duplicate finders")
+    parser.add_argument("--bench-hashers", action="store_true", help="measure MB/s of every registered hasher")
+    parser.add_argument("--size-mb", type=int, default=256, help="amount of data hashed per algorithm")
+    parser.add_argument("--no-save", action="store_true", help="don't store the fastest safe hasher as default")
+    parser.add_argument("--bench-read", action="store_true", help="compare file read paths on a mixed corpus")
+    parser.add_argument("--corpus-mb", type=int, default=512, help="size of the --bench-read corpus")
+    parser.add_argument("--hasher", default=FAST_HASHER, help="algorithm used by --bench-read")
+    args = parser.parse_args(argv)
+
+    if args.bench_read:
+        results = bench_read(args.corpus_mb, args.hasher)
+        baseline = results["legacy 8 KiB read"]
+        for name, speed in results.items():
+            print(f"{name:>18}: {speed:9.1f} MB/s  ({speed / baseline:.2f}x)")
+        return 0
+
+    if not args.bench_hashers:
+        print(f"Default hasher: {default_hasher()}")
+        print(f"Available: {', '.join(available_hashers())}")
+        return 0
+
+    results = bench_hashers(args.size_mb)
+    for name, speed in sorted(results.items(), key=lambda item: -item[1]):
+        tag = "" if is_safe(name) else "  (pre-filter only)"
+        print(f"{name:>8}: {speed:9.1f} MB/s{tag}")
+    best = pick_default(results)
+    print(f"Fastest safe hasher: {best}")
+    if not args.no_save:
+        save_default(best)
+        print(f"Saved as default in {CONFIG_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+#fynd_music
+#GUI-free duplicate music scanner shared by DooPhynd, PyDoopFynd_FH and
+#PyDoopFynd. Files are matched by their tags (artist, title) and/or by
+#content: a head/tail hash of the audio payload with the tags left out, of
+#the raw file, a hash of the decoded audio, or an acoustic fingerprint that
+#also matches other encodings of the same recording.
+#Callers get plain dicts back and are told about progress and errors
+#through callbacks, so the same scan runs in a Tk thread or from cron.
+#
+#The tree is walked once: a crawler thread feeds a bounded queue and the
+#workers start on the first files while the rest is still being listed.
+#Tags come from the header-only reader in fynd_tags, mutagen is only loaded
+#for files it can't handle. Tags missing from the cache are parsed in
+#batches on a process pool instead of under the GIL.
+#With fuzzy_metadata the tag groups are merged afterwards by fynd_fuzzy, so
+#"Title (Remastered 2011)" by "Artist feat. X" joins "Title" by "Artist".
+
+import os
+import json
+import queue
+import struct
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fynd_engine import ScanCancelled
+from fynd_hashers import default_hasher, hash_head_tail
+from fynd_crawl import crawl, collapse_hardlinks, ExtensionFilter
+from fynd_tags import read_tags, hash_payload, flac_identity, pcm_identity, mutagen_available, TagReadError
+from fynd_decode import decode_identity, DecoderSlots, DecodeError, DEFAULT_DECODERS
+from fynd_fingerprint import (fingerprint, encode_vector, decode_vector, fingerprints_available,
+                              FingerprintIndex, FingerprintError)
+from fynd_fuzzy import fuzzy_groups
+
+MUSIC_EXTENSIONS = frozenset(['.mp3', '.flac', '.m4a', '.mp4', '.wav', '.ogg', '.wma', '.aac'])
+HEAD_TAIL_SIZE = 1024 * 1024    # Bytes hashed from each end of a file or payload
+TAGS_KIND = "tags:artist-title-album-duration"
+TAG_BATCH = 128                 # Paths sent to a tag process at once
+QUEUE_SIZE = 1024               # Records the crawler may list ahead of the workers
+MUSIC_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+CONTENT_MODES = ("payload", "file", "audio", "fingerprint")
+NO_TAGS = ()                    # Cached for files without readable tags, so rescans don't parse them again
+# The tag pool starts while the crawler and worker threads run; a forked child could inherit a lock
+# one of them holds, so its processes come from a clean forkserver (spawn where there is none)
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def tags_or_error(file_path):
+    """
+    (tags, error message or None), never raises
+
+    Files without tags, and files whose tags can't be read, get NO_TAGS: that answer holds until the
+    file changes, so it is cached like tags are. Tags are None only for errors that may go away,
+    like a file that can't be opened.
+    """
+    try:
+        return read_tags(file_path) or NO_TAGS, None
+    except TagReadError as e:
+        return NO_TAGS, str(e)
+    except Exception as e:
+        return None, f"Error processing {file_path}: {str(e)}"
+
+
+def read_tags_batch(paths):
+    """
+    Process pool job: read the tags of a batch of files
+
+    Returns:
+        tuple: ([(path, tags)], [error messages]), errors stay together so the caller logs them in one go
+    """
+    results = []
+    errors = []
+    for path in paths:
+        tags, error = tags_or_error(path)
+        if error:
+            errors.append(error)
+        if tags is not None:
+            results.append((path, tags))
+    return results, errors
+
+
+def audio_digest(file_path, algorithm=None, cancel_event=None):
+    """
+    pcm_identity() of the decoded audio samples, so lossless copies in any container still match
+
+    Every file gets the MD5 of its 16-bit samples, the one FLAC encoders store, so algorithm is
+    not used; it is kept for callers that pass their hasher. The MD5 in STREAMINFO only agrees
+    with the decoded one for 16-bit files, other depths are converted by the decoder.
+    """
+    if os.path.splitext(file_path)[1].lower() == ".flac":
+        # FLAC encoders store the MD5 of the samples, no need to decode
+        identity = flac_identity(file_path)
+        if identity is not None:
+            return identity
+    # Streamed in blocks, a long track never sits in memory as a whole
+    return pcm_identity(*decode_identity(file_path, cancel_event))
+
+
+class MusicScanner:
+    def __init__(self, use_metadata=True, use_hash=True, music_only=True, content="payload", cache=None,
+                 state=None, hash_algorithm=None, progress=None, on_error=None, cancel_event=None,
+                 workers=MUSIC_WORKERS, tag_processes=None, decoders=DEFAULT_DECODERS, fuzzy_metadata=False,
+                 verify_files=False):
+        """
+        Initialize the scanner
+
+        Args:
+            use_metadata (bool): Group files by (artist, title)
+            use_hash (bool): Group files by content
+            music_only (bool): Only look at files with a music extension
+            content (str): "payload" hashes the first and last MB of the audio without its tags,
+                "file" the first and last MB of the raw file, "audio" the decoded samples,
+                "fingerprint" groups near-identical recordings (needs numpy and ffmpeg)
+            cache (HashCache): Optional persistent cache for tags and digests
+            state (ScanState): Optional saved tree, rescans then only list changed folders
+            hash_algorithm (str): Registered hasher name, defaults to the benchmarked default
+            progress (callable): Optional callback progress(done, total, path), called from worker threads;
+                total is 0 while the tree is still being listed
+            on_error (callable): Optional callback on_error(message) for every entry added to errors
+            cancel_event (threading.Event): Set it to abort the scan with ScanCancelled
+            workers (int): Number of threads hashing files and looking up cached tags
+            tag_processes (int): Processes parsing uncached tags, None uses every core, 0 parses in the threads
+            decoders (int): ffmpeg processes decoding at once in "audio" and "fingerprint" mode
+            fuzzy_metadata (bool): Also group tags that only differ by featured artists, remaster notes,
+                punctuation or small typos
+            verify_files (bool): With a state, also stat files in unchanged folders to catch in-place rewrites
+        """
+        if content not in CONTENT_MODES:
+            raise ValueError(f"Unknown content mode '{content}', use one of {', '.join(CONTENT_MODES)}")
+        if content == "fingerprint" and use_hash and not fingerprints_available():
+            raise RuntimeError("Fingerprints need numpy and ffmpeg")
+        self.use_metadata = use_metadata
+        self.fuzzy_metadata = fuzzy_metadata
+        self.use_hash = use_hash
+        self.file_filter = ExtensionFilter(MUSIC_EXTENSIONS if music_only else ())
+        self.content = content
+        self.cache = cache
+        self.state = state
+        self.verify_files = verify_files
+        # Files the fast reader hands to mutagen get NO_TAGS without it, installing it must not find those cached
+        self.tags_kind = TAGS_KIND if mutagen_available() else TAGS_KIND + ":no-mutagen"
+        self.hash_algorithm = hash_algorithm or default_hasher()
+        self.progress = progress
+        self.on_error = on_error
+        self.cancel_event = cancel_event or threading.Event()
+        self.workers = max(1, workers)
+        self.decode_slots = DecoderSlots(decoders)
+        if content in ("audio", "fingerprint"):
+            # Every decoder needs a worker thread to feed it
+            self.workers = max(self.workers, self.decode_slots.decoders)
+        self.tag_processes = (os.cpu_count() or 1) if tag_processes is None else tag_processes
+        self.errors = []
+        self.hardlinks = {}         # first path -> other paths linked to the same inode
+        self.delta = None           # ScanDelta when a saved state was used
+        self.files_processed = 0
+        self.total_files = 0        # Set once the crawl is done, 0 while still listing
+        self.metadata_duplicates = {}
+        self.hash_duplicates = {}
+        self.file_sizes = {}        # path -> size for every file in a reported group
+
+    def list_files(self, folder):
+        """Collect the (hardlink-collapsed) records to scan, from the saved state if there is one"""
+        self.errors.clear()
+        self.hardlinks.clear()
+        self.delta = None
+        return list(self.iter_files(folder))
+
+    def iter_files(self, folder):
+        if self.state is not None:
+            records, self.delta = self.state.refresh(folder, self.errors, self.verify_files)
+            records = (r for r in records if self.file_filter.matches(os.path.basename(r.path)))
+        else:
+            records = crawl(folder, self.file_filter, self.errors)
+        yield from collapse_hardlinks(records, self.hardlinks)
+
+    def scan(self, folder, records=None):
+        """
+        Find duplicate music files below folder
+
+        Without records the crawl runs in its own thread and feeds a bounded queue, so the
+        workers start on the first files while the rest of the tree is still being listed.
+
+        Args:
+            folder (str): Directory to scan
+            records (list): Output of list_files(folder) if the caller already has it
+
+        Returns:
+            tuple: ({(artist, title): [paths]}, {digest: [paths]}) with only real duplicates
+        """
+        if records is None:
+            # Cleared in place, callers may hold on to these while the scan runs
+            self.errors.clear()
+            self.hardlinks.clear()
+            self.delta = None
+        by_tags = {}
+        by_content = {}
+        sizes = {}
+        # Fingerprints are matched through the LSH index instead of an exact digest
+        index = FingerprintIndex() if self.use_hash and self.content == "fingerprint" else None
+        lock = threading.Lock()
+        work = queue.Queue(maxsize=QUEUE_SIZE)
+        self.files_processed = 0
+        self.total_files = len(records) if records is not None else 0
+
+        def produce():
+            count = 0
+            try:
+                for record in (records if records is not None else self.iter_files(folder)):
+                    if self.cancel_event.is_set():
+                        break
+                    work.put(record)
+                    count += 1
+            except Exception as e:
+                self.log_error(f"Error listing {folder}: {str(e)}")
+            finally:
+                with lock:
+                    self.total_files = count
+                # One stop marker per worker; workers keep draining, so these puts can't block forever
+                for _ in range(self.workers):
+                    work.put(None)
+
+        # Uncached tags wait here until a full batch can go to the process pool
+        pending = []
+        batches = []
+        pool = None
+
+        def add_tags(file_path, metadata):
+            # Called under the lock, or after the workers have stopped
+            if metadata:
+                key = (metadata[0].lower(), metadata[1].lower())  # (artist, title)
+                by_tags.setdefault(key, []).append(file_path)
+
+        def submit(batch):
+            nonlocal pool
+            with lock:
+                if pool is None:
+                    # Started on the first cache miss, so a fully cached rescan never spawns processes
+                    pool = ProcessPoolExecutor(max_workers=self.tag_processes,
+                                               mp_context=multiprocessing.get_context(POOL_START_METHOD))
+                batches.append((batch, pool.submit(read_tags_batch, [r.path for r in batch])))
+
+        def consume():
+            while True:
+                record = work.get()
+                if record is None:
+                    return
+                if self.cancel_event.is_set():
+                    continue
+                file_path = record.path
+                metadata = None
+                batch = None
+                if self.use_metadata:
+                    if self.tag_processes > 0:
+                        metadata = self.cached_tags(record)
+                        if metadata is None:
+                            with lock:
+                                pending.append(record)
+                                if len(pending) >= TAG_BATCH:
+                                    batch = pending[:]
+                                    pending.clear()
+                    else:
+                        metadata = self.tags(record)
+                if batch:
+                    submit(batch)
+                digest = self.content_key(file_path) if self.use_hash else None
+                with lock:
+                    sizes[file_path] = record.size
+                    add_tags(file_path, metadata)
+                    if digest and index is not None:
+                        index.add(file_path, decode_vector(digest))
+                    elif digest:
+                        by_content.setdefault(digest, []).append(file_path)
+                    self.files_processed += 1
+                    done, total = self.files_processed, self.total_files
+                if self.progress:
+                    self.progress(done, total, file_path)
+
+        threads = [threading.Thread(target=produce, daemon=True)]
+        threads += [threading.Thread(target=consume, daemon=True) for _ in range(self.workers)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if pending and not self.cancel_event.is_set():
+                submit(pending[:])
+            for batch, future in batches:
+                self.check_cancelled()
+                self.merge_tag_batch(batch, future, add_tags)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        if self.cache is not None:
+            self.cache.flush()
+        self.check_cancelled()
+        if self.delta is not None:
+            self.state.save_tree(self.delta)
+
+        if self.fuzzy_metadata:
+            by_tags = fuzzy_groups(by_tags)
+        # Filter out non-duplicates; workers finish in any order, so groups are sorted for a stable report
+        self.metadata_duplicates = self.sorted_groups(by_tags)
+        if index is not None:
+            by_content = {f"fingerprint:{n}": paths for n, paths in enumerate(index.groups())}
+        self.hash_duplicates = self.sorted_groups(by_content)
+        grouped = [paths for groups in (self.metadata_duplicates, self.hash_duplicates) for paths in groups.values()]
+        self.file_sizes = {path: sizes[path] for paths in grouped for path in paths}
+        return self.metadata_duplicates, self.hash_duplicates
+
+    @staticmethod
+    def sorted_groups(groups):
+        duplicates = [(key, sorted(paths)) for key, paths in groups.items() if len(paths) > 1]
+        return dict(sorted(duplicates, key=lambda item: item[1][0]))
+
+    def merge_tag_batch(self, batch, future, add_tags):
+        """Fold one process pool result into the groups and the cache, logging its errors together"""
+        try:
+            results, errors = future.result()
+        except Exception as e:
+            # A crashed worker loses its whole batch, the files are reported instead of retried
+            results, errors = [], [f"Error reading tags of {len(batch)} files: {str(e)}"]
+        records = {record.path: record for record in batch}
+        for path, metadata in results:
+            add_tags(path, metadata)
+            if self.cache is not None:
+                self.cache.put(path, records[path], self.tags_kind, json.dumps(metadata))
+        self.log_errors(errors)
+
+    def cached_tags(self, record):
+        """Tags from the cache (NO_TAGS for files known to have none), None if they still have to be parsed"""
+        if self.cache is None:
+            return None
+        tags = self.cache.get(record.path, record, self.tags_kind)
+        return tuple(json.loads(tags)) if tags is not None else None
+
+    def tags(self, record):
+        """(artist, title, album, duration) parsed in this thread, reusing the cached tags if the file is unchanged"""
+        metadata = self.cached_tags(record)
+        if metadata is not None:
+            return metadata
+        metadata, error = tags_or_error(record.path)
+        if error:
+            self.log_error(error)
+        if metadata is not None and self.cache is not None:
+            self.cache.put(record.path, record, self.tags_kind, json.dumps(metadata))
+        return metadata
+
+    def content_kind(self):
+        if self.content == "audio":
+            return "audio:pcm-md5"
+        if self.content == "fingerprint":
+            return "fingerprint:bands-33x16"
+        if self.content == "payload":
+            return f"payload:{HEAD_TAIL_SIZE}:{self.hash_algorithm}"
+        return f"headtail:{HEAD_TAIL_SIZE}:{self.hash_algorithm}"
+
+    def content_key(self, file_path):
+        """Content digest, reusing the cached digest if the file is unchanged"""
+        if self.cache is None:
+            return self.compute_content_key(file_path)
+        return self.cache.lookup(file_path, self.content_kind(), self.compute_content_key)
+
+    def compute_content_key(self, file_path):
+        try:
+            if self.content == "audio":
+                with self.decode_slots:
+                    return audio_digest(file_path, self.hash_algorithm, self.cancel_event)
+            if self.content == "fingerprint":
+                with self.decode_slots:
+                    return encode_vector(fingerprint(file_path, self.cancel_event))
+            if self.content == "payload":
+                # Tags and cover art are skipped, so re-tagged copies still match
+                return hash_payload(file_path, self.hash_algorithm, HEAD_TAIL_SIZE)[0]
+            # Hash the first and last MB for large files or the whole file for smaller files
+            return hash_head_tail(file_path, self.hash_algorithm, HEAD_TAIL_SIZE)[0]
+        except ScanCancelled:
+            pass
+        except (FingerprintError, DecodeError) as e:
+            self.log_error(str(e))
+        except (struct.error, OSError) as e:
+            self.log_error(f"Error reading file {file_path}: {e}")
+        except Exception as e:
+            self.log_error(f"Error hashing {file_path}: {str(e)}")
+        return None
+
+    def log_error(self, message):
+        self.errors.append(message)
+        if self.on_error:
+            self.on_error(message)
+
+    def log_errors(self, messages):
+        """Log a batch of errors with a single on_error call"""
+        if not messages:
+            return
+        self.errors.extend(messages)
+        if self.on_error:
+            more = f" (and {len(messages) - 1} more)" if len(messages) > 1 else ""
+            self.on_error(messages[-1] + more)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ScanCancelled()
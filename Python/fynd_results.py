@@ -0,0 +1,118 @@
+#fynd_results
+#Duplicate groups kept for display, shared by the Qt and Tk result views.
+#The store never renders anything: filtering and sorting only reorder a
+#list of row indices, and the views ask for the few rows they show. A result
+#with 100k groups then costs one small object per group instead of a text
+#widget holding every line.
+
+import os
+
+SORT_KEYS = {
+    "group": lambda group: group.number,
+    "label": lambda group: group.label.casefold(),
+    "files": lambda group: len(group.paths),
+    "size": lambda group: group.size,
+    "wasted": lambda group: group.wasted,
+}
+
+
+class ResultGroup:
+    """One duplicate group: its files, their sizes and any hardlinks hanging off them"""
+
+    __slots__ = ("number", "kind", "label", "paths", "sizes", "hardlinks", "size", "wasted")
+
+    def __init__(self, number, kind, label, paths, sizes=None, hardlinks=None):
+        self.number = number
+        self.kind = kind
+        self.label = label
+        self.paths = paths
+        self.sizes = sizes or [0] * len(paths)
+        self.hardlinks = hardlinks or {}
+        # Keeping the largest copy, the rest is what deleting the duplicates gives back
+        self.size = max(self.sizes, default=0)
+        self.wasted = sum(self.sizes) - self.size
+
+    def matches(self, text):
+        return text in self.label.casefold() or any(text in path.casefold() for path in self.paths)
+
+
+class ResultStore:
+    def __init__(self):
+        self.groups = []
+        self.view = []              # Indices into groups, filtered and sorted
+        self.filter_text = ""
+        self.sort_column = "group"
+        self.sort_reverse = False
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, row):
+        return self.groups[self.view[row]]
+
+    def clear(self):
+        self.groups = []
+        self.view = []
+
+    def add(self, kind, label, paths, sizes=None, hardlinks=None):
+        group = ResultGroup(len(self.groups) + 1, kind, label, paths, sizes, hardlinks)
+        self.groups.append(group)
+        return group
+
+    def refresh(self):
+        """Rebuild the view after adding groups, keeping the current filter and sort"""
+        if self.filter_text:
+            self.view = [i for i, group in enumerate(self.groups) if group.matches(self.filter_text)]
+        else:
+            self.view = list(range(len(self.groups)))
+        key = SORT_KEYS[self.sort_column]
+        self.view.sort(key=lambda i: key(self.groups[i]), reverse=self.sort_reverse)
+
+    def set_filter(self, text):
+        """Only keep groups whose label or a path contains text (case-insensitive)"""
+        self.filter_text = text.strip().casefold()
+        self.refresh()
+
+    def sort(self, column, reverse=False):
+        if column not in SORT_KEYS:
+            raise ValueError(f"Unknown sort column '{column}'")
+        self.sort_column = column
+        self.sort_reverse = reverse
+        key = SORT_KEYS[column]
+        self.view.sort(key=lambda i: key(self.groups[i]), reverse=reverse)
+
+    def page_count(self, page_size):
+        return max(1, -(-len(self.view) // page_size))
+
+    def page(self, number, page_size):
+        """Groups on page number (0-based) of the current view"""
+        start = number * page_size
+        return [self.groups[i] for i in self.view[start:start + page_size]]
+
+    def wasted_bytes(self):
+        """Reclaimable bytes over the groups in the current view"""
+        return sum(self.groups[i].wasted for i in self.view)
+
+
+def music_stores(metadata_duplicates, hash_duplicates, hardlinks, sizes):
+    """
+    Result stores for a MusicScanner scan
+
+    Hardlink sets that are not part of a content group go into the content store as groups
+    with nothing to reclaim, since their files share the same data on disk.
+
+    Returns:
+        tuple: (metadata ResultStore, content ResultStore), filled but not refreshed
+    """
+    metadata = ResultStore()
+    for (artist, title), paths in metadata_duplicates.items():
+        metadata.add("metadata", f"{artist} - {title}", paths, [sizes.get(path, 0) for path in paths])
+    content = ResultStore()
+    for paths in hash_duplicates.values():
+        content.add("content", os.path.basename(paths[0]), paths, [sizes.get(path, 0) for path in paths],
+                    {path: hardlinks[path] for path in paths if path in hardlinks})
+    grouped = {path for paths in hash_duplicates.values() for path in paths}
+    for path, links in hardlinks.items():
+        if path not in grouped:
+            content.add("hardlinks", f"{os.path.basename(path)} (hardlinks)", [path] + links)
+    return metadata, content
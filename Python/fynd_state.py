@@ -0,0 +1,301 @@
+#fynd_state
+#Saved scan state for incremental rescans.
+#For every scanned root the state keeps the directory tree with each
+#directory's mtime, the file records found in it, and the duplicate groups
+#of the last scan. A rescan only lists directories whose mtime changed,
+#reuses the stored records for the rest, and reports what was added,
+#removed or changed so the duplicate groups can be patched instead of
+#rebuilt.
+#
+#A directory's mtime only changes when entries are added, removed or
+#renamed. Files rewritten in place inside an unchanged directory are
+#only noticed with verify_files=True, which costs one stat per file.
+#
+#Saved groups are only valid for the tree saved with them, so every front
+#end keeps its own state file.
+
+import os
+import time
+import sqlite3
+import threading
+from fynd_crawl import FileRecord
+
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser("~"), ".fynd_scan_state.db")
+
+
+class ScanDelta:
+    """What changed between the saved state and the tree on disk"""
+
+    def __init__(self):
+        self.added = []         # New FileRecords
+        self.removed = []       # FileRecords that are gone
+        self.changed = []       # (old, new) FileRecord pairs
+        self.dirs_listed = 0    # Directories that had to be read again
+        self.dirs_reused = 0    # Directories served from the saved state
+        self.tree = None        # New tree rows, written by ScanState.commit together with the groups
+
+    def affected_sizes(self):
+        """File sizes whose duplicate groups may have changed"""
+        sizes = {record.size for record in self.added}
+        sizes.update(record.size for record in self.removed)
+        for old, new in self.changed:
+            sizes.add(old.size)
+            sizes.add(new.size)
+        return sizes
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.changed)
+
+    def summary(self):
+        return (f"{len(self.added)} added, {len(self.removed)} removed, {len(self.changed)} changed; "
+                f"{self.dirs_listed} folders read, {self.dirs_reused} reused")
+
+
+class ScanState:
+    def __init__(self, db_path=DEFAULT_STATE_PATH):
+        """
+        Open (or create) the state database
+
+        Args:
+            db_path (str): Location of the SQLite file, ":memory:" for a throwaway state
+        """
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                parent TEXT,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (root, path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                nlink INTEGER NOT NULL,
+                PRIMARY KEY (root, dir, path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS groups (
+                root TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                group_no INTEGER NOT NULL,
+                path TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS groups_root ON groups (root);
+            CREATE TABLE IF NOT EXISTS scans (
+                root TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def has_root(self, root):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM dirs WHERE root=? LIMIT 1", (root,)).fetchone() is not None
+
+    def load_tree(self, root):
+        """Saved {dir: mtime_ns}, {parent: [child dirs]} and {dir: [FileRecord]} for root"""
+        with self.lock:
+            dirs, children, files = {}, {}, {}
+            for path, parent, mtime_ns in self.conn.execute(
+                    "SELECT path, parent, mtime_ns FROM dirs WHERE root=?", (root,)):
+                dirs[path] = mtime_ns
+                if parent is not None:
+                    children.setdefault(parent, []).append(path)
+            for folder, path, size, mtime_ns, dev, ino, nlink in self.conn.execute(
+                    "SELECT dir, path, size, mtime_ns, dev, ino, nlink FROM files WHERE root=? ORDER BY dir, path",
+                    (root,)):
+                files.setdefault(folder, []).append(FileRecord(path, size, mtime_ns, dev, ino, nlink))
+        return dirs, children, files
+
+    def refresh(self, root, errors=None, verify_files=False):
+        """
+        Compare the saved tree for root with the disk and return (records, delta)
+
+        Nothing is written until commit() stores the delta together with the new groups, so an
+        aborted scan leaves the previous tree and groups consistent with each other.
+
+        Args:
+            root (str): Directory that was (or will be) scanned
+            errors (list): Optional list collecting unreadable entries
+            verify_files (bool): Also stat files in unchanged folders to catch in-place rewrites
+
+        Returns:
+            tuple: (list of every FileRecord below root, ScanDelta)
+        """
+        root = os.path.abspath(root)
+        old_dirs, old_children, old_files = self.load_tree(root)
+        delta = ScanDelta()
+        new_dirs = {}           # dir -> (parent, mtime_ns)
+        new_files = {}          # dir -> [FileRecord]
+        relisted = []           # dirs whose rows must be rewritten
+
+        stack = [(root, None)]
+        while stack:
+            folder, parent = stack.pop()
+            try:
+                # The stat is taken before listing, so a change during the listing shows up next time
+                mtime_ns = os.stat(folder).st_mtime_ns
+            except OSError as e:
+                if errors is not None:
+                    errors.append(f"Error reading {folder}: {e}")
+                continue
+
+            if old_dirs.get(folder) == mtime_ns:
+                delta.dirs_reused += 1
+                records = old_files.get(folder, [])
+                if verify_files:
+                    records = self.verify(folder, records, delta, errors)
+                    if records is not old_files.get(folder, []):
+                        relisted.append(folder)
+                subdirs = old_children.get(folder, [])
+            else:
+                listing = self.list_folder(folder, errors)
+                if listing is None:
+                    # Keep what was saved under the old mtime, so the next run lists the folder again
+                    # instead of trusting an empty listing
+                    if folder in old_dirs:
+                        new_dirs[folder] = (parent, old_dirs[folder])
+                        new_files[folder] = old_files.get(folder, [])
+                        stack.extend((subdir, folder) for subdir in sorted(old_children.get(folder, []), reverse=True))
+                    continue
+                delta.dirs_listed += 1
+                relisted.append(folder)
+                records, subdirs = listing
+                self.diff(old_files.get(folder, []), records, delta)
+
+            new_dirs[folder] = (parent, mtime_ns)
+            new_files[folder] = records
+            stack.extend((subdir, folder) for subdir in sorted(subdirs, reverse=True))
+
+        # Folders that disappeared take their files with them
+        for folder in old_dirs:
+            if folder not in new_dirs:
+                delta.removed.extend(old_files.get(folder, []))
+
+        delta.tree = (root, old_dirs, new_dirs, new_files, relisted)
+        records = [record for folder in new_files for record in new_files[folder]]
+        return records, delta
+
+    @staticmethod
+    def list_folder(folder, errors):
+        """Read one directory: its regular files as FileRecords (sorted by path) and its subdirectories, None if it can't be listed"""
+        records, subdirs = [], []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_ino == 0:
+                                st = os.stat(entry.path, follow_symlinks=False)
+                            records.append(FileRecord.from_stat(entry.path, st))
+                    except OSError as e:
+                        if errors is not None:
+                            errors.append(f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            if errors is not None:
+                errors.append(f"Error reading {folder}: {e}")
+            return None
+        records.sort()
+        return records, subdirs
+
+    @staticmethod
+    def diff(old_records, new_records, delta):
+        old = {record.path: record for record in old_records}
+        for record in new_records:
+            previous = old.pop(record.path, None)
+            if previous is None:
+                delta.added.append(record)
+            elif previous != record:
+                delta.changed.append((previous, record))
+        delta.removed.extend(old.values())
+
+    @staticmethod
+    def verify(folder, records, delta, errors):
+        """Re-stat stored files of an unchanged folder, returns the same list object if nothing changed"""
+        fresh = []
+        dirty = False
+        for record in records:
+            try:
+                current = FileRecord.from_stat(record.path, os.stat(record.path, follow_symlinks=False))
+            except OSError as e:
+                if errors is not None:
+                    errors.append(f"Error reading {record.path}: {e}")
+                delta.removed.append(record)
+                dirty = True
+                continue
+            if current != record:
+                delta.changed.append((record, current))
+                dirty = True
+            fresh.append(current)
+        return fresh if dirty else records
+
+    def write_tree(self, root, old_dirs, new_dirs, new_files, relisted):
+        # Caller holds the lock and commits
+        gone = [folder for folder in old_dirs if folder not in new_dirs]
+        rewrite = gone + relisted
+        self.conn.executemany("DELETE FROM files WHERE root=? AND dir=?", [(root, d) for d in rewrite])
+        self.conn.executemany("DELETE FROM dirs WHERE root=? AND path=?", [(root, d) for d in gone])
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO dirs (root, path, parent, mtime_ns) VALUES (?, ?, ?, ?)",
+            [(root, d, parent, mtime_ns) for d, (parent, mtime_ns) in new_dirs.items()
+             if old_dirs.get(d) != mtime_ns])
+        self.conn.executemany(
+            "INSERT INTO files (root, dir, path, size, mtime_ns, dev, ino, nlink) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(root, d, r.path, r.size, r.mtime_ns, r.dev, r.inode, r.nlink)
+             for d in relisted for r in new_files.get(d, [])])
+
+    def save_tree(self, delta):
+        """Store only the tree read by refresh(), for callers that keep no groups here"""
+        with self.lock:
+            self.write_tree(*delta.tree)
+            self.conn.commit()
+
+    def load_groups(self, root, signature):
+        """Duplicate groups saved for root as [(size, [paths])], or None if the scan settings differ"""
+        root = os.path.abspath(root)
+        with self.lock:
+            row = self.conn.execute("SELECT signature FROM scans WHERE root=?", (root,)).fetchone()
+            if row is None or row[0] != signature:
+                return None
+            groups = {}
+            for size, group_no, path in self.conn.execute(
+                    "SELECT size, group_no, path FROM groups WHERE root=? ORDER BY group_no, path", (root,)):
+                groups.setdefault(group_no, (size, []))[1].append(path)
+        return list(groups.values())
+
+    def commit(self, root, signature, groups, delta):
+        """Store the tree read by refresh() and the groups computed from it; groups is [(size, [paths])]"""
+        root = os.path.abspath(root)
+        with self.lock:
+            self.write_tree(*delta.tree)
+            self.conn.execute("DELETE FROM groups WHERE root=?", (root,))
+            self.conn.executemany(
+                "INSERT INTO groups (root, size, group_no, path) VALUES (?, ?, ?, ?)",
+                [(root, size, group_no, path) for group_no, (size, paths) in enumerate(groups) for path in paths])
+            self.conn.execute("INSERT OR REPLACE INTO scans (root, signature, scanned_at) VALUES (?, ?, ?)",
+                              (root, signature, time.time()))
+            self.conn.commit()
+
+    def forget(self, root):
+        root = os.path.abspath(root)
+        with self.lock:
+            for table in ("dirs", "files", "groups", "scans"):
+                self.conn.execute(f"DELETE FROM {table} WHERE root=?", (root,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
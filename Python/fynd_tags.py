@@ -0,0 +1,710 @@
+#fynd_tags
+#Header-only tag reader for the music finders.
+#Artist, title, album and duration are read straight from ID3v2/ID3v1 and
+#the first MPEG frame, FLAC STREAMINFO/VORBIS_COMMENT blocks and MP4
+#moov/mvhd/ilst atoms. Cover art and audio are skipped with seeks, so only
+#a few KB are read per file. Files the fast path can't parse with confidence
+#(unsynchronised or compressed ID3 frames, ID3-prefixed FLAC, odd atoms)
+#go to mutagen, which is only imported the first time that happens.
+#
+#The same parsers locate the audio payload, so music can also be hashed
+#without its tags: ID3v2/ID3v1/APEv2/Lyrics3 tags, FLAC metadata blocks and
+#every MP4 atom but mdat are skipped, and re-tagged copies of a song match.
+#
+#Usage: python fynd_tags.py --bench-tags [--files 3000]
+
+import os
+import sys
+import time
+import struct
+import shutil
+import argparse
+import tempfile
+import importlib.util
+from fynd_hashers import new_hasher, update_from_file
+
+FRAME_READ_LIMIT = 4096             # Largest ID3 text frame / MP4 data atom read
+VORBIS_READ_LIMIT = 64 * 1024       # Largest VORBIS_COMMENT block read
+MPEG_SCAN = 4096                    # Bytes searched for the first MPEG frame after the tags
+TAGGED_EXTENSIONS = frozenset(['.mp3', '.flac', '.m4a', '.mp4'])
+
+ID3_FRAMES = {"TPE1": "artist", "TIT2": "title", "TALB": "album",
+              "TP1": "artist", "TT2": "title", "TAL": "album"}
+VORBIS_FIELDS = {"ARTIST": "artist", "TITLE": "title", "ALBUM": "album"}
+MP4_FIELDS = {b"\xa9ART": "artist", b"\xa9nam": "title", b"\xa9alb": "album"}
+
+# Bitrates in kbit/s by (MPEG1?, layer)
+MPEG_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MPEG_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+_mutagen = None
+
+
+class TagReadError(Exception):
+    """A music file whose tags could not be read, the message is shown in the error log"""
+
+
+class Unsupported(Exception):
+    """The fast reader can't handle this file, mutagen has to"""
+
+
+def read_tags(file_path):
+    """
+    Read (artist, title, album, duration) from a music file, fast path first
+
+    Returns:
+        tuple: (artist, title, album, duration in seconds), or None for formats without tag support
+    """
+    if os.path.splitext(file_path)[1].lower() not in TAGGED_EXTENSIONS:
+        return None
+    try:
+        return read_tags_fast(file_path)
+    except Unsupported:
+        return read_tags_mutagen(file_path)
+
+
+def read_tags_fast(file_path, opener=open):
+    """
+    Header-only read, raises Unsupported when mutagen should take over
+
+    Args:
+        file_path (str): Music file
+        opener (callable): open() replacement, the benchmark passes one that counts bytes
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    with opener(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if ext == ".mp3":
+            fields, duration = read_mp3(f, file_size, file_path)
+        elif ext == ".flac":
+            fields, duration = read_flac(f)
+        elif ext == ".m4a" or ext == ".mp4":
+            fields, duration = read_mp4(f, file_size)
+        else:
+            return None
+    return (fields.get("artist", "Unknown"), fields.get("title", "Unknown"),
+            fields.get("album", "Unknown"), round(duration or 0.0, 2))
+
+
+def syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def decode_id3_text(data):
+    """First value of an ID3 text frame"""
+    if not data:
+        return ""
+    encoding, body = data[0], data[1:]
+    try:
+        if encoding == 0:
+            text = body.decode('latin-1')
+        elif encoding == 1:
+            text = body.decode('utf-16')
+        elif encoding == 2:
+            text = body.decode('utf-16-be')
+        elif encoding == 3:
+            text = body.decode('utf-8')
+        else:
+            raise Unsupported()
+    except UnicodeDecodeError:
+        raise Unsupported()
+    return text.split('\x00')[0]
+
+
+def read_id3v2(f):
+    """Text fields of an ID3v2 tag at the start of f and the offset where the audio starts"""
+    f.seek(0)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return None, 0
+    major, flags = header[3], header[5]
+    size = syncsafe(header[6:10])
+    tag_end = 10 + size + (10 if flags & 0x10 else 0)
+    if major not in (2, 3, 4) or flags & 0x80:
+        # Unsynchronised tags need the whole tag de-escaped before parsing
+        raise Unsupported()
+
+    pos = 10
+    if flags & 0x40 and major >= 3:
+        ext = f.read(4)
+        pos += syncsafe(ext) if major == 4 else struct.unpack(">I", ext)[0] + 4
+    head_len = 6 if major == 2 else 10
+    fields = {}
+    while pos + head_len <= 10 + size and len(fields) < 3:
+        f.seek(pos)
+        head = f.read(head_len)
+        if len(head) < head_len or head[0] == 0:
+            break   # Padding
+        if major == 2:
+            frame_id = head[:3]
+            frame_size = int.from_bytes(head[3:6], 'big')
+            frame_flags = 0
+        else:
+            frame_id = head[:4]
+            frame_size = syncsafe(head[4:8]) if major == 4 else struct.unpack(">I", head[4:8])[0]
+            frame_flags = struct.unpack(">H", head[8:10])[0]
+        if not frame_id.isalnum():
+            # Usually a v2.4 tag written with plain sizes, mutagen knows the workarounds
+            raise Unsupported()
+        pos += head_len + frame_size
+        name = ID3_FRAMES.get(frame_id.decode('latin-1'))
+        if name is None or name in fields:
+            continue
+        # Compressed, encrypted, grouped or unsynchronised frames
+        if frame_flags & (0x00E0 if major == 3 else 0x004F) or frame_size > FRAME_READ_LIMIT:
+            raise Unsupported()
+        fields[name] = decode_id3_text(f.read(frame_size))
+    return fields, tag_end
+
+
+def read_id3v1(f, file_size):
+    if file_size < 128:
+        return None
+    f.seek(file_size - 128)
+    data = f.read(128)
+    if data[:3] != b"TAG":
+        return None
+    text = lambda raw: raw.split(b'\x00')[0].decode('latin-1').strip()
+    fields = {"title": text(data[3:33]), "artist": text(data[33:63]), "album": text(data[63:93])}
+    return {name: value for name, value in fields.items() if value}
+
+
+def mp3_duration(f, audio_start, audio_end):
+    """Duration from the Xing/Info/VBRI header of the first frame, or the bitrate for CBR files"""
+    f.seek(audio_start)
+    buf = f.read(MPEG_SCAN)
+    for i in range(len(buf) - 4):
+        if buf[i] != 0xFF or buf[i + 1] & 0xE0 != 0xE0:
+            continue
+        version = (buf[i + 1] >> 3) & 3
+        layer = 4 - ((buf[i + 1] >> 1) & 3)
+        bitrate_idx = buf[i + 2] >> 4
+        rate_idx = (buf[i + 2] >> 2) & 3
+        if version == 1 or layer == 4 or bitrate_idx in (0, 15) or rate_idx == 3:
+            continue
+        mpeg1 = version == 3
+        bitrate = MPEG_BITRATES[(mpeg1, layer)][bitrate_idx] * 1000
+        sample_rate = MPEG_SAMPLE_RATES[version][rate_idx]
+        samples = 384 if layer == 1 else (1152 if layer == 2 or mpeg1 else 576)
+        mono = (buf[i + 3] >> 6) == 3
+
+        xing = i + 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+        if buf[xing:xing + 4] in (b"Xing", b"Info") and len(buf) >= xing + 12:
+            xing_flags = struct.unpack(">I", buf[xing + 4:xing + 8])[0]
+            if xing_flags & 1:
+                frames = struct.unpack(">I", buf[xing + 8:xing + 12])[0]
+                return frames * samples / sample_rate
+        vbri = i + 36
+        if buf[vbri:vbri + 4] == b"VBRI" and len(buf) >= vbri + 18:
+            frames = struct.unpack(">I", buf[vbri + 14:vbri + 18])[0]
+            return frames * samples / sample_rate
+        return max(0, audio_end - audio_start - i) * 8 / bitrate
+    raise Unsupported()
+
+
+def read_mp3(f, file_size, file_path):
+    fields, audio_start = read_id3v2(f)
+    v1 = read_id3v1(f, file_size)
+    if fields is None and v1 is None:
+        raise TagReadError(f"No ID3 header in {file_path}")
+    # ID3v2 wins, ID3v1 fills the gaps like mutagen's merged view
+    merged = dict(v1 or {})
+    merged.update(fields or {})
+    audio_end = file_size - (128 if v1 is not None else 0)
+    return merged, mp3_duration(f, audio_start, audio_end)
+
+
+def parse_streaminfo(data):
+    """(sample_rate, channels, bits_per_sample, total_samples, md5 hex) from a 34-byte STREAMINFO block"""
+    if len(data) < 34:
+        raise Unsupported()
+    sample_rate = (data[10] << 12) | (data[11] << 4) | (data[12] >> 4)
+    channels = ((data[12] >> 1) & 7) + 1
+    bits = (((data[12] & 1) << 4) | (data[13] >> 4)) + 1
+    total_samples = ((data[13] & 0x0F) << 32) | struct.unpack(">I", data[14:18])[0]
+    return sample_rate, channels, bits, total_samples, data[18:34].hex()
+
+
+def iter_flac_blocks(f, offset=0):
+    """Yield (block_type, size) for each metadata block, f is positioned at the block data"""
+    f.seek(offset)
+    if f.read(4) != b"fLaC":
+        # ID3-prefixed FLAC and other oddities
+        raise Unsupported()
+    while True:
+        head = f.read(4)
+        if len(head) < 4:
+            raise Unsupported()
+        block_type = head[0] & 0x7F
+        size = int.from_bytes(head[1:4], 'big')
+        start = f.tell()
+        yield block_type, size
+        f.seek(start + size)
+        if head[0] & 0x80:
+            return
+
+
+def pcm_identity(md5, sample_rate, total_samples):
+    return f"pcm-md5:{md5}:{sample_rate}:{total_samples}"
+
+
+def flac_streaminfo(file_path):
+    """parse_streaminfo() of a FLAC file's STREAMINFO block, None if it can't be read"""
+    with open(file_path, 'rb') as f:
+        try:
+            _, start = read_id3v2(f)
+            for block_type, size in iter_flac_blocks(f, start):
+                # STREAMINFO is always the first block
+                return parse_streaminfo(f.read(size)) if block_type == 0 else None
+        except Unsupported:
+            return None
+    return None
+
+
+def flac_identity(file_path):
+    """
+    Content identity from the MD5 of the decoded samples the encoder stored in STREAMINFO
+
+    Returns:
+        str: pcm_identity() of the signature, or None if it is unset (all zeros) or unreadable
+    """
+    info = flac_streaminfo(file_path)
+    if info is None or info[4] == "0" * 32:
+        return None
+    sample_rate, _, _, total_samples, md5 = info
+    return pcm_identity(md5, sample_rate, total_samples)
+
+
+def read_flac(f):
+    fields = {}
+    duration = None
+    seen_comment = False
+    for block_type, size in iter_flac_blocks(f):
+        if block_type == 0:
+            sample_rate, _, _, total_samples, _ = parse_streaminfo(f.read(size))
+            duration = total_samples / sample_rate if sample_rate else 0.0
+        elif block_type == 4:
+            if size > VORBIS_READ_LIMIT:
+                raise Unsupported()
+            fields = parse_vorbis_comment(f.read(size))
+            seen_comment = True
+        if duration is not None and seen_comment:
+            break
+    return fields, duration
+
+
+def parse_vorbis_comment(data):
+    try:
+        vendor_len = struct.unpack("<I", data[:4])[0]
+        pos = 4 + vendor_len
+        count = struct.unpack("<I", data[pos:pos + 4])[0]
+        pos += 4
+        fields = {}
+        for _ in range(count):
+            length = struct.unpack("<I", data[pos:pos + 4])[0]
+            entry = data[pos + 4:pos + 4 + length].decode('utf-8')
+            pos += 4 + length
+            key, _, value = entry.partition("=")
+            name = VORBIS_FIELDS.get(key.upper())
+            if name and name not in fields:
+                fields[name] = value
+    except (struct.error, UnicodeDecodeError):
+        raise Unsupported()
+    return fields
+
+
+def iter_atoms(f, start, end):
+    """Yield (kind, data_start, atom_end) for the MP4 atoms between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Unsupported()
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def find_atom(f, start, end, kind):
+    for atom_kind, data_start, atom_end in iter_atoms(f, start, end):
+        if atom_kind == kind:
+            return data_start, atom_end
+    return None
+
+
+def read_mp4(f, file_size):
+    moov = find_atom(f, 0, file_size, b"moov")
+    if moov is None:
+        raise Unsupported()
+    fields = {}
+    duration = None
+    for kind, start, end in iter_atoms(f, *moov):
+        if kind == b"mvhd":
+            f.seek(start)
+            data = f.read(32)
+            if data[0] == 1:
+                timescale, length = struct.unpack(">IQ", data[20:32])
+            else:
+                timescale, length = struct.unpack(">II", data[12:20])
+            duration = length / timescale if timescale else 0.0
+        elif kind == b"udta":
+            meta = find_atom(f, start, end, b"meta")
+            # meta is a full atom, its children start after 4 bytes of version and flags
+            ilst = find_atom(f, meta[0] + 4, meta[1], b"ilst") if meta else None
+            if ilst:
+                fields = read_ilst(f, *ilst)
+    return fields, duration
+
+
+def read_ilst(f, start, end):
+    fields = {}
+    for kind, item_start, item_end in iter_atoms(f, start, end):
+        name = MP4_FIELDS.get(kind)
+        if name is None:
+            continue
+        data = find_atom(f, item_start, item_end, b"data")
+        if data is None or data[1] - data[0] > FRAME_READ_LIMIT:
+            raise Unsupported()
+        f.seek(data[0])
+        payload = f.read(data[1] - data[0])
+        # 4 bytes version/type, 4 bytes locale, then the text
+        try:
+            fields[name] = payload[8:].decode('utf-8')
+        except UnicodeDecodeError:
+            raise Unsupported()
+    return fields
+
+
+def trailing_tags_start(f, file_size):
+    """Offset where ID3v1, Lyrics3v2 and APEv2 tags at the end of the file begin"""
+    end = file_size
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b"TAG":
+            end -= 128
+    if end >= 15:
+        f.seek(end - 9)
+        if f.read(9) == b"LYRICS200":
+            f.seek(end - 15)
+            try:
+                end -= int(f.read(6)) + 15
+            except ValueError:
+                pass
+    if end >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b"APETAGEX":
+            size, _, flags = struct.unpack("<III", footer[12:24])
+            end -= size + (32 if flags & 0x80000000 else 0)
+    return max(0, end)
+
+
+def payload_ranges(f, file_size, ext):
+    """
+    Byte ranges holding the audio of an open music file, without any tags or cover art
+
+    Formats without a known layout get the whole file minus trailing tags.
+
+    Returns:
+        list: [(start, end)] in file order
+    """
+    end = trailing_tags_start(f, file_size)
+    start = 0
+    try:
+        if ext == ".m4a" or ext == ".mp4":
+            return [(data_start, atom_end) for kind, data_start, atom_end in iter_atoms(f, 0, file_size)
+                    if kind == b"mdat"]
+        _, start = read_id3v2(f)
+        if ext == ".flac":
+            for _ in iter_flac_blocks(f, start):
+                pass
+            start = f.tell()
+    except Unsupported:
+        # Unsynchronised ID3 still has a readable size, anything else is hashed as it is
+        f.seek(0)
+        header = f.read(10)
+        start = 10 + syncsafe(header[6:10]) if header[:3] == b"ID3" and ext == ".mp3" else 0
+    return [(start, end)] if start < end else []
+
+
+def slice_ranges(ranges, offset, length):
+    """Sub-ranges covering length bytes from offset into the concatenated ranges"""
+    result = []
+    for start, end in ranges:
+        size = end - start
+        if offset >= size:
+            offset -= size
+            continue
+        take = min(size - offset, length)
+        result.append((start + offset, start + offset + take))
+        length -= take
+        offset = 0
+        if length <= 0:
+            break
+    return result
+
+
+def hash_payload(path, algorithm, part_size):
+    """
+    Hash the first and last part_size bytes of the audio payload (all of it if shorter than both)
+
+    Returns:
+        tuple: (hexdigest, bytes_read), raises OSError if the file can't be read
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        ranges = payload_ranges(f, file_size, os.path.splitext(path)[1].lower())
+        total = sum(end - start for start, end in ranges)
+        # The payload length goes in first so truncated copies don't match on their head and tail
+        hasher.update(struct.pack(">Q", total))
+        if total > 2 * part_size:
+            ranges = slice_ranges(ranges, 0, part_size) + slice_ranges(ranges, total - part_size, part_size)
+        nbytes = 0
+        for start, end in ranges:
+            f.seek(start)
+            nbytes += update_from_file(hasher, f, end - start)
+    return hasher.hexdigest(), nbytes
+
+
+def mutagen_available():
+    """Whether mutagen is installed, without importing it"""
+    return _mutagen is not False and importlib.util.find_spec("mutagen") is not None
+
+
+def load_mutagen():
+    """Import mutagen on first use, None if it isn't installed"""
+    global _mutagen
+    if _mutagen is None:
+        try:
+            import mutagen.easyid3
+            import mutagen.mp3
+            import mutagen.flac
+            import mutagen.mp4
+            _mutagen = mutagen
+        except ImportError:
+            _mutagen = False
+    return _mutagen or None
+
+
+def read_tags_mutagen(file_path):
+    """Full mutagen read for files the fast path gave up on"""
+    mutagen = load_mutagen()
+    if mutagen is None:
+        raise TagReadError(f"mutagen is not installed, tags of {file_path} can't be read")
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".mp3":
+        try:
+            audio = mutagen.mp3.MP3(file_path, ID3=mutagen.easyid3.EasyID3)
+        except Exception:
+            raise TagReadError(f"Error reading MP3 file {file_path}")
+        if audio.tags is None:
+            raise TagReadError(f"No ID3 header in {file_path}")
+    elif ext == ".flac":
+        try:
+            audio = mutagen.flac.FLAC(file_path)
+        except Exception:
+            raise TagReadError(f"Error reading FLAC file {file_path}")
+    elif ext == ".m4a" or ext == ".mp4":
+        try:
+            audio = mutagen.mp4.MP4(file_path)
+        except Exception:
+            raise TagReadError(f"Error reading MP4/M4A file {file_path}")
+    else:
+        return None
+
+    # Different files might have different tag structures
+    try:
+        if ext == ".mp4" or ext == ".m4a":
+            artist = audio.get('\xa9ART', ['Unknown'])[0]
+            title = audio.get('\xa9nam', ['Unknown'])[0]
+            album = audio.get('\xa9alb', ['Unknown'])[0]
+        else:
+            artist = audio.get('artist', ['Unknown'])[0]
+            title = audio.get('title', ['Unknown'])[0]
+            album = audio.get('album', ['Unknown'])[0]
+    except (struct.error, IndexError) as e:
+        # Handle "unpack requires a buffer of 4 bytes" and similar errors
+        raise TagReadError(f"Error unpacking metadata in {file_path}: {e}")
+    duration = round(getattr(audio.info, "length", 0.0) or 0.0, 2)
+    return artist, title, album, duration
+
+
+def id3_text_frame(frame_id, text, major=3):
+    data = b"\x03" + text.encode('utf-8') if major == 4 else b"\x01" + text.encode('utf-16')
+    size = len(data)
+    size_bytes = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F]) \
+        if major == 4 else struct.pack(">I", size)
+    return frame_id + size_bytes + b"\x00\x00" + data
+
+
+def make_mp3(path, artist, title, album, art_size, unsync=False):
+    """ID3v2.3 tag with cover art in front of the text frames, a Xing frame and some CBR frames"""
+    art = b"\x00image/jpeg\x00\x03\x00" + os.urandom(art_size)
+    frames = (b"APIC" + struct.pack(">I", len(art)) + b"\x00\x00" + art +
+              id3_text_frame(b"TPE1", artist) + id3_text_frame(b"TIT2", title) + id3_text_frame(b"TALB", album))
+    size = len(frames) + 256
+    header = b"ID3\x03\x00" + bytes([0x80 if unsync else 0]) + bytes(
+        [(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    # MPEG1 layer III, 128 kbit/s, 44.1 kHz, stereo: 417 byte frames
+    frame = bytearray(417)
+    frame[:4] = b"\xff\xfb\x90\x00"
+    xing = bytearray(frame)
+    xing[36:48] = b"Xing" + struct.pack(">II", 1, 2000)
+    with open(path, 'wb') as f:
+        f.write(header + frames + b"\x00" * 256 + bytes(xing) + bytes(frame) * 200)
+
+
+def make_flac(path, artist, title, album, art_size):
+    """STREAMINFO, a PICTURE block and a VORBIS_COMMENT after it, followed by fake frames"""
+    sample_rate, total = 44100, 44100 * 180
+    info = bytearray(34)
+    info[10] = sample_rate >> 12
+    info[11] = (sample_rate >> 4) & 0xFF
+    info[12] = ((sample_rate & 0x0F) << 4) | (1 << 1) | 0
+    info[13] = (15 << 4) | ((total >> 32) & 0x0F)
+    info[14:18] = struct.pack(">I", total & 0xFFFFFFFF)
+    info[18:34] = os.urandom(16)
+    comments = [f"ARTIST={artist}", f"TITLE={title}", f"ALBUM={album}"]
+    vendor = b"fynd"
+    comment = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for entry in comments:
+        raw = entry.encode('utf-8')
+        comment += struct.pack("<I", len(raw)) + raw
+    picture = os.urandom(art_size)
+    block = lambda kind, data, last=False: bytes([kind | (0x80 if last else 0)]) + len(data).to_bytes(3, 'big') + data
+    with open(path, 'wb') as f:
+        f.write(b"fLaC" + block(0, bytes(info)) + block(6, picture) + block(4, comment, last=True) + os.urandom(64 * 1024))
+
+
+def make_m4a(path, artist, title, album, mdat_size):
+    """ftyp, a big mdat and the moov (mvhd + udta/meta/ilst) at the end, like many encoders write it"""
+    atom = lambda kind, data: struct.pack(">I", len(data) + 8) + kind + data
+    text = lambda kind, value: atom(kind, atom(b"data", struct.pack(">II", 1, 0) + value.encode('utf-8')))
+    mvhd = atom(b"mvhd", b"\x00" * 12 + struct.pack(">II", 1000, 180000) + b"\x00" * 80)
+    ilst = atom(b"ilst", text(b"\xa9ART", artist) + text(b"\xa9nam", title) + text(b"\xa9alb", album))
+    meta = atom(b"meta", b"\x00\x00\x00\x00" + atom(b"hdlr", b"\x00" * 25) + ilst)
+    moov = atom(b"moov", mvhd + atom(b"udta", meta))
+    with open(path, 'wb') as f:
+        f.write(atom(b"ftyp", b"M4A \x00\x00\x00\x00") + atom(b"mdat", os.urandom(mdat_size)) + moov)
+
+
+def make_tag_corpus(folder, files, art_size=100 * 1024, fallback_share=0.05):
+    """Equal parts MP3, FLAC and M4A with cover art; fallback_share of the MP3s use unsynchronisation"""
+    paths = []
+    for i in range(files):
+        artist, title, album = f"Artist {i % 97}", f"Title {i}", f"Album {i % 13}"
+        kind = i % 3
+        if kind == 0:
+            path = os.path.join(folder, f"track_{i}.mp3")
+            make_mp3(path, artist, title, album, art_size, unsync=(i // 3) % round(1 / fallback_share) == 0)
+        elif kind == 1:
+            path = os.path.join(folder, f"track_{i}.flac")
+            make_flac(path, artist, title, album, art_size)
+        else:
+            path = os.path.join(folder, f"track_{i}.m4a")
+            make_m4a(path, artist, title, album, art_size)
+        paths.append(path)
+    return paths
+
+
+class CountingFile:
+    """File wrapper that counts bytes read, for the benchmark"""
+
+    def __init__(self, path, mode, counter):
+        self.f = open(path, mode)
+        self.counter = counter
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.counter[0] += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+def bench_tags(files=3000, folder=None):
+    """Time the fast reader (with fallback) against mutagen alone over a synthetic tagged corpus"""
+    own_folder = folder is None
+    folder = folder or tempfile.mkdtemp(prefix="fynd_tags_")
+    try:
+        paths = make_tag_corpus(folder, files)
+        counter = [0]
+        fallbacks = 0
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                read_tags_fast(path, opener=lambda p, mode: CountingFile(p, mode, counter))
+            except Unsupported:
+                fallbacks += 1
+                try:
+                    read_tags_mutagen(path)
+                except TagReadError:
+                    pass
+        fast = time.perf_counter() - start
+        results = {"files": len(paths), "fast_seconds": fast, "fallbacks": fallbacks,
+                   "fallback_rate": fallbacks / len(paths), "bytes_per_file": counter[0] / len(paths),
+                   "mutagen_seconds": None}
+        if load_mutagen() is not None:
+            start = time.perf_counter()
+            for path in paths:
+                try:
+                    read_tags_mutagen(path)
+                except TagReadError:
+                    pass
+            results["mutagen_seconds"] = time.perf_counter() - start
+        return results
+    finally:
+        if own_folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Header-only tag reader for the Fynd music finders")
+    parser.add_argument("--bench-tags", action="store_true", help="compare the fast reader with mutagen")
+    parser.add_argument("--files", type=int, default=3000, help="size of the synthetic corpus")
+    parser.add_argument("paths", nargs="*", help="files to read tags from")
+    args = parser.parse_args(argv)
+
+    if args.bench_tags:
+        r = bench_tags(args.files)
+        print(f"fast path: {r['files']} files in {r['fast_seconds']:.3f} s "
+              f"({r['files'] / max(r['fast_seconds'], 1e-9):.0f} files/s, {r['bytes_per_file'] / 1024:.1f} KB read per file)")
+        print(f"fallback to mutagen: {r['fallbacks']} files ({r['fallback_rate']:.1%})")
+        if r["mutagen_seconds"] is None:
+            print("mutagen is not installed, no comparison")
+        else:
+            print(f"mutagen:   {r['files']} files in {r['mutagen_seconds']:.3f} s "
+                  f"(fast path is {r['mutagen_seconds'] / max(r['fast_seconds'], 1e-9):.1f}x faster)")
+        return 0
+
+    for path in args.paths:
+        try:
+            print(f"{path}: {read_tags(path)}")
+        except (TagReadError, OSError) as e:
+            print(f"{path}: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#fynd_tkviews
+#Paged Treeview of duplicate groups for DooPhynd and PyDoopFynd_FH.
+#Only one page of groups exists as tree items at a time, and the files of a
+#group are inserted when it is opened. Clicking a heading sorts the whole
+#ResultStore and typing in the filter box narrows it; either way only the
+#visible page is redrawn.
+
+import tkinter as tk
+from tkinter import ttk
+from fynd_engine import format_size
+from fynd_results import ResultStore
+
+PAGE_SIZE = 200             # Groups per page
+FILTER_DELAY_MS = 250       # Typing pause before the filter is applied
+
+# (column, heading, width); the tree column shows the group label
+COLUMNS = (("group", "#", 60), ("files", "Files", 60), ("size", "Size", 90), ("wasted", "Wasted", 90))
+LARGEST_FIRST = ("files", "size", "wasted")
+
+
+class PagedResultsView(ttk.Frame):
+    def __init__(self, parent, store=None, page_size=PAGE_SIZE, headings=None, style=None, **kwargs):
+        """
+        Build the view, empty until show() is called
+
+        Args:
+            parent: Tk container
+            store (ResultStore): Groups to show, a new empty store if None
+            page_size (int): Groups per page
+            headings (dict): Column titles overriding the defaults, "label" names the tree column
+            style (str): ttk style for the Treeview
+        """
+        super().__init__(parent, **kwargs)
+        self.store = store if store is not None else ResultStore()
+        self.page_size = page_size
+        self.page_number = 0
+        self.filter_job = None
+        self.pages = {}             # tree item -> group on the current page
+        self.loaded = set()         # Opened groups whose files are already in the tree
+        headings = {"label": "Group", **{name: title for name, title, _ in COLUMNS}, **(headings or {})}
+
+        top = ttk.Frame(self)
+        top.pack(fill=tk.X, pady=(0, 2))
+        ttk.Label(top, text="Filter:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", self.schedule_filter)
+        ttk.Entry(top, textvariable=self.filter_var, width=30).pack(side=tk.LEFT, padx=4)
+        self.summary_var = tk.StringVar()
+        ttk.Label(top, textvariable=self.summary_var).pack(side=tk.LEFT, padx=8)
+
+        body = ttk.Frame(self)
+        body.pack(fill=tk.BOTH, expand=True)
+        options = {"style": style} if style else {}
+        self.tree = ttk.Treeview(body, columns=[name for name, _, _ in COLUMNS], show="tree headings", **options)
+        self.tree.heading("#0", text=headings["label"], command=lambda: self.sort_by("label"))
+        self.tree.column("#0", width=360, stretch=True)
+        for name, _, width in COLUMNS:
+            self.tree.heading(name, text=headings[name], command=lambda name=name: self.sort_by(name))
+            self.tree.column(name, width=width, stretch=False, anchor=tk.E)
+        scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.bind("<<TreeviewOpen>>", self.open_group)
+
+        bottom = ttk.Frame(self)
+        bottom.pack(fill=tk.X, pady=(2, 0))
+        self.prev_button = ttk.Button(bottom, text="< Prev", command=lambda: self.go_to(self.page_number - 1))
+        self.prev_button.pack(side=tk.LEFT)
+        self.page_var = tk.StringVar()
+        ttk.Label(bottom, textvariable=self.page_var).pack(side=tk.LEFT, padx=8)
+        self.next_button = ttk.Button(bottom, text="Next >", command=lambda: self.go_to(self.page_number + 1))
+        self.next_button.pack(side=tk.LEFT)
+        self.render()
+
+    def show(self, message="", store=None):
+        """Redraw after the store was filled (or replaced by store), message is shown when there are no groups"""
+        if store is not None:
+            self.store = store
+        self.store.refresh()
+        self.page_number = 0
+        self.render(message)
+
+    def clear(self):
+        self.store.clear()
+        self.page_number = 0
+        self.render()
+
+    def render(self, message=""):
+        self.tree.delete(*self.tree.get_children())
+        self.pages = {}
+        self.loaded = set()
+        for group in self.store.page(self.page_number, self.page_size):
+            item = self.tree.insert("", tk.END, text=group.label, values=(
+                group.number, len(group.paths), format_size(group.size), format_size(group.wasted)))
+            # Placeholder child so the group can be opened, the files are inserted on demand
+            self.tree.insert(item, tk.END, text="...")
+            self.pages[item] = group
+        pages = self.store.page_count(self.page_size)
+        self.page_var.set(f"Page {self.page_number + 1} of {pages}")
+        self.prev_button.state(["!disabled"] if self.page_number > 0 else ["disabled"])
+        self.next_button.state(["!disabled"] if self.page_number + 1 < pages else ["disabled"])
+        if not self.store.groups:
+            self.summary_var.set(message)
+        else:
+            self.summary_var.set(f"{len(self.store)} groups, {format_size(self.store.wasted_bytes())} reclaimable")
+
+    def open_group(self, event=None):
+        item = self.tree.focus()
+        group = self.pages.get(item)
+        if group is None or item in self.loaded:
+            return
+        self.loaded.add(item)
+        self.tree.delete(*self.tree.get_children(item))
+        for path, size in zip(group.paths, group.sizes):
+            child = self.tree.insert(item, tk.END, text=path, values=("", "", format_size(size), ""))
+            for link in group.hardlinks.get(path, []):
+                self.tree.insert(child, tk.END, text=f"= hardlink: {link}")
+            if group.hardlinks.get(path):
+                self.tree.item(child, open=True)
+
+    def go_to(self, page_number):
+        self.page_number = max(0, min(page_number, self.store.page_count(self.page_size) - 1))
+        self.render()
+
+    def sort_by(self, column):
+        # Clicking the same heading again flips the order
+        if self.store.sort_column == column:
+            reverse = not self.store.sort_reverse
+        else:
+            reverse = column in LARGEST_FIRST
+        self.store.sort(column, reverse)
+        self.page_number = 0
+        self.render()
+
+    def schedule_filter(self, *args):
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(FILTER_DELAY_MS, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_job = None
+        self.store.set_filter(self.filter_var.get())
+        self.page_number = 0
+        self.render()